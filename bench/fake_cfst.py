@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+模拟 cfst 二进制，用于基准测试
+
+接受与 cfst 相同的参数（-f/-o/-cfcolo/-dn/-p/-dd/...），输出同列格式的合成CSV。
+环境变量：
+    FAKE_CFST_ROWS   每次输出的行数（默认200）
+    FAKE_CFST_DELAY  模拟测试耗时（秒，默认0）
+    FAKE_CFST_SEED   随机种子（默认固定为 1，便于复现）
+"""
+
+import csv
+import ipaddress
+import os
+import random
+import sys
+import time
+
+CSV_HEADER = ["IP 地址", "已发送", "已接收", "丢包率", "平均延迟", "下载速度 (MB/s)", "地区码(Colo)"]
+
+def parse_args(argv):
+    """解析 cfst 风格的单横线参数"""
+    opts = {}
+    i = 0
+    while i < len(argv):
+        key = argv[i].lstrip("-")
+        if i + 1 < len(argv) and not argv[i + 1].startswith("-"):
+            opts[key] = argv[i + 1]
+            i += 2
+        else:
+            opts[key] = True
+            i += 1
+    return opts
+
+def read_ips(ip_file, limit):
+    """读取候选文件中的单个IP，CIDR按顺序取地址"""
+    ips = []
+    if not ip_file or not os.path.exists(ip_file):
+        return ips
+    with open(ip_file, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            network = ipaddress.ip_network(line, strict=False)
+            for offset in range(min(network.num_addresses, limit - len(ips))):
+                ips.append(str(network.network_address + offset))
+            if len(ips) >= limit:
+                break
+    return ips
+
+def generate_rows(ips, colos, rows, download, rng):
+    """生成按延迟排序的结果行；下载模式下附带速度"""
+    data = []
+    for i in range(rows):
+        ip = ips[i] if i < len(ips) else f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+        sent = 4
+        received = sent - (1 if rng.random() < 0.05 else 0)
+        speed = rng.uniform(1, 60) if download else 0.0
+        data.append([ip, sent, received, f"{1 - received / sent:.2f}",
+                     f"{rng.uniform(30, 300):.2f}", f"{speed:.2f}", colos[i % len(colos)]])
+    data.sort(key=lambda row: float(row[4]))
+    return data
+
+def main(argv=None):
+    opts = parse_args(sys.argv[1:] if argv is None else argv)
+    rows = int(os.getenv("FAKE_CFST_ROWS", "200"))
+    delay = float(os.getenv("FAKE_CFST_DELAY", "0"))
+    rng = random.Random(int(os.getenv("FAKE_CFST_SEED", "1")))
+    colos = str(opts.get("cfcolo", "HKG")).split(",")
+    download = "dd" not in opts
+    ips = read_ips(opts.get("f"), rows)
+    if download:
+        rows = min(rows, len(ips)) if ips else rows
+
+    time.sleep(delay)
+    output = opts.get("o", "result.csv")
+    with open(output, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        writer.writerows(generate_rows(ips, colos, rows, download, rng))
+    print(f"fake cfst: {rows} rows -> {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
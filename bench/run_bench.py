@@ -0,0 +1,183 @@
+"""
+cfst.py → ddns.py → git → Telegram 全流程基准测试
+
+在临时工作区中运行各阶段，cfst 二进制由 fake_cfst.py 替代，
+Cloudflare DNS API 与 Telegram Worker 由本地替身服务提供，不访问任何真实服务。
+报告每个阶段的耗时、API调用次数、Telegram消息数与子进程峰值内存(RSS)。
+
+用法：
+    python bench/run_bench.py --rows 5000 --colos HKG,LAX,NRT
+    python bench/run_bench.py --json bench_output.json
+    python bench/run_bench.py --baseline bench_baseline.json --tolerance 0.25
+"""
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+BENCH_DIR = Path(__file__).parent.resolve()
+REPO_DIR = BENCH_DIR.parent
+sys.path.insert(0, str(BENCH_DIR))
+
+from standin import start_standin  # noqa: E402
+
+WORKSPACE_FILES = ["cfst.py", "ddns.py", "delete_dns.py", "ip_checker.py",
+                   "ipv4.txt", "ipv6.txt", "proxy.txt"]
+WORKSPACE_DIRS = ["cfst_lib", "speed"]
+
+def prepare_workspace(root: Path) -> Path:
+    """复制运行所需文件并初始化带本地远端的git仓库"""
+    work = root / "work"
+    work.mkdir()
+    for name in WORKSPACE_FILES:
+        shutil.copy2(REPO_DIR / name, work / name)
+    for name in WORKSPACE_DIRS:
+        shutil.copytree(REPO_DIR / name, work / name,
+                        ignore=shutil.ignore_patterns("__pycache__"))
+
+    remote = root / "remote.git"
+    git = ["git", "-c", "user.name=bench", "-c", "user.email=bench@localhost"]
+    subprocess.run(["git", "init", "-q", "--bare", str(remote)], check=True)
+    subprocess.run(["git", "init", "-q"], cwd=work, check=True)
+    subprocess.run(["git", "remote", "add", "origin", str(remote)], cwd=work, check=True)
+    subprocess.run(["git", "add", "."], cwd=work, check=True)
+    subprocess.run(git + ["commit", "-q", "-m", "bench baseline"], cwd=work, check=True)
+    subprocess.run(["git", "push", "-q", "-u", "origin", "HEAD"], cwd=work, check=True,
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return work
+
+def build_env(base_url: str, rows: int, delay: float) -> dict:
+    env = dict(os.environ)
+    env.update({
+        "CFST_BINARY": str(BENCH_DIR / "fake_cfst.py"),
+        "FAKE_CFST_ROWS": str(rows),
+        "FAKE_CFST_DELAY": str(delay),
+        "CLOUDFLARE_API_BASE": f"{base_url}/client/v4/",
+        "CLOUDFLARE_EMAIL": "bench@localhost",
+        "CLOUDFLARE_API_KEY": "bench",
+        "CLOUDFLARE_ZONE_ID": "benchzone",
+        "CF_WORKER_URL": f"{base_url}/tg",
+        "TELEGRAM_BOT_TOKEN": "bench",
+        "TELEGRAM_CHAT_ID": "0",
+        "SECRET_TOKEN": "",
+        "GIT_AUTHOR_NAME": "bench", "GIT_AUTHOR_EMAIL": "bench@localhost",
+        "GIT_COMMITTER_NAME": "bench", "GIT_COMMITTER_EMAIL": "bench@localhost",
+        "PYTHONUNBUFFERED": "1",
+    })
+    return env
+
+def run_measured(cmd, cwd: Path, env: dict, log_file) -> dict:
+    """运行子进程，返回耗时、退出码与峰值RSS（含其子进程）"""
+    start = time.perf_counter()
+    proc = subprocess.Popen(cmd, cwd=cwd, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+    _, status, usage = os.wait4(proc.pid, 0)
+    proc.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, "waitstatus_to_exitcode") else status >> 8
+    return {
+        "wall_s": round(time.perf_counter() - start, 4),
+        "exit_code": proc.returncode,
+        "peak_rss_kb": usage.ru_maxrss,
+    }
+
+def run_stage(name: str, cmd, work: Path, env: dict, state, log_file) -> dict:
+    before = state.stats()
+    log_file.write(f"\n===== {name}: {' '.join(map(str, cmd))} =====\n".encode())
+    log_file.flush()
+    result = run_measured(cmd, work, env, log_file)
+    after = state.stats()
+    result.update({
+        "stage": name,
+        "api_calls": after["api_calls"] - before["api_calls"],
+        "telegram_messages": after["telegram_messages"] - before["telegram_messages"],
+    })
+    return result
+
+def run_benchmark(rows: int, colos: list, delay: float, api_delay: float, log_path: Path) -> list:
+    server, state, base_url = start_standin(delay=api_delay)
+    root = Path(tempfile.mkdtemp(prefix="cfst-bench-"))
+    try:
+        work = prepare_workspace(root)
+        env = build_env(base_url, rows, delay)
+        colo_arg = ",".join(colos)
+        tg_snippet = (
+            "import os; from cfst_lib.tg import send_telegram_message; "
+            "send_telegram_message(os.getenv('CF_WORKER_URL'), os.getenv('TELEGRAM_BOT_TOKEN'), "
+            "os.getenv('TELEGRAM_CHAT_ID'), 'bench message')"
+        )
+        stages = [
+            ("cfst_binary", [sys.executable, str(BENCH_DIR / "fake_cfst.py"), "-f", "ipv4.txt",
+                             "-o", "bench_result.csv", "-cfcolo", colos[0], "-httping"]),
+            ("ddns", [sys.executable, "-u", "ddns.py", "-t", "ipv4", "--colos", colo_arg]),
+            ("git_push", ["sh", "-c", "date > bench_marker && git add . && "
+                                      "git commit -q -m bench && git push -q -f"]),
+            ("telegram", [sys.executable, "-c", tg_snippet]),
+            ("pipeline", [sys.executable, "cfst.py", "-t", "ipv4", "-c", colo_arg, "--git-commit"]),
+        ]
+        results = []
+        with open(log_path, "wb") as log_file:
+            for name, cmd in stages:
+                results.append(run_stage(name, cmd, work, env, state, log_file))
+        return results
+    finally:
+        server.shutdown()
+        shutil.rmtree(root, ignore_errors=True)
+
+def print_report(results: list):
+    print(f"{'阶段':<14}{'耗时(s)':>10}{'API调用':>10}{'TG消息':>8}{'峰值RSS(MB)':>14}{'退出码':>8}")
+    for r in results:
+        print(f"{r['stage']:<14}{r['wall_s']:>10.3f}{r['api_calls']:>10}{r['telegram_messages']:>8}"
+              f"{r['peak_rss_kb'] / 1024:>14.1f}{r['exit_code']:>8}")
+
+def compare_baseline(results: list, baseline: list, tolerance: float) -> list:
+    """与基线比较，返回回归描述列表（耗时超出容差或API调用次数增加）"""
+    base = {r["stage"]: r for r in baseline}
+    regressions = []
+    for r in results:
+        b = base.get(r["stage"])
+        if not b:
+            continue
+        if r["wall_s"] > b["wall_s"] * (1 + tolerance):
+            regressions.append(f"{r['stage']}: 耗时 {b['wall_s']:.3f}s -> {r['wall_s']:.3f}s")
+        if r["api_calls"] > b["api_calls"]:
+            regressions.append(f"{r['stage']}: API调用 {b['api_calls']} -> {r['api_calls']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="cfst 全流程基准测试")
+    parser.add_argument("--rows", type=int, default=1000, help="fake cfst 每次输出的行数")
+    parser.add_argument("--colos", default="HKG,LAX,NRT", help="测试的colo列表")
+    parser.add_argument("--delay", type=float, default=0.0, help="fake cfst 每次运行的模拟耗时（秒）")
+    parser.add_argument("--api-delay", type=float, default=0.0, help="替身API每个请求的模拟延迟（秒）")
+    parser.add_argument("--json", help="将结果写入JSON文件")
+    parser.add_argument("--log", default=str(REPO_DIR / "bench_output.txt"), help="子进程输出日志")
+    parser.add_argument("--baseline", help="基线JSON文件，用于回归检测")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="耗时回归容差（比例）")
+    args = parser.parse_args()
+
+    colos = [c.strip().upper() for c in args.colos.split(",") if c.strip()]
+    results = run_benchmark(args.rows, colos, args.delay, args.api_delay, Path(args.log))
+    print_report(results)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+    failed = [r["stage"] for r in results if r["exit_code"] != 0]
+    if failed:
+        print(f"阶段执行失败: {', '.join(failed)}（详见 {args.log}）")
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            regressions = compare_baseline(results, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"回归: {line}")
+        if regressions:
+            return 1
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,215 @@
+"""
+本地 Cloudflare DNS API 与 Telegram Worker 替身服务
+
+路由：
+    GET/POST         /client/v4/zones/<zone>/dns_records
+    GET/PATCH/DELETE /client/v4/zones/<zone>/dns_records/<id>
+    POST             /client/v4/zones/<zone>/dns_records/batch   批量变更（事务执行）
+    POST             /tg                  Telegram 转发 Worker
+    GET              /__stats             请求计数
+    POST             /__reset             清空计数与记录
+
+可通过 delay 参数为每个请求注入固定延迟，模拟真实网络往返。
+"""
+
+import json
+import re
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+RECORDS_RE = re.compile(r"^/client/v4/zones/([^/]+)/dns_records/?$")
+BATCH_RE = re.compile(r"^/client/v4/zones/([^/]+)/dns_records/batch$")
+RECORD_RE = re.compile(r"^/client/v4/zones/([^/]+)/dns_records/([^/]+)$")
+
+class StandInState:
+    """替身服务的共享状态"""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.lock = threading.Lock()
+        self.records = {}
+        self.calls = Counter()
+        self.messages = []
+
+    def reset(self):
+        with self.lock:
+            self.records.clear()
+            self.calls.clear()
+            self.messages.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "calls": dict(self.calls),
+                "api_calls": sum(v for k, v in self.calls.items() if k.startswith("api ")),
+                "telegram_messages": len(self.messages),
+                "records": len(self.records),
+            }
+
+class StandInHandler(BaseHTTPRequestHandler):
+    state: StandInState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, payload: dict):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return None
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return None
+
+    def _ok(self, result, **extra):
+        payload = {"success": True, "errors": [], "messages": [], "result": result}
+        payload.update(extra)
+        self._send(200, payload)
+
+    def _not_found(self):
+        self._send(404, {"success": False, "errors": [{"code": 81044, "message": "Record not found"}]})
+
+    def _count(self, key: str):
+        with self.state.lock:
+            self.state.calls[key] += 1
+        if self.state.delay:
+            time.sleep(self.state.delay)
+
+    def _handle(self, method: str):
+        url = urlparse(self.path)
+        state = self.state
+        body = self._body()
+
+        if url.path == "/__stats":
+            return self._send(200, state.stats())
+        if url.path == "/__reset":
+            state.reset()
+            return self._send(200, {"success": True})
+        if url.path.rstrip("/") == "/tg":
+            self._count("telegram")
+            with state.lock:
+                state.messages.append((body or {}).get("message", ""))
+            return self._send(200, {"ok": True})
+
+        if method == "POST" and BATCH_RE.match(url.path):
+            self._count("api POST dns_records/batch")
+            return self._batch(body or {})
+        match = RECORDS_RE.match(url.path)
+        if match:
+            self._count(f"api {method} dns_records")
+            if method == "GET":
+                return self._list_records(parse_qs(url.query))
+            if method == "POST":
+                return self._ok(self._create(body or {}))
+        match = RECORD_RE.match(url.path)
+        if match:
+            record_id = match.group(2)
+            self._count(f"api {method} dns_record")
+            with state.lock:
+                record = state.records.get(record_id)
+                if record is None:
+                    return self._not_found()
+                if method == "DELETE":
+                    del state.records[record_id]
+                    return self._ok({"id": record_id})
+                if method in ("PATCH", "PUT"):
+                    record.update({k: v for k, v in (body or {}).items() if k != "id"})
+                return self._ok(dict(record))
+        self._send(404, {"success": False, "errors": [{"message": f"unknown route {url.path}"}]})
+
+    def _create(self, data: dict) -> dict:
+        record = {
+            "id": uuid.uuid4().hex,
+            "type": data.get("type", "A"),
+            "name": data.get("name", ""),
+            "content": data.get("content", ""),
+            "ttl": data.get("ttl", 1),
+            "proxied": data.get("proxied", False),
+        }
+        with self.state.lock:
+            self.state.records[record["id"]] = record
+        return dict(record)
+
+    def _batch(self, body: dict):
+        """与 Cloudflare 一致：按 deletes → patches → puts → posts 顺序执行，任一项失败则整体回滚"""
+        state = self.state
+        with state.lock:
+            snapshot = {k: dict(v) for k, v in state.records.items()}
+            result = {"deletes": [], "patches": [], "puts": [], "posts": []}
+            for action in ("deletes", "patches", "puts"):
+                for item in body.get(action) or []:
+                    record = state.records.get(item.get("id"))
+                    if record is None:
+                        state.records = snapshot
+                        return self._not_found()
+                    if action == "deletes":
+                        del state.records[item["id"]]
+                    else:
+                        record.update({k: v for k, v in item.items() if k != "id"})
+                    result[action].append(dict(record))
+        for item in body.get("posts") or []:
+            result["posts"].append(self._create(item))
+        self._ok(result)
+
+    def _list_records(self, query: dict):
+        """与 Cloudflare 一致：仅处理查询字符串中的过滤条件，并分页"""
+        page = int(query.get("page", ["1"])[0])
+        per_page = int(query.get("per_page", ["100"])[0])
+        with self.state.lock:
+            records = [dict(r) for r in self.state.records.values()
+                       if ("type" not in query or r["type"] == query["type"][0])
+                       and ("name" not in query or r["name"] == query["name"][0])]
+        start = (page - 1) * per_page
+        total_pages = max(1, -(-len(records) // per_page))
+        self._ok(records[start:start + per_page], result_info={
+            "page": page, "per_page": per_page, "count": len(records[start:start + per_page]),
+            "total_count": len(records), "total_pages": total_pages})
+
+    def do_GET(self):
+        self._handle("GET")
+
+    def do_POST(self):
+        self._handle("POST")
+
+    def do_PUT(self):
+        self._handle("PUT")
+
+    def do_PATCH(self):
+        self._handle("PATCH")
+
+    def do_DELETE(self):
+        self._handle("DELETE")
+
+def start_standin(host: str = "127.0.0.1", port: int = 0, delay: float = 0.0):
+    """在后台线程启动替身服务，返回 (server, state, base_url)"""
+    state = StandInState(delay)
+    handler = type("BoundStandInHandler", (StandInHandler,), {"state": state})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, state, f"http://{host}:{server.server_address[1]}"
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Cloudflare API / Telegram Worker 替身服务")
+    parser.add_argument("--port", type=int, default=8787)
+    parser.add_argument("--delay", type=float, default=0.0, help="每个请求注入的延迟（秒）")
+    args = parser.parse_args()
+    server, _, base_url = start_standin(port=args.port, delay=args.delay)
+    print(f"替身服务已启动: {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
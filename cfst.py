@@ -23,7 +23,13 @@ import json
 import argparse
 import requests
 import subprocess
+import sqlite3
+import threading
+import time
 import unittest
+import contextlib
+import tempfile
+import concurrent.futures
 from pathlib import Path
 from datetime import datetime
 from dotenv import load_dotenv
@@ -32,8 +38,15 @@ from unittest.mock import patch, Mock
 from subprocess import CompletedProcess
 
 # 从本地模块导入
-from py.colo_emojis import colo_emojis
-from py.tg import send_telegram_message
+from cfst_lib.colo_emojis import colo_emojis
+from cfst_lib.tg import queue_telegram_message
+from cfst_lib import httping
+from cfst_lib.cidr_sampler import CIDRSampler, DEFAULT_PER_PREFIX, DEFAULT_STRATUM
+from cfst_lib.probe_store import ProbeStore
+from cfst_lib import ranking
+from cfst_lib.metrics import RunMetrics
+from cfst_lib.run_lock import RunLock, file_lock
+import ddns
 
 # ---------------------------- 配置参数 ----------------------------
 ARCH_MAP = {
@@ -48,12 +61,25 @@ DEFAULT_PARAMS = {
     "tl": 300, "tll": 30, "tlr": 0.2,
     "n": 500, "dn": 5, "p": 5
 }
+DEFAULT_WORKERS = 1  # 并发测试的colo数量（1 = 顺序执行）
+DOWNLOAD_SLOTS = 1  # 并发模式下同时进行下载测速的colo数量
+DOWNLOAD_URL = "https://cloudflare.cdn.openbsd.org/pub/OpenBSD/7.3/src.tar.gz"
+ENGINES = ["binary", "native"]  # 延迟测试引擎：cfst二进制 / 原生asyncio HTTPing
+HTTPING_SAMPLES = 4  # 原生引擎每个IP的采样次数
+WARM_START_MIN_SPEED = 5.0  # 热启动结果达标的最低下载速度 (MB/s)
+HISTORY_RETENTION_DAYS = 90  # 测速历史保留天数，每次运行结束时清理更早的记录
+WARM_START_MAX_AGE_DAYS = 30  # 热启动选取IP时参考的历史天数
+TOP_K = 5  # 每个colo保留的最佳节点数量
+RESERVE_SIZE = 10  # 每个colo额外保存的候补节点数量（供 ip_checker.py --repair 替换失效IP）
+DOWNLOAD_SECONDS = 10  # cfst 单个IP的下载测速时长（-dt 默认值），用于估算下载字节数
 
 # ---------------------------- 路径配置 ----------------------------
 BASE_DIR = Path(__file__).parent.resolve()
 LOGS_DIR = BASE_DIR / "logs"
 RESULTS_DIR = BASE_DIR / "results"
 SPEED_DIR = BASE_DIR / "speed"
+HISTORY_DB = BASE_DIR / "history" / "probes.db"
+LOCK_DIR = BASE_DIR / "history" / "locks"  # 类型/colo 运行锁与 git 锁
 
 # ---------------------------- 初始化环境 ----------------------------
 load_dotenv()
@@ -73,8 +99,9 @@ def setup_logging(ip_type: str):
     log_dir = LOGS_DIR / ip_type
     log_dir.mkdir(parents=True, exist_ok=True)
     
-    # 删除所有历史日志文件
-    for old_log in log_dir.glob(f"cfst*.log"):
+    # 删除所有历史日志文件与运行报告
+    old_files = list(log_dir.glob("cfst*.log")) + list(log_dir.glob("cfst_run_*.json"))
+    for old_log in old_files:
         try:
             old_log.unlink()
             print(f"{Color.YELLOW}已清理旧日志: {old_log}{Color.RESET}")
@@ -102,25 +129,128 @@ def setup_logging(ip_type: str):
     logger.addHandler(file_handler)
     logger.addHandler(console_handler)
 
+def save_speed_files(speed_dir: Path, ip_type: str, cfcolo: str, entries: list):
+    """写出 speed/<类型>/<colo>.json 与节点信息文件 <colo>.txt"""
+    json_file = speed_dir / f"{cfcolo}.json"
+    with open(json_file, 'w', encoding='utf-8') as f_json:
+        json.dump(entries, f_json, ensure_ascii=False, indent=2)
+    logging.info(f"{Color.GREEN}已保存最佳结果到: {json_file}{Color.RESET}")
+
+    txt_file = speed_dir / f"{cfcolo}.txt"
+    with open(txt_file, 'w', encoding='utf-8') as f_txt:
+        for entry in entries:
+            ip = entry['ip']
+            if ip_type == 'ipv6':
+                ip = f"[{ip}]"
+            port = entry['port']
+            speed_str = f"┃⚡{entry['speed']:.2f}MB/s" if entry['speed'] > 0 else ""
+            line = f"{ip}:{port}#{entry['emoji']}{entry['country']}{speed_str}\n"
+
+            full_line = line.strip()  # 去除换行符
+            print(
+                   f"{Color.CYAN}[写入{cfcolo}.txt]{Style.RESET_ALL} "
+                   f"{Fore.WHITE}{full_line.split('#')[0]}{Style.RESET_ALL}"
+                   f"{Fore.YELLOW}#{full_line.split('#')[1]}{Style.RESET_ALL}"
+               )
+            logging.info(f"[写入{cfcolo}.txt] {full_line}")  # 日志记录完整行
+
+            f_txt.write(line)
+    logging.info(f"{Color.GREEN}已生成节点信息文件: {txt_file}{Color.RESET}")
+
+def reserve_path(speed_dir: Path, cfcolo: str) -> Path:
+    return speed_dir / f"{cfcolo}_reserve.json"
+
+def load_reserve(speed_dir: Path, cfcolo: str) -> list:
+    """读取候补节点（按排名顺序），不存在时返回空列表"""
+    try:
+        with open(reserve_path(speed_dir, cfcolo), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+def save_reserve(speed_dir: Path, cfcolo: str, reserve: list):
+    """保存排名在 top_k 之后的候补节点，无候补时删除旧文件"""
+    path = reserve_path(speed_dir, cfcolo)
+    if not reserve:
+        path.unlink(missing_ok=True)
+        return
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(reserve, f, ensure_ascii=False, indent=2)
+    logging.info(f"{Color.GREEN}已保存 {len(reserve)} 个候补节点到: {path}{Color.RESET}")
+
+class DownloadGate:
+    """下载测速闸门
+
+    多个colo共享同一出口带宽，同时下载会互相挤占，导致测得的速度偏低。
+    每个槽位代表一份完整带宽，下载阶段必须持有槽位才能执行。
+    """
+
+    def __init__(self, slots: int = DOWNLOAD_SLOTS):
+        self.slots = max(1, slots)
+        self._semaphore = threading.BoundedSemaphore(self.slots)
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._semaphore.release()
+        return False
+
 # ---------------------------- 核心类 ----------------------------
 class CFSpeedTester:
     """Cloudflare Speed Test 操作器（分协议类型执行）"""
-    
-    def __init__(self, ip_type: str):
+
+    def __init__(self, ip_type: str, download_gate: DownloadGate = None, engine: str = "binary",
+                 sampler: CIDRSampler = None, ip_file: Path = None, warm_start: int = 0,
+                 min_speed: float = WARM_START_MIN_SPEED, top_k: int = TOP_K,
+                 score_weights: dict = None, metrics: RunMetrics = None):
         """
         初始化测速操作器
         :param ip_type: 协议类型 (ipv4/ipv6/proxy)
+        :param download_gate: 下载闸门，提供时延迟与下载分两阶段执行
+        :param engine: 延迟测试引擎 (binary/native)
+        :param sampler: 候选IP采样器，未提供时CIDR展开交由测试引擎处理
+        :param ip_file: 候选IP/CIDR文件，默认 <ip_type>.txt
+        :param warm_start: 热启动时优先测试的历史最佳IP数量，0 表示关闭
+        :param min_speed: 热启动结果达标的最低下载速度 (MB/s)
+        :param top_k: 每个colo保留的最佳节点数量
+        :param score_weights: 综合评分权重 {speed, latency, loss}，默认仅按速度排名
+        :param metrics: 运行指标采集器
         """
         self.ip_type = ip_type
+        self.download_gate = download_gate
+        self.engine = engine
+        self.sampler = sampler
+        self.ip_file = Path(ip_file) if ip_file else BASE_DIR / f"{ip_type}.txt"
+        self.warm_start = warm_start
+        self.min_speed = min_speed
+        self.top_k = top_k
+        self.score_weights = score_weights or dict(ranking.DEFAULT_WEIGHTS)
+        self.metrics = metrics or RunMetrics(ip_type)
+        self.history = ProbeStore(HISTORY_DB)
+        self._native_stats = {}  # 原生引擎的延迟统计 {ip: IPStats}
+        self._runner_ups = {}  # 下载阶段的候选IP（按延迟排序） {colo: [ip]}，用于补足候补节点
+        self._sampled_file = None  # 采样后的候选文件（供cfst二进制使用）
+        self._sample_lock = threading.Lock()
         self.results_dir = RESULTS_DIR / ip_type
         self.speed_dir = SPEED_DIR / ip_type
-        
+        self.run_lock = RunLock(ip_type, LOCK_DIR)
+        self.coalesced = set()  # 最近一次 run_colos 中合并自其他进行中测速的colo
+
         # 创建必要目录
         self.results_dir.mkdir(parents=True, exist_ok=True)
         self.speed_dir.mkdir(parents=True, exist_ok=True)
 
     def _get_cfst_binary(self) -> Path:
-        """获取平台对应的CFST二进制文件"""
+        """获取平台对应的CFST二进制文件（可通过 CFST_BINARY 环境变量指定）"""
+        override = os.getenv("CFST_BINARY")
+        if override:
+            cfst_path = Path(override)
+            if not cfst_path.exists():
+                raise FileNotFoundError(f"CFST二进制文件缺失: {cfst_path}")
+            return cfst_path
+
         current_arch = platform.machine()
         cfst_arch = ARCH_MAP.get(current_arch)
         if not cfst_arch:
@@ -133,22 +263,95 @@ class CFSpeedTester:
 
     def execute_tests(self):
         """执行多地区码测试流程"""
-        success_count = 0
-        for cfcolo in CFCOLO_LIST:
-            if self._test_single_colo(cfcolo):
-                success_count += 1
-        return success_count
+        results = self.run_colos(CFCOLO_LIST)
+        return sum(1 for ok in results.values() if ok)
+
+    def run_colos(self, colos: list, workers: int = DEFAULT_WORKERS, shared_sweep: bool = False) -> dict:
+        """
+        测试多个地区码，返回 {colo: 是否成功}（保持传入顺序）
+        已有其他进程/线程在测试的colo不重复扫描，等待其完成并采用其结果（记录在 self.coalesced）
+        :param workers: 并发测试的colo数量，1 为顺序执行
+        :param shared_sweep: 所有colo共用一次延迟扫描，仅按colo分别执行下载测速
+        """
+        results, self.coalesced = self.run_lock.run(
+            colos, lambda owned: self._run_owned_colos(owned, workers, shared_sweep))
+        self._prune_history()
+        return results
+
+    def _prune_history(self):
+        """清理过期的测速历史，避免数据库无限增长"""
+        try:
+            removed = self.history.prune(HISTORY_RETENTION_DAYS)
+        except sqlite3.Error as e:
+            logging.warning(f"{Color.YELLOW}清理测速历史失败: {e}{Color.RESET}")
+            return
+        if removed:
+            logging.info(f"{Color.CYAN}已清理 {removed} 条超过 {HISTORY_RETENTION_DAYS} 天的测速历史{Color.RESET}")
+
+    def _run_owned_colos(self, colos: list, workers: int, shared_sweep: bool) -> dict:
+        """在持有colo运行锁的情况下执行测速"""
+        try:
+            if shared_sweep:
+                port = random.choice(CLOUDFLARE_PORTS)
+                buckets = self._run_shared_sweep(colos, port)
+
+                def test_colo(cfcolo):
+                    return self._test_single_colo(cfcolo, candidates=buckets.get(cfcolo, []), port=port)
+            else:
+                test_colo = self._test_single_colo
+
+            if workers <= 1 or len(colos) <= 1:
+                return {cfcolo: test_colo(cfcolo) for cfcolo in colos}
+
+            logging.info(f"{Color.CYAN}并发测试 {len(colos)} 个地区码 (并发数: {workers}){Color.RESET}")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {cfcolo: executor.submit(test_colo, cfcolo) for cfcolo in colos}
+                return {cfcolo: future.result() for cfcolo, future in futures.items()}
+        finally:
+            if self._sampled_file is not None:
+                self._sampled_file.unlink(missing_ok=True)
+                self._sampled_file = None
+
+    def _candidate_file(self) -> Path:
+        """供cfst二进制使用的候选文件：启用采样时流式写出一次采样结果并复用"""
+        if self.sampler is None:
+            return self.ip_file
+        with self._sample_lock:
+            if self._sampled_file is None:
+                sampled_file = self.results_dir / f".candidates_{datetime.now().strftime('%Y%m%d-%H%M%S')}.txt"
+                count = self.sampler.write_file(self.ip_file, sampled_file)
+                logging.info(f"{Color.CYAN}已从 {self.ip_file.name} 采样 {count} 个候选IP{Color.RESET}")
+                self._sampled_file = sampled_file
+            return self._sampled_file
 
-    def _test_single_colo(self, cfcolo: str) -> bool:
-        """单个地区码测试流程"""
+    def _iter_candidates(self):
+        """供原生引擎流式消费的候选IP（默认每个/24取一个地址、每个IPv6网段取256个，与原先的展开方式一致）"""
+        return (self.sampler or CIDRSampler()).sample_file(self.ip_file)
+
+    def _test_single_colo(self, cfcolo: str, candidates: list = None, port: int = None) -> bool:
+        """
+        单个地区码测试流程
+        :param candidates: 共享扫描得到的候选IP，提供时跳过延迟测试直接下载测速
+        """
         try:
-            port = random.choice(CLOUDFLARE_PORTS)
+            port = port or random.choice(CLOUDFLARE_PORTS)
             result_file = self._generate_result_path(cfcolo)
             result_file.touch()  # 创建空文件标记开始
-            
-            if not self._run_cfst_test(cfcolo, port, result_file):
+
+            if candidates is not None:
+                if not candidates:
+                    logging.warning(f"{Color.YELLOW}{cfcolo} 在共享扫描中无可用IP{Color.RESET}")
+                    self._clean_all_colo_files(cfcolo)
+                    return False
+                tested = self._run_download_phase(cfcolo, port, candidates, result_file)
+            elif self.warm_start and self._run_warm_start(cfcolo, port, result_file):
+                tested = True
+            else:
+                tested = self._run_cfst_test(cfcolo, port, result_file)
+            if not tested:
                 self._clean_all_colo_files(cfcolo)
                 return False
+            self._record_history(result_file, cfcolo, port)
     
             # 检查结果文件是否为空
             if result_file.stat().st_size == 0:
@@ -162,87 +365,280 @@ class CFSpeedTester:
                 return False
     
             self._clean_old_files_except_current(cfcolo, result_file)
-            # 更新DNS记录
-            if result_file.exists() and result_file.stat().st_size > 0:
-                try:
-                    subprocess.run([sys.executable, "-u", "ddns.py", "-t", self.ip_type, "--colos", cfcolo], check=True)
-                except subprocess.CalledProcessError as e:
-                    logging.error(f"{Color.RED}DNS更新失败: {cfcolo} - {str(e)}{Color.RESET}")
-            else:
-                logging.warning(f"{Color.YELLOW}跳过DNS更新: {result_file} 为空或不存在{Color.RESET}")
-    
             return True
         except Exception as e:
             self._clean_all_colo_files(cfcolo)
             logging.error(f"{Color.RED}{cfcolo} 测试失败: {str(e)}{Color.RESET}")
             return False
 
-    def _run_cfst_test(self, cfcolo: str, port: int, result_file: Path) -> bool:
-        """执行CFST测试命令"""
-        cfst_path = self._get_cfst_binary()
-        ip_file = BASE_DIR / f"{self.ip_type}.txt"
+    def _run_warm_start(self, cfcolo: str, port: int, result_file: Path) -> bool:
+        """
+        热启动：仅对历史最佳IP执行下载测速
+        达标（至少 dn 个IP不低于 min_speed）返回True，否则清空结果文件交由完整测试处理
+        """
+        best_ips = self.history.best_ips(self.ip_type, cfcolo, port, self.warm_start,
+                                         max_age_days=WARM_START_MAX_AGE_DAYS)
+        if not best_ips:
+            logging.info(f"{Color.YELLOW}{cfcolo} 无历史记录，执行完整测试{Color.RESET}")
+            return False
+
+        logging.info(f"{Color.CYAN}{cfcolo} 热启动：测试 {len(best_ips)} 个历史最佳IP{Color.RESET}")
+        if self._run_download_phase(cfcolo, port, best_ips, result_file):
+            speeds = self._read_result_speeds(result_file)
+            qualified = sum(1 for speed in speeds if speed >= self.min_speed)
+            if qualified >= DEFAULT_PARAMS["dn"]:
+                logging.info(f"{Color.GREEN}{cfcolo} 热启动达标 ({qualified} 个IP ≥ {self.min_speed}MB/s){Color.RESET}")
+                return True
+            logging.warning(f"{Color.YELLOW}{cfcolo} 热启动未达标 ({qualified} 个IP ≥ {self.min_speed}MB/s)，回退完整测试{Color.RESET}")
+            self._record_history(result_file, cfcolo, port)
+
+        result_file.write_text("", encoding="utf-8")
+        return False
 
-        cmd = [
-            str(cfst_path),
+    def _record_history(self, result_file: Path, cfcolo: str, port: int):
+        """将结果文件写入历史存储（失败不影响测速流程）"""
+        try:
+            self.history.record_result_file(self.ip_type, result_file, cfcolo, port)
+        except Exception as e:
+            logging.warning(f"{Color.YELLOW}历史记录写入失败: {str(e)}{Color.RESET}")
+
+    @property
+    def download_count(self) -> int:
+        """cfst -dn：结果文件只包含下载测速过的IP，因此至少为 top_k"""
+        return max(DEFAULT_PARAMS["dn"], self.top_k)
+
+    def _build_cfst_cmd(self, ip_file: Path, result_file: Path, cfcolo: str, port: int) -> list:
+        """构造CFST测试命令"""
+        return [
+            str(self._get_cfst_binary()),
             "-f", str(ip_file),
             "-o", str(result_file),
-            "-url", "https://cloudflare.cdn.openbsd.org/pub/OpenBSD/7.3/src.tar.gz",
+            "-url", DOWNLOAD_URL,
             "-cfcolo", cfcolo,
             "-tl", str(DEFAULT_PARAMS["tl"]),
             "-tll", str(DEFAULT_PARAMS["tll"]),
             "-tlr", str(DEFAULT_PARAMS["tlr"]),
             "-n", str(DEFAULT_PARAMS["n"]),
             "-tp", str(port),
-            "-dn", str(DEFAULT_PARAMS["dn"]),
-            "-p", str(DEFAULT_PARAMS["p"]),
+            "-dn", str(self.download_count),
+            "-p", str(max(DEFAULT_PARAMS["p"], self.top_k)),
             "-httping"
         ]
 
+    def _run_cfst_test(self, cfcolo: str, port: int, result_file: Path) -> bool:
+        """执行CFST测试命令"""
+        if self.download_gate is not None or self.engine == "native":
+            return self._run_two_phase_test(cfcolo, port, result_file)
+
+        cmd = self._build_cfst_cmd(self._candidate_file(), result_file, cfcolo, port)
+        # cfst 结果文件只包含下载测速过的IP，单阶段模式没有延迟结果可补足候补，下载测速数量额外增加 RESERVE_SIZE
+        cmd[cmd.index("-dn") + 1] = str(self.download_count + RESERVE_SIZE)
+        with self.metrics.stage("cfst", cfcolo) as record:
+            try:
+                logging.info(f"{Color.CYAN}正在测试 {cfcolo} (端口: {port})...{Color.RESET}")
+                subprocess.run(cmd, check=True, stdout=sys.stdout, stderr=sys.stderr)
+                self._record_result_counts(record, result_file)
+                return True
+            except subprocess.CalledProcessError as e:
+                record["status"] = "error"
+                logging.error(f"{Color.RED}命令执行失败: {str(e)}{Color.RESET}")
+                return False
+
+    def _run_two_phase_test(self, cfcolo: str, port: int, result_file: Path) -> bool:
+        """
+        两阶段测试：延迟阶段可与其他colo并行，下载阶段需持有下载闸门
+        """
+        latency_file = result_file.with_suffix(".latency.csv")
         try:
-            logging.info(f"{Color.CYAN}正在测试 {cfcolo} (端口: {port})...{Color.RESET}")
-            subprocess.run(cmd, check=True, stdout=sys.stdout, stderr=sys.stderr)
+            if not self._run_latency_phase(cfcolo, port, latency_file):
+                return False
+            self._record_history(latency_file, cfcolo, port)
+            candidates = self._read_result_ips(latency_file)[:self.download_count * 4]
+            if not candidates:
+                logging.warning(f"{Color.YELLOW}{cfcolo} 延迟测试无可用IP{Color.RESET}")
+                return True  # 空结果文件由调用方处理
+            return self._run_download_phase(cfcolo, port, candidates, result_file)
+        finally:
+            latency_file.unlink(missing_ok=True)
+
+    def _run_latency_phase(self, cfcolo: str, port: int, latency_file: Path) -> bool:
+        """仅执行延迟测试（-dd 禁用下载），结果按延迟排序写入 latency_file"""
+        with self.metrics.stage("latency", cfcolo, engine=self.engine) as record:
+            if self.engine == "native":
+                ok = self._run_native_latency(cfcolo, port, latency_file)
+            else:
+                ok = self._run_binary_latency(cfcolo, port, latency_file)
+            if ok:
+                record["ips"] = len(self._read_result_ips(latency_file))
+            else:
+                record["status"] = "error"
+            return ok
+
+    def _run_binary_latency(self, cfcolo: str, port: int, latency_file: Path) -> bool:
+        """使用cfst二进制执行延迟测试"""
+        cmd = self._build_cfst_cmd(self._candidate_file(), latency_file, cfcolo, port)
+        cmd[cmd.index("-p") + 1] = "0"
+        cmd.append("-dd")
+        try:
+            logging.info(f"{Color.CYAN}正在测试 {cfcolo} 延迟 (端口: {port})...{Color.RESET}")
+            subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL, stderr=sys.stderr)
             return True
         except subprocess.CalledProcessError as e:
-            logging.error(f"{Color.RED}命令执行失败: {str(e)}{Color.RESET}")
+            logging.error(f"{Color.RED}{cfcolo} 延迟测试失败: {str(e)}{Color.RESET}")
+            return False
+
+    def _run_native_latency(self, cfcolo: str, port: int, latency_file: Path) -> bool:
+        """使用原生asyncio HTTPing引擎执行延迟测试"""
+        try:
+            logging.info(f"{Color.CYAN}正在测试 {cfcolo} 延迟 (原生引擎, 端口: {port})...{Color.RESET}")
+            stats = httping.run_httping(
+                self._iter_candidates(), latency_file,
+                colos=cfcolo.split(","),
+                port=port,
+                host=urlparse(DOWNLOAD_URL).hostname,
+                samples=HTTPING_SAMPLES,
+                concurrency=DEFAULT_PARAMS["n"],
+                max_latency=DEFAULT_PARAMS["tl"],
+                min_latency=DEFAULT_PARAMS["tll"],
+                max_loss=DEFAULT_PARAMS["tlr"]
+            )
+            self._native_stats.update((s.ip, s) for s in stats)
+            return True
+        except Exception as e:
+            logging.error(f"{Color.RED}{cfcolo} 原生延迟测试失败: {str(e)}{Color.RESET}")
+            return False
+
+    def _has_cfst_binary(self) -> bool:
+        """检查CFST二进制文件是否可用"""
+        try:
+            self._get_cfst_binary()
+            return True
+        except (RuntimeError, FileNotFoundError):
             return False
 
+    def _run_shared_sweep(self, colos: list, port: int) -> dict:
+        """
+        对所有colo执行一次延迟扫描，按观测到的colo分桶
+        :return: {colo: [按延迟排序的候选IP]}
+        """
+        timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        sweep_file = self.results_dir / f"sweep_{timestamp}.latency.csv"
+        try:
+            if not self._run_latency_phase(",".join(colos), port, sweep_file):
+                return {}
+            self._record_history(sweep_file, colos[0], port)
+            buckets = self._read_colo_buckets(sweep_file)
+        finally:
+            sweep_file.unlink(missing_ok=True)
+
+        limit = self.download_count * 4
+        summary = ", ".join(f"{colo}: {len(buckets.get(colo, []))}" for colo in colos)
+        logging.info(f"{Color.GREEN}共享扫描完成，各colo可用IP数 - {summary}{Color.RESET}")
+        return {colo: ips[:limit] for colo, ips in buckets.items()}
+
+    def _run_download_phase(self, cfcolo: str, port: int, ips: list, result_file: Path) -> bool:
+        """对候选IP执行下载测速（受下载闸门限制）"""
+        if self.engine == "native" and not self._has_cfst_binary():
+            # 无二进制文件时无法下载测速，直接使用延迟结果（速度记为0）
+            logging.warning(f"{Color.YELLOW}{cfcolo} 未找到CFST二进制文件，仅保留延迟测试结果{Color.RESET}")
+            httping.write_csv([self._native_stats[ip] for ip in ips if ip in self._native_stats], result_file)
+            return True
+
+        self._runner_ups[cfcolo] = list(ips)
+        candidate_file = result_file.with_suffix(".ips.txt")
+        candidate_file.write_text("\n".join(ips) + "\n", encoding="utf-8")
+        cmd = self._build_cfst_cmd(candidate_file, result_file, cfcolo, port)
+        with self.metrics.stage("download", cfcolo, candidates=len(ips)) as record:
+            try:
+                wait_start = time.perf_counter()
+                with self.download_gate or contextlib.nullcontext():
+                    record["gate_wait_s"] = round(time.perf_counter() - wait_start, 4)
+                    logging.info(f"{Color.CYAN}正在测试 {cfcolo} 下载速度 ({len(ips)} 个候选IP)...{Color.RESET}")
+                    subprocess.run(cmd, check=True, stdout=sys.stdout, stderr=sys.stderr)
+                self._record_result_counts(record, result_file)
+                return True
+            except subprocess.CalledProcessError as e:
+                record["status"] = "error"
+                logging.error(f"{Color.RED}{cfcolo} 下载测试失败: {str(e)}{Color.RESET}")
+                return False
+            finally:
+                candidate_file.unlink(missing_ok=True)
+
+    def _record_result_counts(self, record: dict, result_file: Path):
+        """记录结果行数与估算的下载字节数（速度 × 下载时长）"""
+        speeds = self._read_result_speeds(result_file)
+        record["ips"] = len(speeds)
+        record["bytes_downloaded"] = int(sum(s for s in speeds if s > 0) * DOWNLOAD_SECONDS * 1024 * 1024)
+
+    @staticmethod
+    def _read_colo_buckets(result_file: Path) -> dict:
+        """按 地区码(Colo) 列将结果文件中的IP分桶（保持原有顺序）"""
+        buckets = {}
+        if not result_file.exists():
+            return buckets
+        with open(result_file, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                ip = row.get('IP 地址', '').strip()
+                colo = row.get('地区码(Colo)', '').strip().upper()
+                if ip and colo:
+                    buckets.setdefault(colo, []).append(ip)
+        return buckets
+
+    @staticmethod
+    def _read_result_speeds(result_file: Path) -> list:
+        """读取CFST结果文件中的下载速度列表"""
+        speeds = []
+        if not result_file.exists():
+            return speeds
+        with open(result_file, 'r', encoding='utf-8') as f:
+            for row in csv.DictReader(f):
+                try:
+                    speeds.append(float(row.get('下载速度 (MB/s)', '0')))
+                except ValueError:
+                    continue
+        return speeds
+
+    @staticmethod
+    def _read_result_ips(result_file: Path) -> list:
+        """读取CFST结果文件中的IP列表（保持原有顺序）"""
+        if not result_file.exists():
+            return []
+        with open(result_file, 'r', encoding='utf-8') as f:
+            return [row['IP 地址'].strip() for row in csv.DictReader(f) if row.get('IP 地址', '').strip()]
+
     def _process_results(self, result_file: Path, cfcolo: str, port: int) -> list:
-        """处理测速结果并生成节点信息"""
-        entries = []
+        """处理测速结果并生成节点信息（单遍Top-K，按综合评分排名）"""
         emoji_data = colo_emojis.get(cfcolo, ("", "US"))
         emoji, country_code = emoji_data[0], emoji_data[1]
+        timestamp = datetime.now().isoformat()
 
         try:
-            with open(result_file, 'r', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                for row in reader:
-                    ip = row.get('IP 地址', '').strip()
-                    speed = row.get('下载速度 (MB/s)', '0').strip()
-
-                    # 检查 IP 和速度是否有效
-                    if not ip or not speed:
-                        continue
-
-                    # 生成节点条目
-                    try:
-                        speed_float = float(speed)
-                        entry = {
-                            "ip": ip,
-                            "port": port,
-                            "speed": speed_float,
-                            "emoji": emoji,
-                            "colo": cfcolo,
-                            "country": country_code,
-                            "timestamp": datetime.now().isoformat()
-                        }
-                        entries.append(entry)
-                    except ValueError:
-                        continue
-
-            # 按速度排序并保留前5名
-            sorted_entries = sorted(entries, key=lambda x: x["speed"], reverse=True)[:5]
-            self._save_processed_results(cfcolo, sorted_entries)
-            return sorted_entries
+            top_rows = ranking.rank_result_file(result_file, self.top_k + RESERVE_SIZE, self.score_weights)
+            entries = [
+                {
+                    "ip": ip,
+                    "port": port,
+                    "speed": speed,
+                    "emoji": emoji,
+                    "colo": cfcolo,
+                    "country": country_code,
+                    "timestamp": timestamp
+                }
+                for ip, speed, _, _ in top_rows
+            ]
+            reserve = entries[self.top_k:]
+            # cfst 结果文件只包含下载测速过的IP：两阶段/共享扫描/热启动模式下，
+            # 用下载阶段未进入结果的候选IP补足候补（速度未知记为0，替换前会复检）
+            ranked = {entry["ip"] for entry in entries}
+            for ip in self._runner_ups.pop(cfcolo, []):
+                if len(reserve) >= RESERVE_SIZE:
+                    break
+                if ip not in ranked:
+                    ranked.add(ip)
+                    reserve.append({"ip": ip, "port": port, "speed": 0.0, "emoji": emoji, "colo": cfcolo,
+                                    "country": country_code, "timestamp": timestamp})
+            self._save_processed_results(cfcolo, entries[:self.top_k], reserve)
+            return entries[:self.top_k]
 
         except Exception as e:
             logging.error(f"{Color.RED}结果处理失败: {str(e)}{Color.RESET}")
@@ -253,37 +649,13 @@ class CFSpeedTester:
         timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
         return self.results_dir / f"{cfcolo}_{timestamp}.csv"
 
-    def _save_processed_results(self, cfcolo: str, entries: list):
-        """保存处理后的结果（仅当有数据时）"""
+    def _save_processed_results(self, cfcolo: str, entries: list, reserve: list = None):
+        """保存处理后的结果（仅当有数据时）及候补节点"""
         if not entries:
             logging.warning(f"{Color.YELLOW}无有效数据，跳过生成文件{Color.RESET}")
             return
-    
-        json_file = self.speed_dir / f"{cfcolo}.json"
-        with open(json_file, 'w', encoding='utf-8') as f_json:
-            json.dump(entries, f_json, ensure_ascii=False, indent=2)
-        logging.info(f"{Color.GREEN}已保存最佳结果到: {json_file}{Color.RESET}")
-    
-        txt_file = self.speed_dir / f"{cfcolo}.txt"
-        with open(txt_file, 'w', encoding='utf-8') as f_txt:
-            for entry in entries:
-                ip = entry['ip']
-                if self.ip_type == 'ipv6':
-                    ip = f"[{ip}]"
-                port = entry['port']
-                speed_str = f"┃⚡{entry['speed']:.2f}MB/s" if entry['speed'] > 0 else ""
-                line = f"{ip}:{port}#{entry['emoji']}{entry['country']}{speed_str}\n"
-                
-                full_line = line.strip()  # 去除换行符
-                print(
-                       f"{Color.CYAN}[写入{cfcolo}.txt]{Style.RESET_ALL} "
-                       f"{Fore.WHITE}{full_line.split('#')[0]}{Style.RESET_ALL}"
-                       f"{Fore.YELLOW}#{full_line.split('#')[1]}{Style.RESET_ALL}"
-                   )
-                logging.info(f"[写入{cfcolo}.txt] {full_line}")  # 日志记录完整行
-                
-                f_txt.write(line)
-        logging.info(f"{Color.GREEN}已生成节点信息文件: {txt_file}{Color.RESET}")
+        save_speed_files(self.speed_dir, self.ip_type, cfcolo, entries)
+        save_reserve(self.speed_dir, cfcolo, reserve or [])
 
     def _clean_all_colo_files(self, cfcolo: str):
         """清理该colo所有相关文件（包括speed目录）"""
@@ -310,10 +682,39 @@ class CFSpeedTester:
                     except Exception as e:
                         logging.error(f"{Color.RED}清理失败: {old_file} - {str(e)}{Color.RESET}")
 
+    def update_dns(self, colos: list, batch: bool = False):
+        """
+        测速全部结束后在当前进程内批量更新DNS记录（通知由调用方汇总发送）
+        :param batch: 使用Cloudflare批量接口提交变更
+        :return: (删除数, 新增数, 完整日志)，失败时返回 None
+        """
+        if not colos:
+            logging.warning(f"{Color.YELLOW}无成功的地区码，跳过DNS更新{Color.RESET}")
+            return None
+        with self.metrics.stage("ddns", ",".join(colos)) as record:
+            before = ddns.get_client().stats()
+            try:
+                deleted, added, log = ddns.apply_dns_updates(self.ip_type, colos, notify=False, batch=batch)
+            except Exception as e:
+                record["status"] = "error"
+                logging.error(f"{Color.RED}DNS更新失败: {', '.join(colos)} - {str(e)}{Color.RESET}")
+                return None
+            finally:
+                after = ddns.get_client().stats()
+                for key in ("requests", "retries", "errors", "rate_limited"):
+                    record[f"api_{key}"] = after.get(key, 0) - before.get(key, 0)
+            record.update(deleted=deleted, added=added)
+            return deleted, added, log
+
 # ---------------------------- 新增Git提交功能 ----------------------------
     @staticmethod
     def git_commit_and_push(ip_type: str):
-        """执行Git提交操作"""
+        """执行Git提交操作（多个进程同时提交时依次执行）"""
+        with file_lock(LOCK_DIR / "git.lock"):
+            return CFSpeedTester._git_commit_and_push(ip_type)
+
+    @staticmethod
+    def _git_commit_and_push(ip_type: str):
         try:
             # 检查是否有文件变更
             status_check = subprocess.run(
@@ -372,6 +773,36 @@ def parse_arguments():
                         help="逗号分隔的colo地区码列表（例如：HKG,LAX）")
     parser.add_argument("--git-commit", action="store_true",
                         help="测试完成后提交结果到Git仓库")
+    parser.add_argument("-w", "--workers", type=int, default=DEFAULT_WORKERS,
+                        help="并发测试的colo数量（1为顺序执行）")
+    parser.add_argument("--download-slots", type=int, default=DOWNLOAD_SLOTS,
+                        help="并发模式下同时进行下载测速的colo数量")
+    parser.add_argument("--shared-sweep", action="store_true",
+                        help="所有colo共用一次延迟扫描，再按colo分别下载测速")
+    parser.add_argument("--engine", choices=ENGINES, default="binary",
+                        help="延迟测试引擎：binary 使用cfst二进制，native 使用原生asyncio HTTPing")
+    parser.add_argument("--ip-file", default=None,
+                        help="候选IP/CIDR文件（默认 <type>.txt，例如 amd64/ips-v4.txt）")
+    parser.add_argument("--sample-per-prefix", type=int, default=0,
+                        help="每个/24抽取的候选IP数，0表示交由测试引擎展开")
+    parser.add_argument("--sample-per-prefix-v6", type=int, default=DEFAULT_PER_PREFIX[6],
+                        help="采样时每个IPv6分层前缀抽取的候选IP数")
+    parser.add_argument("--stratum-v6", type=int, default=DEFAULT_STRATUM[6],
+                        help="IPv6分层前缀长度（例如40），0表示每个列出的网段为一层")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="候选IP采样的随机种子（便于复现）")
+    parser.add_argument("--exclude", default=None,
+                        help="需要排除的IP/CIDR列表文件")
+    parser.add_argument("--warm-start", type=int, default=0,
+                        help="优先测试各colo历史最佳的N个IP，未达标时再执行完整测试（0为关闭）")
+    parser.add_argument("--min-speed", type=float, default=WARM_START_MIN_SPEED,
+                        help="热启动结果达标的最低下载速度 (MB/s)")
+    parser.add_argument("--top-k", type=int, default=TOP_K,
+                        help="每个colo保留的最佳节点数量（cfst -dn 随之增大）")
+    parser.add_argument("--score-weights", default="",
+                        help="综合评分权重，例如 speed=1,latency=0.01,loss=10（默认仅按速度）")
+    parser.add_argument("--dns-batch", action="store_true",
+                        help="使用Cloudflare批量接口提交DNS变更")
     return parser.parse_args()
 
 # ---------------------------- 主程序 ----------------------------
@@ -384,6 +815,7 @@ def main():
     git_success = False
     failed_colos = []
     success_colos = []  # 新增：记录成功的colo列表
+    metrics = RunMetrics(args.type)
 
     try:
         setup_logging(args.type)
@@ -391,32 +823,52 @@ def main():
         
         # 发送开始通知
         start_msg = f"🚀 开始 {args.type.upper()} 测试，地区码: {', '.join(selected_colos)}"
-        send_telegram_message(
-            worker_url=os.getenv("CF_WORKER_URL"),
-            bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
-            chat_id=os.getenv("TELEGRAM_CHAT_ID"),
-            message=start_msg,
-            secret_token=os.getenv("SECRET_TOKEN")
-        )
+        # 通知由后台线程发送，此阶段只记录入队耗时与是否入队成功
+        with metrics.stage("telegram_enqueue", event="start") as record:
+            record["queued"] = int(queue_telegram_message(
+                worker_url=os.getenv("CF_WORKER_URL"),
+                bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
+                chat_id=os.getenv("TELEGRAM_CHAT_ID"),
+                message=start_msg,
+                secret_token=os.getenv("SECRET_TOKEN")
+            ))
 
         # 执行测速流程
-        tester = CFSpeedTester(args.type)
-        for cfcolo in selected_colos:
-            if tester._test_single_colo(cfcolo):
+        download_gate = DownloadGate(args.download_slots) if args.workers > 1 else None
+        sampler = None
+        if args.sample_per_prefix > 0:
+            exclude = Path(args.exclude).read_text(encoding="utf-8").splitlines() if args.exclude else ()
+            sampler = CIDRSampler(per_prefix=args.sample_per_prefix, seed=args.seed, exclude=exclude,
+                                  stratum_v6=args.stratum_v6, per_prefix_v6=args.sample_per_prefix_v6)
+        tester = CFSpeedTester(args.type, download_gate=download_gate, engine=args.engine,
+                               sampler=sampler, ip_file=args.ip_file,
+                               warm_start=args.warm_start, min_speed=args.min_speed,
+                               top_k=args.top_k, score_weights=ranking.parse_weights(args.score_weights),
+                               metrics=metrics)
+        colo_results = tester.run_colos(selected_colos, workers=args.workers, shared_sweep=args.shared_sweep)
+        for cfcolo, ok in colo_results.items():
+            metrics.set_colo_result(cfcolo, ok)
+            if ok:
                 success_count += 1
                 success_colos.append(cfcolo)  # 记录成功colo
             else:
                 failed_colos.append(cfcolo)
                 print(f"{Fore.RED}❌ {cfcolo} 测试失败{Style.RESET_ALL}")
 
+        # 所有colo测速完成后一次性更新DNS（合并自其他运行的colo由其自行更新）
+        merged_colos = [c for c in selected_colos if c in tester.coalesced]
+        dns_colos = [c for c in success_colos if c not in tester.coalesced]
+        dns_result = tester.update_dns(dns_colos, batch=args.dns_batch) if dns_colos else None
+
         # Git提交
         if args.git_commit and success_count > 0:
             logging.info(f"{Color.CYAN}正在提交结果到Git仓库...{Color.RESET}")
-            git_success = CFSpeedTester.git_commit_and_push(args.type)
+            with metrics.stage("git") as record:
+                git_success = CFSpeedTester.git_commit_and_push(args.type)
+                record["committed"] = int(git_success)
 
         # 构造状态消息
         timestamp = datetime.now().strftime("%m/%d %H:%M")
-        ddns_triggered = success_count > 0  # 判断是否有触发DNS更新
         status_msg = [
             f"🌐 CFST更新维护 - {timestamp}",
             "├─ 更新区域",
@@ -424,8 +876,22 @@ def main():
             f"│  ├─ ✅ 成功({success_count}/{len(selected_colos)}): {', '.join(success_colos) if success_colos else '无'}",
             f"│  └─ ❌ 失败({len(failed_colos)}/{len(selected_colos)}): {', '.join(failed_colos) if failed_colos else '无'}",
             "└─ 自动维护",
-            f"   └─ {'⚡ 已触发DDNS更新' if ddns_triggered else '🛠️ 无可用更新'}"
         ]
+        if merged_colos:
+            status_msg.insert(-2, f"│  ├─ 🔗 合并进行中的测速({len(merged_colos)}): {', '.join(merged_colos)}")
+        if dns_result:
+            deleted, added, dns_log = dns_result
+            status_msg += [
+                f"   └─ ⚡ DDNS更新: 删除 {deleted} 条，新增 {added} 条",
+                "📜 DDNS日志:",
+                dns_log
+            ]
+        elif dns_colos:
+            status_msg.append("   └─ ❌ DDNS更新失败")
+        elif success_colos:
+            status_msg.append("   └─ 🔗 DDNS由进行中的测速更新")
+        else:
+            status_msg.append("   └─ 🛠️ 无可用更新")
 
     except Exception as e:
         error_message = f"❌ {args.type.upper()} 测试异常: {str(e)}"
@@ -436,15 +902,25 @@ def main():
     finally:
         # 发送结果通知
         try:
-            send_telegram_message(
-                worker_url=os.getenv("CF_WORKER_URL"),
-                bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
-                chat_id=os.getenv("TELEGRAM_CHAT_ID"),
-                message="\n".join(status_msg),
-                secret_token=os.getenv("SECRET_TOKEN")
-            )
+            with metrics.stage("telegram_enqueue", event="summary") as record:
+                record["queued"] = int(queue_telegram_message(
+                    worker_url=os.getenv("CF_WORKER_URL"),
+                    bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
+                    chat_id=os.getenv("TELEGRAM_CHAT_ID"),
+                    message="\n".join(status_msg),
+                    secret_token=os.getenv("SECRET_TOKEN")
+                ))
         except Exception as e:
             logging.error(f"{Color.RED}Telegram 通知发送失败: {str(e)}{Color.RESET}")
+
+        # 导出运行报告与Prometheus指标
+        try:
+            metrics.finish()
+            report_dir = LOGS_DIR / args.type
+            metrics.write_json(report_dir / f"cfst_run_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+            metrics.write_prometheus(report_dir / "cfst.prom")
+        except Exception as e:
+            logging.error(f"{Color.RED}运行指标导出失败: {str(e)}{Color.RESET}")
         
         logging.info(f"{Color.CYAN}=== 测试流程结束 ==={Color.RESET}")
         if failed_colos:
@@ -462,6 +938,15 @@ class TestCFSpeedTester(unittest.TestCase):
     """CFSpeedTester 单元测试"""
 
     def setUp(self):
+        # 结果、历史与锁文件写入临时目录，避免在工作树中产生文件
+        workdir = tempfile.TemporaryDirectory()
+        self.addCleanup(workdir.cleanup)
+        self.workdir = Path(workdir.name)
+        paths = patch.multiple(sys.modules[__name__], RESULTS_DIR=self.workdir / "results",
+                               SPEED_DIR=self.workdir / "speed", LOCK_DIR=self.workdir / "locks",
+                               HISTORY_DB=self.workdir / "probes.db")
+        paths.start()
+        self.addCleanup(paths.stop)
         self.tester = CFSpeedTester("ipv4")
         self.test_colo = "HKG"
 
@@ -472,16 +957,100 @@ class TestCFSpeedTester(unittest.TestCase):
 
     def test_result_processing(self):
         """测试结果处理逻辑"""
-        test_file = Path(__file__).parent / "test_data.csv"
-        processed = self.tester._process_results(test_file, self.test_colo, 443)
+        test_file = self.workdir / "test_data.csv"
+        test_file.write_text(
+            "IP 地址,已发送,已接收,丢包率,平均延迟,下载速度 (MB/s),地区码(Colo)\n"
+            "104.16.1.1,4,4,0.00,80.00,12.30,HKG\n"
+            "104.16.1.2,4,4,0.00,90.00,,HKG\n", encoding="utf-8")
+        with patch.object(CFSpeedTester, '_save_processed_results'):
+            processed = self.tester._process_results(test_file, self.test_colo, 443)
         self.assertGreaterEqual(len(processed), 1, "应该至少处理一个有效结果")
 
+    def test_reserve_from_latency_runner_ups(self):
+        """测试结果文件只有下载测速的5行时（与cfst二进制一致），候补取自延迟阶段的其余IP"""
+        header = "IP 地址,已发送,已接收,丢包率,平均延迟,下载速度 (MB/s),地区码(Colo)\n"
+        rows = "".join(f"104.16.1.{i},4,4,0.00,{80 + i}.00,{20 - i}.00,HKG\n" for i in range(5))
+        result_file = self.workdir / "HKG_5rows.csv"
+        result_file.write_text(header + rows, encoding="utf-8")
+        latency_ips = [f"104.16.1.{i}" for i in range(5)] + [f"104.16.2.{i}" for i in range(15)]
+
+        processed = self.tester._process_results(result_file, self.test_colo, 443)
+        self.assertEqual(len(processed), 5)
+        self.assertEqual(load_reserve(self.tester.speed_dir, self.test_colo), [])
+
+        self.tester._runner_ups[self.test_colo] = latency_ips
+        self.tester._process_results(result_file, self.test_colo, 443)
+        reserve = load_reserve(self.tester.speed_dir, self.test_colo)
+        self.assertEqual([e["ip"] for e in reserve], [f"104.16.2.{i}" for i in range(RESERVE_SIZE)])
+
+        with patch('subprocess.run') as mock_run, \
+                patch.object(CFSpeedTester, '_get_cfst_binary', return_value=Path("cfst")):
+            self.tester._run_cfst_test(self.test_colo, 443, result_file)
+        cmd = mock_run.call_args.args[0]
+        self.assertEqual(cmd[cmd.index("-dn") + 1], str(TOP_K + RESERVE_SIZE))
+
     @patch('subprocess.run')
     def test_cfst_execution(self, mock_run):
         """测试CFST命令执行"""
         mock_run.return_value = CompletedProcess(args=[], returncode=0, stdout='', stderr='')
-        result = self.tester._run_cfst_test(self.test_colo, 443, Path("/tmp/test.csv"))
+        result = self.tester._run_cfst_test(self.test_colo, 443, self.workdir / "test.csv")
         self.assertTrue(result, "命令应该执行成功")
 
+    def test_concurrent_run_colos(self):
+        """测试并发模式保持colo顺序与成功/失败统计"""
+        colos = ["HKG", "LAX", "NRT", "SIN"]
+        with patch.object(CFSpeedTester, '_test_single_colo', side_effect=lambda c: c != "LAX"):
+            results = self.tester.run_colos(colos, workers=3)
+        self.assertEqual(list(results), colos)
+        self.assertEqual([c for c, ok in results.items() if not ok], ["LAX"])
+
+    def test_shared_sweep_buckets(self):
+        """测试共享扫描按colo分桶并仅执行下载阶段"""
+        buckets = {"HKG": ["1.1.1.1", "1.1.1.2"], "LAX": ["1.0.0.1"]}
+        with patch.object(CFSpeedTester, '_run_shared_sweep', return_value=buckets), \
+                patch.object(CFSpeedTester, '_test_single_colo', return_value=True) as mock_test:
+            results = self.tester.run_colos(["HKG", "LAX", "NRT"], shared_sweep=True)
+        self.assertEqual(list(results), ["HKG", "LAX", "NRT"])
+        passed = {c.args[0]: c.kwargs["candidates"] for c in mock_test.call_args_list}
+        self.assertEqual(passed, {"HKG": buckets["HKG"], "LAX": buckets["LAX"], "NRT": []})
+
+    def test_run_colos_prunes_history(self):
+        """测试每次运行结束时只清理超过保留天数的历史，热启动仅参考较近的历史"""
+        now = time.time()
+        for ip, age_days in (("104.16.1.1", HISTORY_RETENTION_DAYS + 1), ("104.16.1.2", 60), ("104.16.1.3", 0)):
+            self.tester.history.record(self.tester.ip_type, [
+                {"colo": self.test_colo, "ip": ip, "port": 443, "speed": 10.0}
+            ], ts=now - age_days * 86400)
+        with patch.object(CFSpeedTester, '_test_single_colo', return_value=True):
+            self.tester.run_colos([self.test_colo])
+        self.assertEqual(sorted(self.tester.history.best_ips(self.tester.ip_type, self.test_colo, 443, 5,
+                                                             max_age_days=365)), ["104.16.1.2", "104.16.1.3"])
+
+        self.tester.warm_start = 5
+        with patch.object(CFSpeedTester, '_run_download_phase', return_value=False) as mock_download:
+            self.tester._run_warm_start(self.test_colo, 443, self.workdir / "warm_HKG.csv")
+        self.assertEqual(mock_download.call_args.args[2], ["104.16.1.3"])
+
+    def test_download_count_covers_top_k(self):
+        """测试 -dn 不少于 top_k"""
+        self.assertEqual(self.tester.download_count, DEFAULT_PARAMS["dn"])
+        self.tester.top_k = 8
+        with patch.object(CFSpeedTester, '_get_cfst_binary', return_value=Path("cfst")):
+            cmd = self.tester._build_cfst_cmd(Path("ipv4.txt"), self.workdir / "r.csv", "HKG", 443)
+        self.assertEqual(cmd[cmd.index("-dn") + 1], "8")
+        self.assertEqual(cmd[cmd.index("-p") + 1], "8")
+
+    def test_warm_start_fallback(self):
+        """测试热启动未达标时回退完整测试"""
+        result_file = self.workdir / "warm_HKG.csv"
+        slow = "IP 地址,已发送,已接收,丢包率,平均延迟,下载速度 (MB/s),地区码(Colo)\n1.1.1.1,4,4,0.00,50.00,0.50,HKG\n"
+        self.tester.warm_start = 5
+        with patch.object(self.tester.history, 'best_ips', return_value=["1.1.1.1"]), \
+                patch.object(self.tester.history, 'record_result_file'), \
+                patch.object(CFSpeedTester, '_run_download_phase',
+                             side_effect=lambda c, p, ips, f: f.write_text(slow, encoding='utf-8') or True):
+            self.assertFalse(self.tester._run_warm_start(self.test_colo, 443, result_file))
+        self.assertEqual(result_file.read_text(encoding='utf-8'), "")
+
 if __name__ == '__main__':
     unittest.main()
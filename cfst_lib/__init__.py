@@ -0,0 +1,3 @@
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent  # 仓库根目录，状态文件均以此为基准，与运行目录无关
@@ -0,0 +1,234 @@
+"""
+共享的 Cloudflare API 客户端
+
+- 连接池复用的 requests.Session（keep-alive，避免每次请求重新握手）
+- 连接/读取超时
+- 429 与 5xx 的指数退避重试，优先遵循 Retry-After
+- 令牌桶限速（突发 60 次 + 3.8 次/秒，任意 5 分钟内不超过 Cloudflare 每用户 1200 次的限制）
+- 请求数、重试数、错误数与延迟统计
+"""
+
+import random
+import threading
+import time
+import unittest
+from collections import Counter
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+API_BASE = "https://api.cloudflare.com/client/v4/"
+DEFAULT_TIMEOUT = (5, 30)  # (连接超时, 读取超时) 秒
+DEFAULT_RATE = 3.8  # 每秒请求数
+DEFAULT_BURST = 60  # 60 + 3.8 * 300 = 1200
+RETRY_STATUS = {429, 500, 502, 503, 504}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "PUT", "DELETE", "OPTIONS"}
+
+class TokenBucket:
+    """线程安全的令牌桶，支持因 Retry-After 整体暂停"""
+
+    def __init__(self, rate: float = DEFAULT_RATE, capacity: int = DEFAULT_BURST):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """取得一个令牌，返回等待的秒数"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                delay = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float):
+        """在 seconds 秒内暂停所有请求（收到 Retry-After 时使用）"""
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0.0
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """解析 Retry-After 头（秒数或HTTP日期）"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class CloudflareClient:
+    """
+    Cloudflare API 客户端（可在多线程间共享）
+    非幂等请求（POST/PATCH）仅在 429 或连接未建立时重试，避免重复创建记录
+    """
+
+    def __init__(self, base_url: str = API_BASE, headers: dict = None, timeout=DEFAULT_TIMEOUT,
+                 max_retries: int = 4, backoff: float = 0.5, rate: float = DEFAULT_RATE,
+                 burst: int = DEFAULT_BURST, pool_size: int = 16):
+        self.base_url = base_url if base_url.endswith("/") else base_url + "/"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.bucket = TokenBucket(rate, burst) if rate else None
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update(headers or {})
+        self.counters = Counter()
+        self._lock = threading.Lock()
+
+    def _count(self, **values):
+        with self._lock:
+            self.counters.update(values)
+
+    def _retry_delay(self, attempt: int, response: Optional[requests.Response]) -> float:
+        if response is not None:
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            if retry_after is not None:
+                if self.bucket:
+                    self.bucket.pause(retry_after)
+                return retry_after
+        return self.backoff * (2 ** attempt) * random.uniform(0.5, 1.0)
+
+    def request(self, method: str, endpoint: str, **kwargs) -> requests.Response:
+        """
+        发送请求并在需要时重试，返回最后一次的响应
+        网络错误在重试耗尽后抛出 requests.exceptions.RequestException
+        """
+        method = method.upper()
+        url = endpoint if endpoint.startswith(("http://", "https://")) else self.base_url + endpoint.lstrip("/")
+        kwargs.setdefault("timeout", self.timeout)
+        for attempt in range(self.max_retries + 1):
+            if self.bucket:
+                waited = self.bucket.acquire()
+                if waited:
+                    self._count(throttled_s=waited)
+            start = time.perf_counter()
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self._count(requests=1, errors=1, latency_s=time.perf_counter() - start)
+                retryable = method in IDEMPOTENT_METHODS or isinstance(e, requests.exceptions.ConnectTimeout)
+                if not retryable or attempt >= self.max_retries:
+                    raise
+            else:
+                self._count(requests=1, latency_s=time.perf_counter() - start)
+                if response.status_code == 429:
+                    self._count(rate_limited=1)
+                retryable = response.status_code == 429 or (
+                    response.status_code in RETRY_STATUS and method in IDEMPOTENT_METHODS)
+                if not retryable or attempt >= self.max_retries:
+                    if response.status_code >= 400:
+                        self._count(errors=1)
+                    return response
+            self._count(retries=1)
+            time.sleep(self._retry_delay(attempt, response))
+        raise AssertionError("unreachable")
+
+    def api(self, method: str, endpoint: str, data=None, params=None) -> dict:
+        """发送JSON请求并返回Cloudflare响应体；网络或解析错误时返回 success=False"""
+        try:
+            response = self.request(method, endpoint, json=data, params=params)
+        except requests.exceptions.RequestException as e:
+            return {"success": False, "errors": [{"message": f"网络错误: {str(e)}"}]}
+        # requests.JSONDecodeError 同时继承自 RequestException，需单独处理，不能当作网络错误
+        try:
+            return response.json()
+        except ValueError:
+            return {"success": False, "errors": [{"message": f"无效的API响应: HTTP {response.status_code}"}]}
+
+    def stats(self) -> dict:
+        """请求统计：requests/retries/errors/rate_limited/avg_latency_ms"""
+        with self._lock:
+            stats = dict(self.counters)
+        count = stats.get("requests", 0)
+        stats["avg_latency_ms"] = round(stats.get("latency_s", 0.0) / count * 1000, 1) if count else 0.0
+        return stats
+
+def auth_headers(email: str = None, api_key: str = None, api_token: str = None) -> dict:
+    """构造认证头：优先使用 API Token，否则使用 Global API Key"""
+    headers = {"Content-Type": "application/json"}
+    if api_token:
+        headers["Authorization"] = f"Bearer {api_token}"
+    else:
+        headers.update({"X-Auth-Email": email or "", "X-Auth-Key": api_key or ""})
+    return headers
+
+# ---------------------------- 单元测试 ----------------------------
+class TestCloudflareClient(unittest.TestCase):
+    """API客户端单元测试（本地HTTP服务）"""
+
+    def setUp(self):
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        self.statuses = []
+        statuses = self.statuses
+        bodies = self.bodies = []
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _reply(self):
+                status = statuses.pop(0) if statuses else 200
+                body = bodies.pop(0) if bodies else b'{"success": true, "result": []}'
+                self.send_response(status)
+                if status == 429:
+                    self.send_header("Retry-After", "0")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = _reply
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = CloudflareClient(f"http://127.0.0.1:{self.server.server_address[1]}/",
+                                       backoff=0.01, rate=100)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.client.session.close()
+
+    def test_retries_rate_limit_and_server_errors(self):
+        self.statuses.extend([429, 503])
+        self.assertTrue(self.client.api("GET", "zones/z/dns_records")["success"])
+        stats = self.client.stats()
+        self.assertEqual((stats["requests"], stats["retries"], stats["rate_limited"]), (3, 2, 1))
+
+    def test_post_not_retried_on_server_error(self):
+        self.statuses.append(502)
+        self.client.api("POST", "zones/z/dns_records", {"type": "A"})
+        self.assertEqual(self.client.stats()["requests"], 1)
+        self.assertEqual(self.client.stats()["errors"], 1)
+
+    def test_non_json_response(self):
+        self.statuses.append(520)
+        self.bodies.append(b"<html>error</html>")
+        result = self.client.api("POST", "zones/z/dns_records", {"type": "A"})
+        self.assertFalse(result["success"])
+        self.assertEqual(result["errors"][0]["message"], "无效的API响应: HTTP 520")
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("3"), 3.0)
+        self.assertIsNone(parse_retry_after("soon"))
+        self.assertEqual(parse_retry_after("Thu, 01 Jan 1970 00:00:00 GMT"), 0.0)
+
+if __name__ == "__main__":
+    unittest.main()
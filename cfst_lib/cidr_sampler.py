@@ -0,0 +1,165 @@
+"""
+流式 CIDR 候选IP采样器
+
+直接在整数区间上工作，不展开完整地址列表：
+1. 按分层前缀分层，每层随机抽取 N 个地址；默认与原先的展开方式一致：
+   IPv4 每个 /24 取 1 个，IPv6 每个列出的网段取 256 个（可改为按 /40 等前缀分层）
+2. 每层独立播种，同一 seed 下结果确定且与文件中其他行无关
+3. 支持排除集合（单个IP或CIDR）
+4. 以生成器方式逐个产出候选IP，供测速阶段流式消费
+"""
+
+import bisect
+import ipaddress
+import random
+import unittest
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+DEFAULT_STRATUM = {4: 24, 6: 0}  # 分层前缀长度，0 表示以列出的网段整体为一层
+DEFAULT_PER_PREFIX = {4: 1, 6: 256}  # 每层抽取的地址数
+
+def iter_networks(lines: Iterable[str]) -> Iterator[ipaddress._BaseNetwork]:
+    """逐行解析IP/CIDR，忽略空行与注释"""
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        yield ipaddress.ip_network(line, strict=False)
+
+def _merge_ranges(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    """合并重叠的闭区间"""
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+class CIDRSampler:
+    """分层抽样的候选IP生成器"""
+
+    def __init__(self, per_prefix: int = DEFAULT_PER_PREFIX[4], seed: Optional[int] = None,
+                 exclude: Iterable[str] = (), stratum_v4: int = DEFAULT_STRATUM[4],
+                 stratum_v6: int = DEFAULT_STRATUM[6], per_prefix_v6: int = DEFAULT_PER_PREFIX[6]):
+        """
+        :param per_prefix: IPv4 每个分层前缀抽取的地址数
+        :param seed: 随机种子，None 表示每次运行随机
+        :param exclude: 需要排除的IP或CIDR
+        :param stratum_v4: IPv4 分层前缀长度
+        :param stratum_v6: IPv6 分层前缀长度，0 表示每个列出的网段为一层
+        :param per_prefix_v6: IPv6 每个分层前缀抽取的地址数
+        """
+        self.per_prefix = {4: max(1, per_prefix), 6: max(1, per_prefix_v6)}
+        self.seed = seed if seed is not None else random.randrange(1 << 32)
+        self.stratum = {4: stratum_v4, 6: stratum_v6}
+        ranges = {4: [], 6: []}
+        for network in iter_networks(exclude):
+            ranges[network.version].append(
+                (int(network.network_address), int(network.broadcast_address)))
+        self._excluded = {version: _merge_ranges(r) for version, r in ranges.items()}
+        self._excluded_starts = {version: [r[0] for r in rs] for version, rs in self._excluded.items()}
+
+    def is_excluded(self, version: int, value: int) -> bool:
+        """判断整数形式的地址是否落在排除区间内"""
+        starts = self._excluded_starts[version]
+        i = bisect.bisect_right(starts, value) - 1
+        return i >= 0 and value <= self._excluded[version][i][1]
+
+    def _sample_stratum(self, version: int, start: int, size: int) -> Iterator[int]:
+        """在 [start, start+size) 内抽取最多 per_prefix 个未被排除的地址"""
+        rng = random.Random((self.seed << 136) | (version << 128) | start)
+        wanted = min(self.per_prefix[version], size)
+        if size <= wanted * 4:
+            # 小区间直接随机排列，保证能取满
+            offsets = iter(rng.sample(range(size), size))
+        else:
+            offsets = (rng.randrange(size) for _ in range(wanted * 8))
+        chosen = set()
+        for offset in offsets:
+            if len(chosen) >= wanted:
+                break
+            value = start + offset
+            if value in chosen or self.is_excluded(version, value):
+                continue
+            chosen.add(value)
+            yield value
+
+    def sample_networks(self, networks: Iterable[ipaddress._BaseNetwork]) -> Iterator[str]:
+        """对网络序列逐层抽样，产出IP字符串"""
+        for network in networks:
+            version = network.version
+            address_cls = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+            stratum_prefix = max(self.stratum[version], network.prefixlen)
+            stratum_size = 1 << (network.max_prefixlen - stratum_prefix)
+            base = int(network.network_address)
+            for start in range(base, base + network.num_addresses, stratum_size):
+                for value in self._sample_stratum(version, start, stratum_size):
+                    yield str(address_cls(value))
+
+    def sample_file(self, ip_file: Path) -> Iterator[str]:
+        """流式读取候选文件并抽样"""
+        with open(ip_file, "r", encoding="utf-8") as f:
+            yield from self.sample_networks(iter_networks(f))
+
+    def write_file(self, ip_file: Path, output_file: Path) -> int:
+        """将抽样结果逐行写入文件（供cfst二进制 -f 使用），返回写入数量"""
+        count = 0
+        with open(output_file, "w", encoding="utf-8") as f:
+            for ip in self.sample_file(ip_file):
+                f.write(ip + "\n")
+                count += 1
+        return count
+
+# ---------------------------- 单元测试 ----------------------------
+class TestCIDRSampler(unittest.TestCase):
+    """CIDRSampler 单元测试"""
+
+    def test_stratified_count_and_bounds(self):
+        sampler = CIDRSampler(per_prefix=3, seed=1)
+        ips = list(sampler.sample_networks(iter_networks(["104.16.0.0/22"])))
+        self.assertEqual(len(ips), 12)
+        for i, third in enumerate([0, 1, 2, 3]):
+            block = ips[i * 3:(i + 1) * 3]
+            self.assertTrue(all(ip.startswith(f"104.16.{third}.") for ip in block))
+            self.assertEqual(len(set(block)), 3)
+
+    def test_deterministic_seed(self):
+        lines = ["173.245.48.0/20", "2606:4700::/32"]
+        first = list(CIDRSampler(seed=7).sample_networks(iter_networks(lines)))
+        second = list(CIDRSampler(seed=7).sample_networks(iter_networks(lines)))
+        self.assertEqual(first, second)
+        # 每层独立播种：前后增加其他网段不影响已有网段的结果
+        alone = list(CIDRSampler(seed=7).sample_networks(iter_networks(lines[:1])))
+        self.assertEqual(first[:len(alone)], alone)
+
+    def test_exclusion(self):
+        sampler = CIDRSampler(per_prefix=2, seed=3, exclude=["10.0.0.0/25", "10.0.1.7"])
+        ips = list(sampler.sample_networks(iter_networks(["10.0.0.0/24", "10.0.1.0/29"])))
+        values = [int(ipaddress.ip_address(ip)) for ip in ips]
+        self.assertTrue(all(not sampler.is_excluded(4, v) for v in values))
+        self.assertTrue(all(ip.split(".")[2] == "1" or int(ip.split(".")[3]) >= 128 for ip in ips))
+        self.assertNotIn("10.0.1.7", ips)
+
+    def test_ipv6_density(self):
+        # 默认与原先的展开方式一致：每个列出的IPv6网段取256个地址
+        network = ipaddress.ip_network("2606:4700::/32")
+        ips = list(CIDRSampler(seed=1).sample_networks([network]))
+        self.assertEqual(len(set(ips)), 256)
+        self.assertTrue(all(ipaddress.ip_address(ip) in network for ip in ips))
+        # 可改为按 /40 分层，每层取 per_prefix_v6 个
+        sampler = CIDRSampler(seed=1, stratum_v6=40, per_prefix_v6=2)
+        ips = list(sampler.sample_networks(iter_networks(["2606:4700::/38"])))
+        self.assertEqual(len(ips), 8)
+        self.assertEqual([int(ipaddress.ip_address(ip)) >> 88 for ip in ips][::2],
+                         [(0x26064700 << 8) + i for i in range(4)])
+
+    def test_small_networks_and_single_ips(self):
+        ips = list(CIDRSampler(per_prefix=5, seed=1).sample_networks(
+            iter_networks(["1.1.1.1", "1.0.0.0/30"])))
+        self.assertEqual(ips[0], "1.1.1.1")
+        self.assertEqual(sorted(ips[1:]), ["1.0.0.0", "1.0.0.1", "1.0.0.2", "1.0.0.3"])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,320 @@
+"""
+DDNS 变更日志（JSONL）
+
+每个 类型/colo 一个只追加的日志文件 ddns/<类型>/<colo>.jsonl，每行一次变更：
+    {"ts": "2025-03-29 01:35:30", "op": "add", "domain": "hk.616049.xyz", "ip": "1.1.1.1", "port": 443}
+并维护物化索引 ddns/<类型>/<colo>.index.json（域名 → 当前 ip:port 集合，IPv4/IPv6 均可），
+删除只需追加一行，查询直接读取索引；索引落后于日志时只重放新增的部分，
+日志行数远超当前记录数时自动压缩。
+每次访问都会检查日志大小，常驻进程（monitor.py）也能看到其他进程追加的记录；
+追加与索引写入在文件锁 <colo>.lock 内进行。
+首次使用时从旧格式 <colo>.txt 导入并删除旧文件。
+"""
+
+import json
+import os
+import re
+import threading
+import unittest
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from cfst_lib import BASE_DIR
+from cfst_lib.run_lock import file_lock
+
+JOURNAL_DIR = BASE_DIR / "ddns"
+COMPACT_MIN_LINES = 1000  # 日志行数超过该值且超过当前记录数4倍时压缩
+LEGACY_LINE_RE = re.compile(r"^(.+?) - ([0-9a-fA-F.:]+):(\d+) -> (\S+)")
+
+class DdnsJournal:
+    """单个 类型/colo 的DDNS变更日志与索引"""
+
+    def __init__(self, ip_type: str, colo: str, base_dir: Path = JOURNAL_DIR):
+        directory = Path(base_dir) / ip_type
+        self.journal_file = directory / f"{colo}.jsonl"
+        self.index_file = directory / f"{colo}.index.json"
+        self.legacy_file = directory / f"{colo}.txt"
+        self.lock_file = directory / f"{colo}.lock"
+        self.domains: Dict[str, Dict[str, str]] = {}  # 域名 -> {"ip:port": 添加时间}
+        self.lines = 0
+        self.offset = 0  # 内存中的状态已包含的日志字节数
+        self.inode = None  # 压缩以原子替换实现，inode 变化说明日志已被其他进程改写
+        self._lock = threading.Lock()
+        self._loaded = False
+
+    @contextmanager
+    def _locked(self):
+        """线程锁 + 跨进程文件锁，并同步其他进程的追加"""
+        with self._lock, file_lock(self.lock_file):
+            self._load()
+            yield
+
+    # ---------------------------- 加载 ----------------------------
+    def _load(self):
+        if not self._loaded:
+            if not self.journal_file.exists() and self.legacy_file.exists():
+                self._import_legacy()
+            elif not self._load_index():
+                self._replay()
+            self._loaded = True
+            return
+        inode, size = self._journal_stat()
+        if inode != self.inode or size < self.offset:  # 其他进程压缩了日志
+            if not self._load_index():
+                self._replay()
+        elif size > self.offset:
+            self._replay_tail(self.offset)
+
+    def _load_index(self) -> bool:
+        try:
+            with open(self.index_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            inode, size = self._journal_stat()
+            # 日志被压缩或改写（与索引记录的不是同一文件，或比记录的更小）时完整重放
+            if data["size"] > size or data.get("inode") != inode:
+                return False
+            self.domains = data["domains"]
+            self.lines = data["lines"]
+            self.offset = data["size"]
+            self.inode = inode
+        except (OSError, ValueError, KeyError):
+            return False
+        if self.offset < size:
+            self._replay_tail(self.offset)
+        return True
+
+    def _replay_tail(self, offset: int):
+        """索引落后于日志（例如其他进程追加后未更新索引）时只重放新增的行"""
+        with open(self.journal_file, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                try:
+                    self._apply(json.loads(line))
+                except (ValueError, KeyError):
+                    continue
+                self.lines += 1
+            self.offset = f.tell()
+        self.inode = self._journal_stat()[0]
+        self._save_index()
+
+    def _replay(self):
+        """索引缺失或损坏时重放日志重建"""
+        self.domains, self.lines, self.offset = {}, 0, 0
+        if self.journal_file.exists():
+            with open(self.journal_file, "rb") as f:
+                for line in f:
+                    try:
+                        self._apply(json.loads(line))
+                    except (ValueError, KeyError):
+                        continue  # 跳过写入中断产生的残行
+                    self.lines += 1
+                self.offset = f.tell()
+        self.inode = self._journal_stat()[0]
+        self._save_index()
+
+    def _import_legacy(self):
+        """从旧格式 "时间 - IP:端口 -> 域名" 导入"""
+        entries = []
+        with open(self.legacy_file, "r", encoding="utf-8") as f:
+            for line in f:
+                match = LEGACY_LINE_RE.match(line.strip())
+                if match:
+                    ts, ip, port, domain = match.groups()
+                    entries.append({"ts": ts, "op": "add", "domain": domain, "ip": ip, "port": int(port)})
+        self.domains, self.lines = {}, 0
+        for entry in entries:
+            self._apply(entry)
+        self._rewrite()
+        self.legacy_file.unlink()
+
+    # ---------------------------- 变更 ----------------------------
+    def _apply(self, entry: dict) -> List[str]:
+        """将一条变更应用到索引，返回受影响的 ip:port"""
+        key = f"{entry['ip']}:{entry['port']}" if entry.get("port") is not None else None
+        if entry["op"] == "add":
+            self.domains.setdefault(entry["domain"], {})[key] = entry["ts"]
+            return [key]
+        removed = []
+        for domain, members in self.domains.items():
+            if entry.get("domain") not in (None, domain):
+                continue
+            for member in list(members):
+                if member == key or (key is None and member.rpartition(":")[0] == entry["ip"]):
+                    del members[member]
+                    removed.append(member)
+        return removed
+
+    def _append(self, entry: dict) -> List[str]:
+        """在 _locked() 内调用"""
+        affected = self._apply(entry)
+        self.journal_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.journal_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+        self.inode, self.offset = self._journal_stat()
+        self.lines += 1
+        live = sum(len(members) for members in self.domains.values())
+        if self.lines > COMPACT_MIN_LINES and self.lines > live * 4:
+            self._rewrite()
+        else:
+            self._save_index()
+        return affected
+
+    def add(self, ip: str, port: int, domain: str):
+        with self._locked():
+            self._append({"ts": _now(), "op": "add", "domain": domain, "ip": ip, "port": int(port)})
+
+    def delete(self, ip: str, port: Optional[int] = None, domain: Optional[str] = None) -> List[str]:
+        """删除 ip[:port]，返回被删除的 ip:port 列表（未找到时不写入日志）"""
+        with self._locked():
+            probe = {"op": "delete", "ip": ip, "port": port, "domain": domain}
+            snapshot = {d: dict(m) for d, m in self.domains.items()}
+            found = self._apply(probe)
+            self.domains = snapshot
+            if not found:
+                return []
+            entry = {"ts": _now(), "op": "delete", "ip": ip, "port": None if port is None else int(port)}
+            if domain:
+                entry["domain"] = domain
+            return self._append(entry)
+
+    # ---------------------------- 查询 ----------------------------
+    def current(self) -> Dict[str, List[str]]:
+        """域名 -> 当前 ip:port 列表"""
+        with self._locked():
+            return {domain: list(members) for domain, members in self.domains.items() if members}
+
+    def ports_for(self, domain: str) -> List[int]:
+        """域名下所有IP使用的端口"""
+        return sorted({port for ports in self.ports_by_ip_for(domain).values() for port in ports})
+
+    def ports_by_ip_for(self, domain: str) -> Dict[str, List[int]]:
+        """域名下 IP -> 端口列表"""
+        with self._locked():
+            result: Dict[str, List[int]] = {}
+            for member in self.domains.get(domain, {}):
+                ip, _, port = member.rpartition(":")
+                result.setdefault(ip, []).append(int(port))
+            return {ip: sorted(ports) for ip, ports in result.items()}
+
+    def ports_by_ip(self) -> Dict[str, int]:
+        """IP -> 端口（同一IP多个端口时取最近添加的）"""
+        with self._locked():
+            latest = {}
+            for members in self.domains.values():
+                for member, ts in members.items():
+                    ip, _, port = member.rpartition(":")
+                    if ip not in latest or ts >= latest[ip][0]:
+                        latest[ip] = (ts, int(port))
+            return {ip: port for ip, (_, port) in latest.items()}
+
+    # ---------------------------- 持久化 ----------------------------
+    def _rewrite(self):
+        """压缩：日志仅保留当前仍有效的记录"""
+        entries = [{"ts": ts, "op": "add", "domain": domain, "ip": member.rpartition(":")[0],
+                    "port": int(member.rpartition(":")[2])}
+                   for domain, members in self.domains.items() for member, ts in members.items()]
+        _atomic_write(self.journal_file, "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries))
+        self.lines = len(entries)
+        self.inode, self.offset = self._journal_stat()
+        self._save_index()
+
+    def _journal_stat(self) -> tuple:
+        """(inode, 大小)，日志不存在时为 (None, 0)"""
+        try:
+            stat = self.journal_file.stat()
+        except FileNotFoundError:
+            return None, 0
+        return stat.st_ino, stat.st_size
+
+    def _save_index(self):
+        data = {"lines": self.lines, "size": self.offset, "inode": self.inode,
+                "domains": {d: m for d, m in self.domains.items() if m}}
+        _atomic_write(self.index_file, json.dumps(data, ensure_ascii=False, indent=1))
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _atomic_write(path: Path, content: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(content, encoding="utf-8")
+    os.replace(tmp, path)
+
+_journals: Dict[tuple, DdnsJournal] = {}
+_journals_lock = threading.Lock()
+
+def get_journal(ip_type: str, colo: str, base_dir: Path = JOURNAL_DIR) -> DdnsJournal:
+    """进程内共享的日志实例"""
+    key = (str(base_dir), ip_type, colo)
+    with _journals_lock:
+        if key not in _journals:
+            _journals[key] = DdnsJournal(ip_type, colo, base_dir)
+        return _journals[key]
+
+# ---------------------------- 单元测试 ----------------------------
+class TestDdnsJournal(unittest.TestCase):
+    """DDNS变更日志单元测试"""
+
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.base = Path(tmp.name)
+
+    def test_legacy_import_and_index(self):
+        legacy = self.base / "ipv4" / "HKG.txt"
+        legacy.parent.mkdir(parents=True)
+        legacy.write_text("2025-03-29 01:30:24 - 1.1.1.1:443 -> hk.616049.xyz\n"
+                          "2025-03-29 01:30:26 - 2.2.2.2:8443 -> hk.616049.xyz\n", encoding="utf-8")
+        journal = DdnsJournal("ipv4", "HKG", self.base)
+        self.assertEqual(journal.ports_for("hk.616049.xyz"), [443, 8443])
+        self.assertFalse(legacy.exists())
+
+        self.assertEqual(journal.delete("1.1.1.1", 443), ["1.1.1.1:443"])
+        self.assertEqual(journal.delete("9.9.9.9", 443), [])
+        journal.add("2001:db8::1", 2053, "hk.616049.xyz")
+
+        reopened = DdnsJournal("ipv4", "HKG", self.base)
+        self.assertEqual(reopened.ports_by_ip(), {"2.2.2.2": 8443, "2001:db8::1": 2053})
+        (self.base / "ipv4" / "HKG.index.json").unlink()
+        self.assertEqual(DdnsJournal("ipv4", "HKG", self.base).current(), reopened.current())
+
+    def test_incremental_tail_replay(self):
+        journal = DdnsJournal("ipv6", "HKG", self.base)
+        journal.add("2001:db8::1", 443, "hkv6.616049.xyz")
+        # 模拟其他进程追加日志但未更新索引
+        with open(journal.journal_file, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"ts": _now(), "op": "add", "domain": "hkv6.616049.xyz",
+                                "ip": "2001:db8::1", "port": 2053}) + "\n")
+        reopened = DdnsJournal("ipv6", "HKG", self.base)
+        self.assertEqual(reopened.ports_by_ip_for("hkv6.616049.xyz"), {"2001:db8::1": [443, 2053]})
+        self.assertEqual(reopened.lines, 2)
+        with open(reopened.index_file, encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["size"], reopened.journal_file.stat().st_size)
+
+    def test_long_lived_instance_sees_other_writers(self):
+        monitor = DdnsJournal("ipv4", "SIN", self.base)
+        monitor.add("1.1.1.1", 443, "sg.616049.xyz")
+        DdnsJournal("ipv4", "SIN", self.base).add("1.1.1.1", 2053, "sg.616049.xyz")
+        self.assertEqual(monitor.ports_for("sg.616049.xyz"), [443, 2053])
+
+        # 其他进程压缩日志后重新加载，自身写入的索引也不会跳过他人的记录
+        other = DdnsJournal("ipv4", "SIN", self.base)
+        other.delete("1.1.1.1", 443)
+        other._rewrite()
+        monitor.add("2.2.2.2", 443, "sg.616049.xyz")
+        self.assertEqual(DdnsJournal("ipv4", "SIN", self.base).ports_by_ip_for("sg.616049.xyz"),
+                         {"1.1.1.1": [2053], "2.2.2.2": [443]})
+
+    def test_compaction(self):
+        journal = DdnsJournal("ipv4", "LAX", self.base)
+        for _ in range(COMPACT_MIN_LINES // 2 + 1):
+            journal.add("1.1.1.1", 443, "us.616049.xyz")
+            journal.delete("1.1.1.1", 443)
+        self.assertLess(journal.lines, 10)
+        self.assertEqual(journal.current(), {})
+
+if __name__ == "__main__":
+    unittest.main()
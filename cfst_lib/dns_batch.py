@@ -0,0 +1,106 @@
+"""
+Cloudflare DNS 批量记录接口
+
+将一次运行中的创建/修改/删除操作合并为 POST zones/<zone>/dns_records/batch 请求，
+每个请求最多 BATCH_LIMIT 项。Cloudflare 以事务方式执行单个批量请求（全部成功或全部失败），
+同一请求内按 deletes → patches → puts → posts 的顺序执行，因此同一域名的增删放在同一请求中不会出现无解析窗口。
+"""
+
+import unittest
+from typing import Callable, List, Tuple
+
+BATCH_LIMIT = 200  # 单个批量请求的最大变更数（免费套餐上限）
+ACTIONS = ("deletes", "patches", "puts", "posts")
+
+class DnsBatch:
+    """
+    收集DNS变更并分块提交
+    变更以组为单位添加（通常一个域名一组），组不会被拆分到多个请求中（超过上限时除外）
+    """
+
+    def __init__(self, limit: int = BATCH_LIMIT):
+        self.limit = limit
+        self.groups = []
+
+    def add_group(self, ops: list):
+        """
+        添加一组变更
+        :param ops: [{"action": "posts"/"patches"/"puts"/"deletes", "body": {...}, "tag": 任意附加信息}]
+        """
+        for op in ops:
+            if op["action"] not in ACTIONS:
+                raise ValueError(f"未知的批量操作: {op['action']}")
+        if ops:
+            self.groups.append(list(ops))
+
+    def __len__(self):
+        return sum(len(group) for group in self.groups)
+
+    def chunks(self) -> List[list]:
+        """按上限打包，尽量保持组完整"""
+        chunks, current = [], []
+        for group in self.groups:
+            if current and len(current) + len(group) > self.limit:
+                chunks.append(current)
+                current = []
+            for op in group:
+                if len(current) >= self.limit:
+                    chunks.append(current)
+                    current = []
+                current.append(op)
+        if current:
+            chunks.append(current)
+        return chunks
+
+    def execute(self, request: Callable[[str, str, dict], dict], zone_id: str) -> List[Tuple[dict, bool, dict]]:
+        """
+        提交全部变更
+        :param request: cf_api 形式的请求函数 (method, endpoint, data) -> 响应JSON
+        :return: [(op, 是否成功, 返回的记录)]，顺序与添加顺序一致
+        """
+        results = []
+        for chunk in self.chunks():
+            body = {action: [op["body"] for op in chunk if op["action"] == action] for action in ACTIONS}
+            response = request('POST', f'zones/{zone_id}/dns_records/batch',
+                               {action: items for action, items in body.items() if items})
+            success = bool(response.get('success'))
+            returned = response.get('result') or {}
+            # 每类操作的返回结果与请求中的顺序一一对应
+            positions = dict.fromkeys(ACTIONS, 0)
+            for op in chunk:
+                action = op["action"]
+                items = returned.get(action) or []
+                record = items[positions[action]] if positions[action] < len(items) else {}
+                positions[action] += 1
+                results.append((op, success, record))
+        return results
+
+# ---------------------------- 单元测试 ----------------------------
+class TestDnsBatch(unittest.TestCase):
+    """批量变更单元测试"""
+
+    def test_chunks_keep_groups(self):
+        batch = DnsBatch(limit=4)
+        batch.add_group([{"action": "posts", "body": {"content": str(i)}} for i in range(3)])
+        batch.add_group([{"action": "deletes", "body": {"id": str(i)}} for i in range(2)])
+        batch.add_group([{"action": "posts", "body": {"content": str(i)}} for i in range(5)])
+        self.assertEqual([len(c) for c in batch.chunks()], [3, 2, 4, 1])
+
+    def test_execute_maps_results(self):
+        batch = DnsBatch()
+        batch.add_group([{"action": "posts", "body": {"content": "1.1.1.1"}, "tag": "a"},
+                         {"action": "deletes", "body": {"id": "x"}, "tag": "b"}])
+        calls = []
+
+        def request(method, endpoint, data):
+            calls.append((method, endpoint, data))
+            return {"success": True, "result": {"posts": [{"id": "new", "content": "1.1.1.1"}],
+                                                "deletes": [{"id": "x"}]}}
+
+        results = batch.execute(request, "zone")
+        self.assertEqual(calls[0][1], "zones/zone/dns_records/batch")
+        self.assertEqual(set(calls[0][2]), {"posts", "deletes"})
+        self.assertEqual([(op["tag"], ok, rec["id"]) for op, ok, rec in results], [("a", True, "new"), ("b", True, "x")])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,143 @@
+"""
+健康检查历史（滑动窗口 + 迟滞）
+
+按 类型/域名/IP 保存最近 window 次检测结果与连接耗时，持久化为 history/health.json。
+最近 window 次中失败不少于 threshold 次才判定为故障，偶发的连接失败不会触发重新测速；
+触发维护后重置对应历史，新结果重新累积。
+"""
+
+import json
+import os
+import time
+import unittest
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+from cfst_lib import BASE_DIR
+
+HISTORY_FILE = BASE_DIR / "history" / "health.json"
+DEFAULT_WINDOW = 5
+DEFAULT_THRESHOLD = 3  # 最近 DEFAULT_WINDOW 次中失败次数达到该值判定为故障
+
+class HealthHistory:
+    """单个类型的健康检查历史"""
+
+    def __init__(self, ip_type: str, path: Path = HISTORY_FILE, window: int = DEFAULT_WINDOW,
+                 threshold: int = DEFAULT_THRESHOLD):
+        if not 1 <= threshold <= window:
+            raise ValueError(f"失败阈值需在 1~{window} 之间: {threshold}")
+        self.ip_type = ip_type
+        self.path = Path(path)
+        self.window = window
+        self.threshold = threshold
+        self.data = self._load()
+        # 域名 -> {"samples": [[时间, 成功]], "ips": {IP: [[时间, 成功, 耗时ms]]}}
+        self.domains: Dict[str, dict] = self.data.setdefault(ip_type, {})
+
+    def _load(self) -> dict:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _domain(self, domain: str) -> dict:
+        return self.domains.setdefault(domain, {"samples": [], "ips": {}})
+
+    # ---------------------------- 记录 ----------------------------
+    def record_domain(self, domain: str, ok: bool):
+        samples = self._domain(domain)["samples"]
+        samples.append([int(time.time()), int(ok)])
+        del samples[:-self.window]
+
+    def record_ip(self, domain: str, ip: str, ok: bool, latency: Optional[float] = None):
+        samples = self._domain(domain)["ips"].setdefault(ip, [])
+        samples.append([int(time.time()), int(ok), None if latency is None else round(latency, 1)])
+        del samples[:-self.window]
+
+    def prune(self, domain: str, ips: Iterable[str]):
+        """移除已不再解析到的IP"""
+        current = set(ips)
+        history = self._domain(domain)["ips"]
+        for ip in [ip for ip in history if ip not in current]:
+            del history[ip]
+
+    def reset(self, domain: str, ips: Iterable[str] = None):
+        """触发维护后清空域名（或指定IP）的历史"""
+        entry = self._domain(domain)
+        if ips is None:
+            entry["samples"] = []
+            entry["ips"] = {}
+            return
+        for ip in ips:
+            entry["ips"].pop(ip, None)
+
+    # ---------------------------- 判定 ----------------------------
+    def _is_down(self, samples: List[list]) -> bool:
+        return sum(1 for sample in samples[-self.window:] if not sample[1]) >= self.threshold
+
+    def domain_down(self, domain: str) -> bool:
+        return self._is_down(self.domains.get(domain, {}).get("samples", []))
+
+    def ip_down(self, domain: str, ip: str) -> bool:
+        return self._is_down(self.domains.get(domain, {}).get("ips", {}).get(ip, []))
+
+    def trend(self, domain: str, ip: str = None) -> str:
+        """最近的检测结果，例如 "✓✗✓ 42ms"（平均耗时取成功的样本）"""
+        entry = self.domains.get(domain, {})
+        samples = entry.get("samples", []) if ip is None else entry.get("ips", {}).get(ip, [])
+        marks = "".join("✓" if sample[1] else "✗" for sample in samples)
+        latencies = [sample[2] for sample in samples if len(sample) > 2 and sample[2] is not None]
+        if latencies:
+            marks += f" {sum(latencies) / len(latencies):.0f}ms"
+        return marks
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(self.data, ensure_ascii=False, separators=(",", ":")), encoding="utf-8")
+        os.replace(tmp, self.path)
+
+# ---------------------------- 单元测试 ----------------------------
+class TestHealthHistory(unittest.TestCase):
+    """健康历史单元测试"""
+
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "health.json"
+
+    def test_hysteresis_window(self):
+        history = HealthHistory("ipv4", self.path, window=5, threshold=3)
+        for ok in (False, True, False):
+            history.record_domain("hk.example.com", ok)
+            history.record_ip("hk.example.com", "1.1.1.1", ok, 40.0 if ok else None)
+        self.assertFalse(history.domain_down("hk.example.com"))
+        history.record_domain("hk.example.com", False)
+        self.assertTrue(history.domain_down("hk.example.com"))
+        self.assertEqual(history.trend("hk.example.com", "1.1.1.1"), "✗✓✗ 40ms")
+
+        # 旧的失败滑出窗口后恢复
+        for _ in range(3):
+            history.record_domain("hk.example.com", True)
+        self.assertFalse(history.domain_down("hk.example.com"))
+
+    def test_persistence_prune_and_reset(self):
+        history = HealthHistory("ipv4", self.path, window=3, threshold=1)
+        history.record_ip("hk.example.com", "1.1.1.1", False)
+        history.record_ip("hk.example.com", "2.2.2.2", True)
+        history.save()
+
+        reloaded = HealthHistory("ipv4", self.path, window=3, threshold=1)
+        self.assertTrue(reloaded.ip_down("hk.example.com", "1.1.1.1"))
+        reloaded.prune("hk.example.com", ["1.1.1.1"])
+        self.assertEqual(list(reloaded.domains["hk.example.com"]["ips"]), ["1.1.1.1"])
+        reloaded.reset("hk.example.com", ["1.1.1.1"])
+        self.assertFalse(reloaded.ip_down("hk.example.com", "1.1.1.1"))
+        self.assertEqual(HealthHistory("ipv6", self.path).domains, {})
+        with self.assertRaises(ValueError):
+            HealthHistory("ipv4", self.path, window=2, threshold=3)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,328 @@
+"""
+原生 asyncio HTTPing 延迟测试引擎
+
+作为外部 cfst 二进制的替代：
+1. 对候选IP发送 HTTP HEAD 请求（携带 SNI/Host），按 keep-alive 连接多次采样
+2. 从 cf-ray 响应头读取地区码(Colo)
+3. 有界并发，统计丢包率与平均延迟
+4. 输出与 cfst 相同列的 CSV，供 cfst.py 的 _process_results 直接解析
+5. 分阶段计时探测（TCP连接/TLS握手/首字节），供 ip_checker.py 的 HTTP 检测模式使用
+"""
+
+import asyncio
+import csv
+import ipaddress
+import math
+import socket
+import ssl
+import time
+import unittest
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+CSV_HEADER = ["IP 地址", "已发送", "已接收", "丢包率", "平均延迟", "下载速度 (MB/s)", "地区码(Colo)"]
+DEFAULT_HOST = "cloudflare.cdn.openbsd.org"
+HTTP_PORTS = {80, 8080, 8880, 2052, 2082, 2086, 2095}  # Cloudflare 明文HTTP端口
+OK_STATUS = {200, 301, 302}
+
+class IPStats:
+    """单个IP的采样统计"""
+
+    def __init__(self, ip: str, port: int):
+        self.ip = ip
+        self.port = port
+        self.sent = 0
+        self.received = 0
+        self.latencies = []
+        self.colo = ""
+
+    @property
+    def loss_rate(self) -> float:
+        return 1 - self.received / self.sent if self.sent else 1.0
+
+    @property
+    def avg_latency(self) -> float:
+        return sum(self.latencies) / len(self.latencies) if self.latencies else 0.0
+
+    def to_row(self) -> list:
+        return [self.ip, self.sent, self.received, f"{self.loss_rate:.2f}",
+                f"{self.avg_latency:.2f}", "0.00", self.colo]
+
+def parse_colo(cf_ray: str) -> str:
+    """从 cf-ray 头解析地区码，例如 8f1a2b3c4d5e6f7a-HKG -> HKG"""
+    if not cf_ray or "-" not in cf_ray:
+        return ""
+    return cf_ray.rsplit("-", 1)[1].strip().upper()
+
+async def _open(ip: str, port: int, host: str, timeout: float, ssl_context):
+    """建立到IP的连接（TLS 时以 host 作为 SNI）"""
+    if ssl_context is None:
+        return await asyncio.wait_for(asyncio.open_connection(ip, port), timeout)
+    return await asyncio.wait_for(
+        asyncio.open_connection(ip, port, ssl=ssl_context, server_hostname=host), timeout)
+
+async def _head(reader, writer, host: str, path: str, timeout: float):
+    """发送 HEAD 请求并读取响应头，返回 (状态码, 头部字典)"""
+    writer.write(
+        f"HEAD {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: cfst-httping\r\n"
+        f"Connection: keep-alive\r\n\r\n".encode()
+    )
+    await writer.drain()
+    raw = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    lines = raw.decode("latin-1").split("\r\n")
+    status = int(lines[0].split()[1])
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            key, value = line.split(":", 1)
+            headers[key.strip().lower()] = value.strip()
+    return status, headers
+
+def _close(writer):
+    try:
+        writer.close()
+    except Exception:
+        pass
+
+async def probe_ip(ip: str, port: int, host: str = DEFAULT_HOST, path: str = "/",
+                   samples: int = 4, timeout: float = 2.0, ssl_context=None) -> IPStats:
+    """
+    对单个IP执行 HTTPing
+    首个请求用于预热连接并读取 cf-ray，其后 samples 次请求计时（与 cfst -httping 一致）
+    """
+    stats = IPStats(ip, port)
+    writer = None
+    try:
+        reader, writer = await _open(ip, port, host, timeout, ssl_context)
+        status, headers = await _head(reader, writer, host, path, timeout)
+        if status not in OK_STATUS:
+            stats.sent = samples
+            return stats
+        stats.colo = parse_colo(headers.get("cf-ray", ""))
+        keep_alive = headers.get("connection", "").lower() != "close"
+
+        for _ in range(samples):
+            stats.sent += 1
+            start = time.perf_counter()
+            try:
+                if not keep_alive:
+                    _close(writer)
+                    reader, writer = await _open(ip, port, host, timeout, ssl_context)
+                status, headers = await _head(reader, writer, host, path, timeout)
+            except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                keep_alive = False
+                continue
+            if status in OK_STATUS:
+                stats.received += 1
+                stats.latencies.append((time.perf_counter() - start) * 1000)
+            keep_alive = headers.get("connection", "").lower() != "close"
+    except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+        stats.sent = max(stats.sent, samples)
+    finally:
+        if writer is not None:
+            _close(writer)
+    return stats
+
+class TimingStats:
+    """单个 IP:端口 的分阶段耗时采样（毫秒）"""
+
+    def __init__(self, ip: str, port: int):
+        self.ip = ip
+        self.port = port
+        self.connect: List[float] = []
+        self.tls: List[float] = []
+        self.ttfb: List[float] = []
+        self.colo = ""
+        self.status = 0
+        self.failures = 0
+        self.last_error = ""
+
+    @property
+    def ok(self) -> bool:
+        return bool(self.ttfb)
+
+    def percentiles(self) -> Dict[str, Tuple[float, float]]:
+        """各阶段的 (p50, p95)，无样本的阶段不返回"""
+        return {name: (percentile(values, 50), percentile(values, 95))
+                for name, values in (("connect", self.connect), ("tls", self.tls), ("ttfb", self.ttfb))
+                if values}
+
+def percentile(values: List[float], pct: float) -> float:
+    """最近秩法百分位数"""
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+async def probe_timings(ip: str, port: int, host: str = DEFAULT_HOST, path: str = "/",
+                        samples: int = 4, timeout: float = 2.0, ssl_context=None) -> TimingStats:
+    """
+    每次采样新建连接，分别记录TCP连接、TLS握手（明文HTTP端口跳过）与首字节（响应头）耗时，
+    并从 cf-ray 读取实际服务的地区码；任何HTTP状态码均视为可达
+    """
+    stats = TimingStats(ip, port)
+    if port in HTTP_PORTS:
+        ssl_context = None
+    elif ssl_context is None:
+        ssl_context = ssl.create_default_context()
+    loop = asyncio.get_running_loop()
+    family = socket.AF_INET6 if ipaddress.ip_address(ip).version == 6 else socket.AF_INET
+
+    for _ in range(samples):
+        sock = socket.socket(family, socket.SOCK_STREAM)
+        sock.setblocking(False)
+        writer = None
+        try:
+            start = time.perf_counter()
+            await asyncio.wait_for(loop.sock_connect(sock, (ip, port)), timeout)
+            connected = time.perf_counter()
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(
+                sock=sock, ssl=ssl_context, server_hostname=host if ssl_context else None), timeout)
+            handshaken = time.perf_counter()
+            status, headers = await _head(reader, writer, host, path, timeout)
+            done = time.perf_counter()
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as e:
+            stats.failures += 1
+            stats.last_error = f"{type(e).__name__}: {str(e)}"
+            continue
+        finally:
+            if writer is not None:
+                _close(writer)
+            else:
+                sock.close()
+        stats.connect.append((connected - start) * 1000)
+        if ssl_context is not None:
+            stats.tls.append((handshaken - connected) * 1000)
+        stats.ttfb.append((done - handshaken) * 1000)
+        stats.status = status
+        stats.colo = parse_colo(headers.get("cf-ray", "")) or stats.colo
+    return stats
+
+async def sweep(ips: Iterable[str], port: int, host: str = DEFAULT_HOST, path: str = "/",
+                samples: int = 4, timeout: float = 2.0, concurrency: int = 200,
+                ssl_context=None) -> List[IPStats]:
+    """
+    有界并发地测试候选IP
+    候选IP以迭代器方式逐个取用，不会一次性展开到内存；仅保留有响应的IP统计
+    """
+    if ssl_context is None and port not in HTTP_PORTS:
+        ssl_context = ssl.create_default_context()
+    if port in HTTP_PORTS:
+        ssl_context = None
+
+    iterator = iter(ips)
+    results = []
+
+    async def worker():
+        for ip in iterator:
+            stats = await probe_ip(ip, port, host, path, samples, timeout, ssl_context)
+            if stats.received:
+                results.append(stats)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return results
+
+def filter_and_sort(stats: List[IPStats], colos: Optional[Iterable[str]] = None,
+                    max_latency: float = 9999, min_latency: float = 0,
+                    max_loss: float = 1.0) -> List[IPStats]:
+    """按延迟上下限、丢包率与地区码过滤，并按 (丢包率, 平均延迟) 排序"""
+    wanted = {c.upper() for c in colos} if colos else None
+    selected = [
+        s for s in stats
+        if (wanted is None or s.colo in wanted)
+        and min_latency <= s.avg_latency <= max_latency
+        and s.loss_rate <= max_loss
+    ]
+    return sorted(selected, key=lambda s: (s.loss_rate, s.avg_latency))
+
+def write_csv(stats: List[IPStats], result_file: Path):
+    """以 cfst 相同的列格式写出结果"""
+    with open(result_file, "w", encoding="utf-8", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(CSV_HEADER)
+        for s in stats:
+            writer.writerow(s.to_row())
+
+def run_httping(candidates: Iterable[str], result_file: Path, colos: Optional[Iterable[str]] = None,
+                port: int = 443, host: str = DEFAULT_HOST, samples: int = 4,
+                concurrency: int = 200, timeout: float = 2.0, max_latency: float = 9999,
+                min_latency: float = 0, max_loss: float = 1.0, ssl_context=None) -> List[IPStats]:
+    """同步入口：流式测试候选IP、过滤排序并写出CSV，返回写出的统计列表"""
+    stats = asyncio.run(sweep(candidates, port, host, samples=samples,
+                              timeout=timeout, concurrency=concurrency, ssl_context=ssl_context))
+    selected = filter_and_sort(stats, colos, max_latency, min_latency, max_loss)
+    write_csv(selected, result_file)
+    return selected
+
+# ---------------------------- 单元测试 ----------------------------
+class TestHTTPing(unittest.TestCase):
+    """使用本地 TLS 替身服务器测试 HTTPing 引擎"""
+
+    @classmethod
+    def setUpClass(cls):
+        import shutil
+        import subprocess
+        import tempfile
+        if not shutil.which("openssl"):
+            raise unittest.SkipTest("缺少 openssl，无法生成测试证书")
+        tmp = tempfile.TemporaryDirectory()
+        cls.addClassCleanup(tmp.cleanup)
+        cls.tmp = Path(tmp.name)
+        cls.cert, cls.key = cls.tmp / "cert.pem", cls.tmp / "key.pem"
+        subprocess.run(
+            ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1",
+             "-subj", f"/CN={DEFAULT_HOST}", "-keyout", str(cls.key), "-out", str(cls.cert)],
+            check=True, capture_output=True)
+
+    async def _serve(self, coro):
+        server_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        server_ctx.load_cert_chain(self.cert, self.key)
+        seen_sni = []
+        server_ctx.sni_callback = lambda sock, name, ctx: seen_sni.append(name)
+
+        async def handle(reader, writer):
+            try:
+                while True:
+                    await reader.readuntil(b"\r\n\r\n")
+                    writer.write(b"HTTP/1.1 200 OK\r\ncf-ray: 8f1a2b3c4d5e6f7a-HKG\r\n"
+                                 b"Content-Length: 0\r\n\r\n")
+                    await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionError):
+                writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0, ssl=server_ctx)
+        port = server.sockets[0].getsockname()[1]
+        client_ctx = ssl.create_default_context(cafile=str(self.cert))
+        async with server:
+            result = await coro(port, client_ctx)
+        return result, seen_sni
+
+    def test_probe_reads_colo_and_stats(self):
+        stats, sni = asyncio.run(self._serve(
+            lambda port, ctx: probe_ip("127.0.0.1", port, samples=3, ssl_context=ctx)))
+        self.assertEqual((stats.sent, stats.received, stats.colo), (3, 3, "HKG"))
+        self.assertEqual(stats.loss_rate, 0)
+        self.assertIn(DEFAULT_HOST, sni)
+
+    def test_probe_timings_percentiles(self):
+        stats, _ = asyncio.run(self._serve(
+            lambda port, ctx: probe_timings("127.0.0.1", port, samples=4, ssl_context=ctx)))
+        self.assertTrue(stats.ok)
+        self.assertEqual((len(stats.connect), len(stats.tls), len(stats.ttfb)), (4, 4, 4))
+        self.assertEqual((stats.colo, stats.status, stats.failures), ("HKG", 200, 0))
+        self.assertEqual(set(stats.percentiles()), {"connect", "tls", "ttfb"})
+        self.assertEqual(percentile([4.0, 1.0, 3.0, 2.0], 50), 2.0)
+        self.assertEqual(percentile([4.0, 1.0, 3.0, 2.0], 95), 4.0)
+
+    def test_sweep_skips_unreachable_and_writes_csv(self):
+        results, _ = asyncio.run(self._serve(
+            lambda port, ctx: sweep(["127.0.0.1", "127.0.0.2"], port, samples=2,
+                                    timeout=0.5, concurrency=2, ssl_context=ctx)))
+        self.assertEqual([s.ip for s in results], ["127.0.0.1"])
+        out = self.tmp / "result.csv"
+        write_csv(filter_and_sort(results, colos=["HKG"]), out)
+        with open(out, encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(rows[0]["IP 地址"], "127.0.0.1")
+        self.assertEqual(rows[0]["地区码(Colo)"], "HKG")
+
+if __name__ == "__main__":
+    unittest.main()
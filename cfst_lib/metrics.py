@@ -0,0 +1,161 @@
+"""
+运行指标采集与导出
+
+按 colo/阶段 记录开始、结束、耗时及附加计数（IP数、下载字节数、API调用数等），
+运行结束后导出为 JSON 运行报告与 Prometheus textfile collector 格式文件。
+"""
+
+import json
+import os
+import threading
+import time
+import unittest
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Optional
+
+class RunMetrics:
+    """单次运行的分阶段指标（线程安全）"""
+
+    def __init__(self, ip_type: str, job: str = "cfst"):
+        self.ip_type = ip_type
+        self.job = job
+        self.started_at = time.time()
+        self.finished_at = None
+        self.stages = []
+        self.counters = Counter()
+        self.colo_results = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str, colo: Optional[str] = None, **fields):
+        """
+        记录一个阶段；可在 with 块内向返回的字典写入计数字段，例如 record["ips"] = 100
+        阶段内抛出异常时状态记为 error 并继续向上抛出
+        """
+        record = {"stage": name, "colo": colo or "ALL", "status": "ok", **fields}
+        start = time.time()
+        perf_start = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record["status"] = "error"
+            raise
+        finally:
+            record["start"] = datetime.fromtimestamp(start).isoformat()
+            record["end"] = datetime.now().isoformat()
+            record["duration_s"] = round(time.perf_counter() - perf_start, 4)
+            with self._lock:
+                self.stages.append(record)
+
+    def count(self, name: str, value: float = 1):
+        """累加运行级计数，例如 api_calls"""
+        with self._lock:
+            self.counters[name] += value
+
+    def set_colo_result(self, colo: str, success: bool):
+        with self._lock:
+            self.colo_results[colo] = success
+
+    def finish(self):
+        self.finished_at = time.time()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            finished = self.finished_at or time.time()
+            return {
+                "job": self.job,
+                "type": self.ip_type,
+                "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+                "finished_at": datetime.fromtimestamp(finished).isoformat(),
+                "duration_s": round(finished - self.started_at, 4),
+                "colos": dict(self.colo_results),
+                "counters": dict(self.counters),
+                "stages": list(self.stages),
+            }
+
+    def write_json(self, path: Path):
+        """写出 JSON 运行报告"""
+        _atomic_write(Path(path), json.dumps(self.to_dict(), ensure_ascii=False, indent=2))
+
+    def to_prometheus(self) -> str:
+        """生成 Prometheus 文本格式（同一 colo/阶段 多次出现时累加）"""
+        report = self.to_dict()
+        labels = f'job="{self.job}",type="{self.ip_type}"'
+        durations = defaultdict(float)
+        gauges = defaultdict(float)
+        errors = defaultdict(int)
+        for record in report["stages"]:
+            key = (record["colo"], record["stage"])
+            durations[key] += record["duration_s"]
+            errors[key] += record["status"] != "ok"
+            for field, value in record.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and field != "duration_s":
+                    gauges[(field,) + key] += value
+
+        lines = [
+            "# HELP cfst_stage_duration_seconds 各阶段耗时",
+            "# TYPE cfst_stage_duration_seconds gauge",
+        ]
+        for (colo, stage), value in sorted(durations.items()):
+            lines.append(f'cfst_stage_duration_seconds{{{labels},colo="{colo}",stage="{stage}"}} {value:.4f}')
+        lines += ["# HELP cfst_stage_errors 各阶段失败次数", "# TYPE cfst_stage_errors gauge"]
+        for (colo, stage), value in sorted(errors.items()):
+            lines.append(f'cfst_stage_errors{{{labels},colo="{colo}",stage="{stage}"}} {value}')
+        lines += ["# HELP cfst_stage_value 各阶段附加计数（IP数、字节数、API调用数等）",
+                  "# TYPE cfst_stage_value gauge"]
+        for (field, colo, stage), value in sorted(gauges.items()):
+            lines.append(f'cfst_stage_value{{{labels},colo="{colo}",stage="{stage}",field="{field}"}} {value:g}')
+        lines += ["# HELP cfst_run_counter 运行级计数", "# TYPE cfst_run_counter gauge"]
+        for name, value in sorted(report["counters"].items()):
+            lines.append(f'cfst_run_counter{{{labels},name="{name}"}} {value:g}')
+        lines += ["# HELP cfst_colo_success colo测试结果（1成功/0失败）", "# TYPE cfst_colo_success gauge"]
+        for colo, success in sorted(report["colos"].items()):
+            lines.append(f'cfst_colo_success{{{labels},colo="{colo}"}} {int(success)}')
+        lines += [
+            "# HELP cfst_run_duration_seconds 整体运行耗时",
+            "# TYPE cfst_run_duration_seconds gauge",
+            f"cfst_run_duration_seconds{{{labels}}} {report['duration_s']:.4f}",
+            "# HELP cfst_run_finished_timestamp_seconds 运行结束时间",
+            "# TYPE cfst_run_finished_timestamp_seconds gauge",
+            f"cfst_run_finished_timestamp_seconds{{{labels}}} {self.finished_at or time.time():.0f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: Path):
+        """写出 textfile collector 文件（先写临时文件再重命名，避免被读到半成品）"""
+        _atomic_write(Path(path), self.to_prometheus())
+
+def _atomic_write(path: Path, content: str):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    tmp.write_text(content, encoding="utf-8")
+    os.replace(tmp, path)
+
+# ---------------------------- 单元测试 ----------------------------
+class TestRunMetrics(unittest.TestCase):
+    """RunMetrics 单元测试"""
+
+    def test_stage_records_and_exports(self):
+        metrics = RunMetrics("ipv4")
+        with metrics.stage("latency", "HKG") as record:
+            record["ips"] = 120
+        with self.assertRaises(RuntimeError):
+            with metrics.stage("download", "HKG"):
+                raise RuntimeError("boom")
+        metrics.count("api_calls", 3)
+        metrics.set_colo_result("HKG", False)
+        metrics.finish()
+
+        report = metrics.to_dict()
+        self.assertEqual([s["status"] for s in report["stages"]], ["ok", "error"])
+        self.assertEqual(report["stages"][0]["ips"], 120)
+        text = metrics.to_prometheus()
+        self.assertIn('cfst_stage_value{job="cfst",type="ipv4",colo="HKG",stage="latency",field="ips"} 120', text)
+        self.assertIn('cfst_stage_errors{job="cfst",type="ipv4",colo="HKG",stage="download"} 1', text)
+        self.assertIn('cfst_run_counter{job="cfst",type="ipv4",name="api_calls"} 3', text)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,166 @@
+"""
+测速历史存储（SQLite）
+
+记录每一次延迟探测与下载测速结果，按 ip_type/colo/port/时间 建立索引，
+用于热启动时挑选各colo历史表现最好的IP优先测试。
+"""
+
+import csv
+import sqlite3
+import threading
+import time
+import unittest
+from contextlib import closing
+from pathlib import Path
+from typing import Iterable, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS probes (
+    id INTEGER PRIMARY KEY,
+    ip_type TEXT NOT NULL,
+    colo TEXT NOT NULL,
+    ip TEXT NOT NULL,
+    port INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    sent INTEGER,
+    received INTEGER,
+    loss REAL,
+    latency REAL,
+    speed REAL
+);
+CREATE INDEX IF NOT EXISTS idx_probes_colo ON probes (ip_type, colo, port, ts);
+CREATE INDEX IF NOT EXISTS idx_probes_ip ON probes (ip_type, ip, port, ts);
+"""
+
+def _to_float(value, default=None):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def _to_int(value, default=None):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return default
+
+class ProbeStore:
+    """测速历史存储，首次使用时才创建数据库文件"""
+
+    def __init__(self, db_path: Path):
+        self.db_path = Path(db_path)
+        self._lock = threading.RLock()
+        self._initialized = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    conn.executescript(SCHEMA)
+                    self._initialized = True
+        return conn
+
+    def record(self, ip_type: str, rows: Iterable[dict], ts: Optional[float] = None) -> int:
+        """
+        批量写入记录
+        :param rows: 字典序列，键为 colo/ip/port/sent/received/loss/latency/speed
+        :return: 写入条数
+        """
+        ts = ts or time.time()
+        values = [
+            (ip_type, r["colo"], r["ip"], r["port"], ts, r.get("sent"), r.get("received"),
+             r.get("loss"), r.get("latency"), r.get("speed"))
+            for r in rows
+        ]
+        if not values:
+            return 0
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        with self._lock, closing(self._connect()) as conn, conn:
+            conn.executemany(
+                "INSERT INTO probes (ip_type, colo, ip, port, ts, sent, received, loss, latency, speed) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", values)
+        return len(values)
+
+    def record_result_file(self, ip_type: str, result_file: Path, colo: str, port: int) -> int:
+        """
+        导入cfst结果CSV（延迟或下载结果均可）
+        行内 地区码(Colo) 列优先，缺失时使用传入的 colo
+        """
+        if not Path(result_file).exists():
+            return 0
+        rows = []
+        with open(result_file, "r", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                ip = row.get("IP 地址", "").strip()
+                if not ip:
+                    continue
+                rows.append({
+                    "colo": (row.get("地区码(Colo)") or colo).strip().upper(),
+                    "ip": ip,
+                    "port": port,
+                    "sent": _to_int(row.get("已发送")),
+                    "received": _to_int(row.get("已接收")),
+                    "loss": _to_float(row.get("丢包率")),
+                    "latency": _to_float(row.get("平均延迟")),
+                    "speed": _to_float(row.get("下载速度 (MB/s)"), 0.0),
+                })
+        return self.record(ip_type, rows)
+
+    def best_ips(self, ip_type: str, colo: str, port: int, limit: int,
+                 max_age_days: float = 30) -> List[str]:
+        """按历史平均下载速度（其次平均延迟）返回最佳IP"""
+        if not self.db_path.exists():
+            return []
+        since = time.time() - max_age_days * 86400
+        with closing(self._connect()) as conn:
+            cursor = conn.execute(
+                "SELECT ip FROM probes "
+                "WHERE ip_type = ? AND colo = ? AND port = ? AND ts >= ? AND speed > 0 "
+                "GROUP BY ip ORDER BY AVG(speed) DESC, AVG(latency) ASC LIMIT ?",
+                (ip_type, colo.upper(), port, since, limit))
+            return [row[0] for row in cursor]
+
+    def prune(self, max_age_days: float = 90) -> int:
+        """删除过期记录，返回删除条数"""
+        if not self.db_path.exists():
+            return 0
+        with self._lock, closing(self._connect()) as conn, conn:
+            cursor = conn.execute("DELETE FROM probes WHERE ts < ?",
+                                  (time.time() - max_age_days * 86400,))
+            return cursor.rowcount
+
+# ---------------------------- 单元测试 ----------------------------
+class TestProbeStore(unittest.TestCase):
+    """ProbeStore 单元测试"""
+
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.tmp = Path(tmp.name)
+        self.store = ProbeStore(self.tmp / "probes.db")
+
+    def test_best_ips_ranks_by_average_speed(self):
+        self.store.record("ipv4", [
+            {"colo": "HKG", "ip": "1.1.1.1", "port": 443, "speed": 10.0, "latency": 80},
+            {"colo": "HKG", "ip": "1.1.1.2", "port": 443, "speed": 30.0, "latency": 90},
+            {"colo": "HKG", "ip": "1.1.1.3", "port": 443, "speed": 0.0, "latency": 20},
+            {"colo": "LAX", "ip": "1.1.1.4", "port": 443, "speed": 99.0, "latency": 20},
+        ])
+        self.store.record("ipv4", [{"colo": "HKG", "ip": "1.1.1.2", "port": 443, "speed": 2.0}])
+        self.assertEqual(self.store.best_ips("ipv4", "HKG", 443, 5), ["1.1.1.2", "1.1.1.1"])
+        self.assertEqual(self.store.best_ips("ipv6", "HKG", 443, 5), [])
+
+    def test_record_result_file_and_prune(self):
+        csv_file = self.tmp / "HKG.csv"
+        csv_file.write_text(
+            "IP 地址,已发送,已接收,丢包率,平均延迟,下载速度 (MB/s),地区码(Colo)\n"
+            "1.0.0.1,4,4,0.00,50.00,12.50,HKG\n"
+            "1.0.0.2,4,3,0.25,70.00,0.00,NRT\n", encoding="utf-8")
+        self.assertEqual(self.store.record_result_file("ipv4", csv_file, "HKG", 443), 2)
+        self.assertEqual(self.store.best_ips("ipv4", "HKG", 443, 5), ["1.0.0.1"])
+        self.assertEqual(self.store.prune(max_age_days=-1), 2)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+"""
+测速结果 Top-K 排名
+
+对 cfst 结果 CSV 按综合评分单遍流式选出前K名：
+    score = speed * w_speed - latency * w_latency - loss * w_loss
+其中 speed 单位 MB/s，latency 单位 ms，loss 为 0~1 的丢包率。
+默认权重仅按下载速度排名；大文件在安装了 NumPy 时走向量化路径。
+"""
+
+import csv
+import heapq
+import os
+import unittest
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy 为可选依赖
+    np = None
+
+DEFAULT_WEIGHTS = {"speed": 1.0, "latency": 0.0, "loss": 0.0}
+NUMPY_MIN_BYTES = 8 * 1024 * 1024  # 超过该大小的结果文件使用 NumPy 路径
+
+COL_IP = "IP 地址"
+COL_LOSS = "丢包率"
+COL_LATENCY = "平均延迟"
+COL_SPEED = "下载速度 (MB/s)"
+
+Row = Tuple[str, float, float, float]  # (ip, speed, latency, loss)
+
+def parse_weights(text: str) -> Dict[str, float]:
+    """解析 "speed=1,latency=0.01,loss=10" 形式的权重，未指定的项使用默认值"""
+    weights = dict(DEFAULT_WEIGHTS)
+    for part in filter(None, (p.strip() for p in (text or "").split(","))):
+        key, _, value = part.partition("=")
+        key = key.strip()
+        if key not in weights:
+            raise ValueError(f"未知的评分项: {key}")
+        weights[key] = float(value)
+    return weights
+
+def score(speed: float, latency: float, loss: float, weights: Dict[str, float]) -> float:
+    return speed * weights["speed"] - latency * weights["latency"] - loss * weights["loss"]
+
+def _to_float(value: str, default: float = 0.0) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return default
+
+def iter_rows(result_file: Path) -> Iterator[Row]:
+    """流式读取结果文件，跳过IP或速度缺失/无效的行"""
+    with open(result_file, "r", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            ip = (row.get(COL_IP) or "").strip()
+            speed = (row.get(COL_SPEED) or "").strip()
+            if not ip or not speed:
+                continue
+            try:
+                speed_value = float(speed)
+            except ValueError:
+                continue
+            yield ip, speed_value, _to_float(row.get(COL_LATENCY)), _to_float(row.get(COL_LOSS))
+
+def top_k(rows: Iterable[Row], k: int, weights: Dict[str, float] = None) -> List[Row]:
+    """
+    基于最小堆的单遍 Top-K，内存占用 O(k)
+    同分时保留文件中靠前的行（与稳定排序一致）
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    if k <= 0:
+        return []
+    heap = []
+    for index, row in enumerate(rows):
+        item = (score(row[1], row[2], row[3], weights), -index, row)
+        if len(heap) < k:
+            heapq.heappush(heap, item)
+        elif item > heap[0]:
+            heapq.heapreplace(heap, item)
+    return [row for _, _, row in sorted(heap, key=lambda item: (-item[0], -item[1]))]
+
+def top_k_numpy(result_file: Path, k: int, weights: Dict[str, float] = None) -> List[Row]:
+    """
+    NumPy 向量化路径：数值列一次性载入后用 argpartition 选出前K名，
+    再单遍回读文件取出对应行的IP（NumPy 跳过空行，回读时按同样过滤后的行号对应）
+    """
+    weights = weights or DEFAULT_WEIGHTS
+    with open(result_file, "r", encoding="utf-8") as f:
+        header = next(csv.reader(f))
+        cols = [header.index(COL_IP), header.index(COL_SPEED),
+                header.index(COL_LATENCY), header.index(COL_LOSS)]
+        try:
+            data = np.loadtxt(f, delimiter=",", usecols=cols[1:], dtype=float, ndmin=2, comments=None)
+        except ValueError:
+            # 存在空字段时使用较慢但容错的 genfromtxt
+            f.seek(0)
+            next(f)
+            data = np.genfromtxt(f, delimiter=",", usecols=cols[1:], dtype=float, ndmin=2, comments=None)
+    if data.size == 0 or k <= 0:
+        return []
+    speed, latency, loss = data[:, 0], np.nan_to_num(data[:, 1]), np.nan_to_num(data[:, 2])
+    scores = speed * weights["speed"] - latency * weights["latency"] - loss * weights["loss"]
+    scores[np.isnan(speed)] = -np.inf
+    k = min(k, int(np.count_nonzero(~np.isnan(speed))))
+    if k == 0:
+        return []
+    candidates = np.argpartition(-scores, k - 1)[:k] if k < len(scores) else np.arange(len(scores))
+    order = candidates[np.lexsort((candidates, -scores[candidates]))]
+
+    wanted = {int(i): rank for rank, i in enumerate(order)}
+    ips = [""] * len(order)
+    with open(result_file, "r", encoding="utf-8") as f:
+        next(f)
+        for index, line in enumerate(line for line in f if line.strip()):
+            if index in wanted:
+                ips[wanted[index]] = line.split(",")[cols[0]].strip()
+    return [(ips[rank], float(speed[i]), float(latency[i]), float(loss[i]))
+            for rank, i in enumerate(order)]
+
+def rank_result_file(result_file: Path, k: int, weights: Dict[str, float] = None) -> List[Row]:
+    """按文件大小自动选择流式或 NumPy 路径"""
+    if np is not None and os.path.getsize(result_file) >= NUMPY_MIN_BYTES:
+        try:
+            return top_k_numpy(result_file, k, weights)
+        except ValueError:
+            pass  # 格式不规则时回退流式路径
+    return top_k(iter_rows(result_file), k, weights)
+
+# ---------------------------- 单元测试 ----------------------------
+class TestRanking(unittest.TestCase):
+    """Top-K 排名单元测试"""
+
+    ROWS = [("1.0.0.1", 10.0, 200.0, 0.0), ("1.0.0.2", 12.0, 50.0, 0.5),
+            ("1.0.0.3", 10.0, 60.0, 0.0), ("1.0.0.4", 3.0, 40.0, 0.0)]
+
+    def test_speed_only_matches_stable_sort(self):
+        expected = sorted(self.ROWS, key=lambda r: r[1], reverse=True)[:3]
+        self.assertEqual(top_k(iter(self.ROWS), 3), expected)
+
+    def test_composite_weights(self):
+        weights = parse_weights("latency=0.05,loss=20")
+        self.assertEqual([r[0] for r in top_k(self.ROWS, 2, weights)], ["1.0.0.3", "1.0.0.4"])
+        with self.assertRaises(ValueError):
+            parse_weights("jitter=1")
+
+    @unittest.skipIf(np is None, "未安装 NumPy")
+    def test_numpy_path_matches_streaming(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "result.csv"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"{COL_IP},已发送,已接收,{COL_LOSS},{COL_LATENCY},{COL_SPEED},地区码(Colo)\n")
+            for ip, speed, latency, loss in self.ROWS:
+                f.write(f"{ip},4,4,{loss},{latency},{speed},HKG\n")
+        weights = parse_weights("latency=0.01")
+        self.assertEqual(top_k_numpy(path, 3, weights), top_k(iter_rows(path), 3, weights))
+
+    @unittest.skipIf(np is None, "未安装 NumPy")
+    def test_numpy_path_skips_blank_lines(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        path = Path(tmp.name) / "result.csv"
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(f"{COL_IP},已发送,已接收,{COL_LOSS},{COL_LATENCY},{COL_SPEED},地区码(Colo)\n\n")
+            for ip, speed, latency, loss in self.ROWS:
+                f.write(f"{ip},4,4,{loss},{latency},{speed},HKG\n\n")
+        expected = top_k(iter_rows(path), 3)
+        self.assertEqual([r[0] for r in expected], ["1.0.0.2", "1.0.0.1", "1.0.0.3"])
+        self.assertEqual(top_k_numpy(path, 3), expected)
+
+if __name__ == "__main__":
+    unittest.main()
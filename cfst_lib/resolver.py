@@ -0,0 +1,340 @@
+"""
+异步 DNS 解析器（A/AAAA）
+
+直接通过 UDP 向上游 DNS 服务器发送查询（应答被截断时改用 TCP），多个域名并发解析；
+结果按应答中的 TTL 缓存，并可持久化到本地文件供下次运行复用。
+未指定上游时使用 /etc/resolv.conf 中的第一个 nameserver，均不可用时回退系统 getaddrinfo。
+指定上游（例如区域的权威服务器）可绕过本地缓存的过期结果。
+"""
+
+import asyncio
+import ipaddress
+import json
+import os
+import random
+import socket
+import struct
+import time
+import unittest
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from cfst_lib import BASE_DIR
+
+CACHE_FILE = BASE_DIR / "history" / "dns_cache.json"
+QTYPES = {"A": 1, "AAAA": 28}
+DEFAULT_TIMEOUT = 2.0
+DEFAULT_RETRIES = 2
+NEGATIVE_TTL = 30  # 无记录（NXDOMAIN/空应答）的缓存时间（秒）
+FALLBACK_TTL = 60  # 系统解析无TTL信息时的缓存时间（秒）
+
+class DnsError(Exception):
+    """DNS查询失败（超时、格式错误、服务器错误）"""
+
+# ---------------------------- 报文编解码 ----------------------------
+def build_query(name: str, qtype: str, qid: int) -> bytes:
+    """构造递归查询报文"""
+    header = struct.pack("!HHHHHH", qid, 0x0100, 1, 0, 0, 0)
+    labels = b"".join(bytes([len(part)]) + part.encode("idna")
+                      for part in name.rstrip(".").split(".") if part)
+    return header + labels + b"\x00" + struct.pack("!HH", QTYPES[qtype], 1)
+
+def _skip_name(data: bytes, offset: int) -> int:
+    while True:
+        length = data[offset]
+        if length & 0xC0 == 0xC0:  # 压缩指针
+            return offset + 2
+        offset += 1
+        if length == 0:
+            return offset
+        offset += length
+
+def parse_response(data: bytes, qid: int, qtype: str) -> Tuple[int, bool, List[Tuple[str, int]]]:
+    """
+    解析应答报文
+    :return: (rcode, 是否截断, [(IP, TTL)])，CNAME 链由上游展开，直接收集同类型的应答记录
+    """
+    try:
+        rid, flags, qdcount, ancount, _, _ = struct.unpack("!HHHHHH", data[:12])
+        if rid != qid or not flags & 0x8000:
+            raise DnsError("应答ID不匹配")
+        offset = 12
+        for _ in range(qdcount):
+            offset = _skip_name(data, offset) + 4
+        answers = []
+        for _ in range(ancount):
+            offset = _skip_name(data, offset)
+            rtype, _, ttl, length = struct.unpack("!HHIH", data[offset:offset + 10])
+            offset += 10
+            rdata = data[offset:offset + length]
+            offset += length
+            if rtype == QTYPES[qtype] and length in (4, 16):
+                answers.append((str(ipaddress.ip_address(rdata)), ttl))
+        return flags & 0x000F, bool(flags & 0x0200), answers
+    except (struct.error, IndexError, ValueError) as e:
+        raise DnsError(f"无效的应答: {str(e)}")
+
+def parse_upstream(value: str) -> Tuple[str, int]:
+    """解析 "IP"、"IP:端口"、"[IPv6]:端口" 形式的上游地址"""
+    if value.startswith("["):
+        host, _, port = value[1:].partition("]")
+        return host, int(port.lstrip(":") or 53)
+    if value.count(":") == 1:
+        host, port = value.split(":")
+        return host, int(port)
+    return value, 53
+
+def system_nameserver(path: str = "/etc/resolv.conf") -> Optional[str]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == "nameserver":
+                    return parts[1].split("%")[0]
+    except OSError:
+        pass
+    return None
+
+# ---------------------------- 传输 ----------------------------
+class _QueryProtocol(asyncio.DatagramProtocol):
+    def __init__(self, future: asyncio.Future):
+        self.future = future
+
+    def datagram_received(self, data, addr):
+        if not self.future.done():
+            self.future.set_result(data)
+
+    def error_received(self, exc):
+        if not self.future.done():
+            self.future.set_exception(exc)
+
+async def _query_udp(query: bytes, server: Tuple[str, int], timeout: float) -> bytes:
+    loop = asyncio.get_running_loop()
+    future = loop.create_future()
+    transport, _ = await loop.create_datagram_endpoint(lambda: _QueryProtocol(future), remote_addr=server)
+    try:
+        transport.sendto(query)
+        return await asyncio.wait_for(future, timeout)
+    finally:
+        transport.close()
+
+async def _query_tcp(query: bytes, server: Tuple[str, int], timeout: float) -> bytes:
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(*server), timeout)
+    try:
+        writer.write(struct.pack("!H", len(query)) + query)
+        await writer.drain()
+        length = struct.unpack("!H", await asyncio.wait_for(reader.readexactly(2), timeout))[0]
+        return await asyncio.wait_for(reader.readexactly(length), timeout)
+    finally:
+        writer.close()
+
+# ---------------------------- 解析器 ----------------------------
+class DnsResolver:
+    """带TTL缓存的并发 A/AAAA 解析器（在单个事件循环内使用）"""
+
+    def __init__(self, upstream: Optional[str] = None, timeout: float = DEFAULT_TIMEOUT,
+                 retries: int = DEFAULT_RETRIES, cache_file: Optional[Path] = None):
+        """
+        :param upstream: 上游DNS服务器（IP[:端口]），默认读取 /etc/resolv.conf
+        :param cache_file: 缓存文件，为 None 时仅在进程内缓存
+        """
+        upstream = upstream or system_nameserver()
+        self.server = parse_upstream(upstream) if upstream else None
+        self.timeout = timeout
+        self.retries = retries
+        self.cache_file = Path(cache_file) if cache_file else None
+        self.cache: Dict[str, Tuple[float, List[str]]] = {}  # 键 -> (过期时间, IP列表)
+        self.queries = 0
+        self.errors: Dict[str, str] = {}  # 域名 -> 最近一次解析失败的原因
+        self._load()
+
+    def _key(self, name: str, qtype: str) -> str:
+        server = f"{self.server[0]}:{self.server[1]}" if self.server else "system"
+        return f"{server}|{name.rstrip('.').lower()}|{qtype}"
+
+    async def resolve(self, name: str, qtype: str = "A") -> List[str]:
+        """解析域名，缓存未过期时直接返回；IP字面量原样返回"""
+        try:
+            return [str(ipaddress.ip_address(name))]
+        except ValueError:
+            pass
+        key = self._key(name, qtype)
+        cached = self.cache.get(key)
+        if cached and cached[0] > time.time():
+            return list(cached[1])
+
+        self.queries += 1
+        if self.server:
+            answers = await self._query(name, qtype)
+            ttl = min((t for _, t in answers), default=NEGATIVE_TTL)
+            ips = list(dict.fromkeys(ip for ip, _ in answers))
+        else:
+            ips, ttl = await self._query_system(name, qtype), FALLBACK_TTL
+        self.cache[key] = (time.time() + ttl, ips)
+        return list(ips)
+
+    def invalidate(self, names: Iterable[str]) -> int:
+        """作废指定域名的缓存（所有记录类型），例如DNS记录刚被修改后；返回作废的条数"""
+        names = {name.rstrip('.').lower() for name in names}
+        stale = [key for key in self.cache if key.split("|")[1] in names]
+        for key in stale:
+            del self.cache[key]
+        return len(stale)
+
+    async def resolve_many(self, names: Iterable[str], qtype: str = "A") -> Dict[str, List[str]]:
+        """并发解析多个域名，单个域名失败时返回空列表（原因记录在 errors 中）"""
+        names = list(names)
+        results = await asyncio.gather(*(self.resolve(name, qtype) for name in names), return_exceptions=True)
+        resolved = {}
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                self.errors[name] = str(result)
+                result = []
+            resolved[name] = result
+        return resolved
+
+    async def _query(self, name: str, qtype: str) -> List[Tuple[str, int]]:
+        last_error = None
+        for _ in range(self.retries + 1):
+            qid = random.randint(0, 0xFFFF)
+            query = build_query(name, qtype, qid)
+            try:
+                rcode, truncated, answers = parse_response(
+                    await _query_udp(query, self.server, self.timeout), qid, qtype)
+                if truncated:
+                    rcode, _, answers = parse_response(
+                        await _query_tcp(query, self.server, self.timeout), qid, qtype)
+            except (asyncio.TimeoutError, OSError, DnsError) as e:
+                last_error = e
+                continue
+            if rcode not in (0, 3):  # NOERROR / NXDOMAIN 之外视为服务器错误
+                last_error = DnsError(f"服务器返回错误码 {rcode}")
+                continue
+            return answers
+        raise DnsError(f"解析 {name} ({qtype}) 失败: {type(last_error).__name__}: {last_error}")
+
+    async def _query_system(self, name: str, qtype: str) -> List[str]:
+        family = socket.AF_INET6 if qtype == "AAAA" else socket.AF_INET
+        try:
+            infos = await asyncio.get_running_loop().getaddrinfo(name, None, family=family,
+                                                                 type=socket.SOCK_STREAM)
+        except socket.gaierror:
+            return []
+        return list(dict.fromkeys(info[4][0] for info in infos))
+
+    # ---------------------------- 持久化 ----------------------------
+    def _load(self):
+        if not self.cache_file:
+            return
+        try:
+            with open(self.cache_file, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        now = time.time()
+        self.cache = {key: (expires, ips) for key, (expires, ips) in data.items() if expires > now}
+
+    def save(self):
+        """写出未过期的缓存"""
+        if not self.cache_file:
+            return
+        now = time.time()
+        data = {key: [expires, ips] for key, (expires, ips) in self.cache.items() if expires > now}
+        self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_file.with_name(f".{self.cache_file.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps(data), encoding="utf-8")
+        os.replace(tmp, self.cache_file)
+
+# ---------------------------- 单元测试 ----------------------------
+class _StubServer(asyncio.DatagramProtocol):
+    """本地测试用DNS服务器：按 {(名称, 类型): [IP]} 应答，其他名称返回 NXDOMAIN"""
+
+    def __init__(self, records: Dict[Tuple[str, int], List[str]], ttl: int = 300):
+        self.records = records
+        self.ttl = ttl
+        self.received = 0
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        self.received += 1
+        qid = struct.unpack("!H", data[:2])[0]
+        end = _skip_name(data, 12)
+        labels, offset = [], 12
+        while data[offset]:
+            labels.append(data[offset + 1:offset + 1 + data[offset]].decode())
+            offset += 1 + data[offset]
+        qtype = struct.unpack("!H", data[end:end + 2])[0]
+        ips = self.records.get((".".join(labels), qtype))
+        answers = b"".join(b"\xc0\x0c" + struct.pack("!HHIH", qtype, 1, self.ttl, len(packed)) + packed
+                           for packed in (ipaddress.ip_address(ip).packed for ip in ips or []))
+        flags = 0x8180 if ips is not None else 0x8183
+        header = struct.pack("!HHHHHH", qid, flags, 1, len(ips or []), 0, 0)
+        self.transport.sendto(header + data[12:end + 4] + answers, addr)
+
+class TestDnsResolver(unittest.TestCase):
+    """解析器单元测试（本地DNS服务）"""
+
+    RECORDS = {("hk.example.com", 1): ["1.1.1.1", "1.0.0.1"], ("hk.example.com", 28): ["2606:4700::1111"]}
+
+    def _run(self, coro_factory, ttl=300):
+        async def main():
+            loop = asyncio.get_running_loop()
+            transport, stub = await loop.create_datagram_endpoint(
+                lambda: _StubServer(self.RECORDS, ttl), local_addr=("127.0.0.1", 0))
+            try:
+                port = transport.get_extra_info("sockname")[1]
+                return await coro_factory(f"127.0.0.1:{port}"), stub
+            finally:
+                transport.close()
+        return asyncio.run(main())
+
+    def test_concurrent_a_aaaa_and_cache(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        cache_file = Path(tmp.name) / "dns.json"
+
+        async def resolve(upstream):
+            resolver = DnsResolver(upstream, timeout=1.0, cache_file=cache_file)
+            a = await resolver.resolve_many(["hk.example.com", "missing.example.com"], "A")
+            aaaa = await resolver.resolve("hk.example.com", "AAAA")
+            await resolver.resolve("hk.example.com", "A")
+            resolver.save()
+            cached = DnsResolver(upstream, cache_file=cache_file)
+            return a, aaaa, await cached.resolve("hk.example.com", "A"), cached.queries
+
+        (a, aaaa, cached, queries), stub = self._run(resolve)
+        self.assertEqual(a, {"hk.example.com": ["1.1.1.1", "1.0.0.1"], "missing.example.com": []})
+        self.assertEqual(aaaa, ["2606:4700::1111"])
+        self.assertEqual(cached, ["1.1.1.1", "1.0.0.1"])
+        self.assertEqual((stub.received, queries), (3, 0))
+
+    def test_expired_answers_are_requeried(self):
+        async def resolve(upstream):
+            resolver = DnsResolver(upstream, timeout=1.0)
+            await resolver.resolve("hk.example.com")
+            return await resolver.resolve("hk.example.com")
+
+        ips, stub = self._run(resolve, ttl=0)
+        self.assertEqual(ips, ["1.1.1.1", "1.0.0.1"])
+        self.assertEqual(stub.received, 2)
+
+    def test_invalidate_drops_every_type_for_name(self):
+        resolver = DnsResolver("127.0.0.1")
+        expires = time.time() + 300
+        resolver.cache = {resolver._key("hk.example.com", "A"): (expires, ["1.1.1.1"]),
+                          resolver._key("hk.example.com", "AAAA"): (expires, ["2606:4700::1111"]),
+                          resolver._key("us.example.com", "A"): (expires, ["2.2.2.2"])}
+        self.assertEqual(resolver.invalidate(["HK.example.com."]), 2)
+        self.assertEqual(list(resolver.cache), [resolver._key("us.example.com", "A")])
+
+    def test_parse_upstream(self):
+        self.assertEqual(parse_upstream("1.1.1.1"), ("1.1.1.1", 53))
+        self.assertEqual(parse_upstream("127.0.0.1:5353"), ("127.0.0.1", 5353))
+        self.assertEqual(parse_upstream("[2606:4700::1111]:53"), ("2606:4700::1111", 53))
+        self.assertEqual(parse_upstream("2606:4700::1111"), ("2606:4700::1111", 53))
+
+if __name__ == "__main__":
+    unittest.main()
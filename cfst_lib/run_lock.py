@@ -0,0 +1,195 @@
+"""
+测速运行锁与请求合并
+
+每个 类型/colo 一个锁文件 history/locks/<类型>/<colo>.lock（fcntl.flock，进程退出时自动释放），
+同一colo同一时间只有一个测速在执行。锁被占用时不重复扫描，而是等待进行中的测速结束，
+直接采用其写入锁文件的结果（完成时间晚于本次请求即视为已合并）；
+持有者未写入结果就释放锁时（例如异常退出）再由本次请求自行测速。
+不支持 fcntl 的平台（Windows）退化为进程内锁。
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+import unittest
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Callable, Dict, IO, Iterable, List, Set, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+from cfst_lib import BASE_DIR
+
+LOCK_DIR = BASE_DIR / "history" / "locks"
+
+_local_locks: Dict[str, threading.Lock] = {}
+_local_locks_guard = threading.Lock()
+
+# ---------------------------- 文件锁 ----------------------------
+def _try_lock(f: IO, path: Path, blocking: bool) -> bool:
+    if fcntl is not None:
+        try:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            return True
+        except BlockingIOError:
+            return False
+    with _local_locks_guard:
+        lock = _local_locks.setdefault(str(path.resolve()), threading.Lock())
+    return lock.acquire(blocking)
+
+def _unlock(f: IO, path: Path):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        _local_locks[str(path.resolve())].release()
+    f.close()
+
+def _open(path: Path) -> IO:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    return open(path, "a+", encoding="utf-8")  # 不截断，保留上一次运行写入的结果
+
+@contextmanager
+def file_lock(path: Path, blocking: bool = True):
+    """独占文件锁；非阻塞模式下锁被占用时 yield None"""
+    path = Path(path)
+    f = _open(path)
+    if not _try_lock(f, path, blocking):
+        f.close()
+        yield None
+        return
+    try:
+        yield f
+    finally:
+        _unlock(f, path)
+
+def _read_state(f: IO) -> dict:
+    f.seek(0)
+    try:
+        return json.loads(f.read() or "{}")
+    except ValueError:
+        return {}
+
+def _write_state(f: IO, state: dict):
+    f.seek(0)
+    f.truncate()
+    f.write(json.dumps(state))
+    f.flush()
+
+# ---------------------------- colo运行锁 ----------------------------
+class RunLock:
+    """单个类型下各colo的运行锁"""
+
+    def __init__(self, ip_type: str, lock_dir: Path = LOCK_DIR):
+        self.ip_type = ip_type
+        self.lock_dir = Path(lock_dir) / ip_type
+
+    def path(self, colo: str) -> Path:
+        return self.lock_dir / f"{colo}.lock"
+
+    def hold(self, colo: str, blocking: bool = True):
+        """直接持有colo锁（例如替换候补节点时），非阻塞模式下被占用时 yield None"""
+        return file_lock(self.path(colo), blocking)
+
+    def run(self, colos: Iterable[str], runner: Callable[[List[str]], Dict[str, bool]]
+            ) -> Tuple[Dict[str, bool], Set[str]]:
+        """
+        对空闲的colo调用 runner(colos) -> {colo: 是否成功}；其余colo等待进行中的运行并合并其结果
+        :return: ({colo: 是否成功}（保持传入顺序）, 合并自其他运行的colo集合)
+        """
+        colos = list(colos)
+        requested_at = time.time()
+        results: Dict[str, bool] = {}
+        merged: Set[str] = set()
+        pending = colos
+        while pending:
+            owned, busy = {}, []
+            for colo in pending:
+                f = _open(self.path(colo))
+                if _try_lock(f, self.path(colo), blocking=False):
+                    owned[colo] = f
+                else:
+                    f.close()
+                    busy.append(colo)
+            if owned:
+                self._run_owned(owned, runner, results)
+            # 先释放自己持有的锁再等待，避免两个请求互相等待
+            pending = []
+            for colo in busy:
+                logging.info(f"[{self.ip_type}/{colo}] 已有测速在进行，等待其结果")
+                with file_lock(self.path(colo)) as f:
+                    state = _read_state(f)
+                if state.get("finished", 0) >= requested_at:
+                    results[colo] = bool(state.get("ok"))
+                    merged.add(colo)
+                    logging.info(f"[{self.ip_type}/{colo}] 已合并进行中的测速结果: "
+                                 f"{'成功' if results[colo] else '失败'}")
+                else:
+                    pending.append(colo)
+        return {colo: results[colo] for colo in colos}, merged
+
+    def _run_owned(self, owned: Dict[str, IO], runner: Callable, results: Dict[str, bool]):
+        try:
+            for f in owned.values():
+                _write_state(f, {"pid": os.getpid(), "started": time.time()})
+            outcome = runner(list(owned))
+            for colo, f in owned.items():
+                results[colo] = bool(outcome.get(colo, False))
+                _write_state(f, {"pid": os.getpid(), "finished": time.time(), "ok": results[colo]})
+        finally:
+            for colo, f in owned.items():
+                _unlock(f, self.path(colo))
+
+# ---------------------------- 单元测试 ----------------------------
+class TestRunLock(unittest.TestCase):
+    """运行锁单元测试"""
+
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.lock_dir = Path(tmp.name)
+
+    def test_concurrent_requests_coalesce(self):
+        started, calls = threading.Event(), []
+
+        def slow_runner(colos):
+            calls.append(list(colos))
+            started.set()
+            time.sleep(0.3)
+            return {colo: colo == "HKG" for colo in colos}
+
+        first = {}
+        thread = threading.Thread(target=lambda: first.update(
+            result=RunLock("ipv4", self.lock_dir).run(["HKG", "LAX"], slow_runner)))
+        thread.start()
+        started.wait(1)
+        results, merged = RunLock("ipv4", self.lock_dir).run(["LAX", "HKG", "NRT"], slow_runner)
+        thread.join()
+
+        self.assertEqual(calls, [["HKG", "LAX"], ["NRT"]])
+        self.assertEqual(results, {"LAX": False, "HKG": True, "NRT": False})
+        self.assertEqual(merged, {"HKG", "LAX"})
+        self.assertEqual(first["result"], ({"HKG": True, "LAX": False}, set()))
+
+    def test_stale_result_and_failed_runner(self):
+        def failing_runner(colos):
+            raise RuntimeError("boom")
+
+        lock = RunLock("ipv6", self.lock_dir)
+        with self.assertRaises(RuntimeError):
+            lock.run(["HKG"], failing_runner)
+        # 异常后锁已释放，且旧结果不会被当作本次请求的结果
+        results, merged = lock.run(["HKG"], lambda colos: {"HKG": True})
+        self.assertEqual((results, merged), ({"HKG": True}, set()))
+        with lock.hold("HKG") as f:
+            self.assertIsNotNone(f)
+            with lock.hold("HKG", blocking=False) as busy:
+                self.assertIsNone(busy)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,306 @@
+"""
+Telegram 通知（经 Cloudflare Worker 转发）
+
+send_telegram_message 同步发送：复用连接池、设置超时、超出单条长度限制时按行拆分、失败时退避重试。
+queue_telegram_message 放入后台发送队列后立即返回，测速与DNS更新不再等待 Telegram；
+后台线程将同一目标短时间内的多条消息合并发送，队列满时丢弃新消息，
+进程退出时最多等待 FLUSH_TIMEOUT 秒发送剩余消息。
+"""
+
+import os
+import atexit
+import logging
+import queue
+import threading
+import time
+import unittest
+import requests
+import json
+from typing import List
+from dotenv import load_dotenv
+
+# 加载 .env 文件
+load_dotenv()
+
+MAX_MESSAGE_LENGTH = 4096  # Telegram 单条消息长度上限
+REQUEST_TIMEOUT = (5, 15)  # (连接, 读取) 超时（秒）
+MAX_RETRIES = 3
+BACKOFF_BASE = 1.0  # 重试间隔 1s, 2s, 4s ...
+QUEUE_SIZE = 100
+COALESCE_INTERVAL = 2.0  # 合并该时间窗口内发往同一目标的消息（秒）
+FLUSH_TIMEOUT = 30.0  # 进程退出时等待队列发送完成的最长时间（秒）
+
+_FLUSH = object()  # 队列中的刷新标记：立即结束合并窗口
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """进程内共享的连接池"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            _session.headers.update({'Content-Type': 'application/json'})
+        return _session
+
+def split_message(message: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """按行拆分超长消息，多段时添加 (i/n) 页码；单行超长时硬切分"""
+    if len(message) <= limit:
+        return [message]
+    body_limit = limit - 16  # 为页码预留空间
+    lines = []
+    for line in message.split("\n"):
+        while len(line) > body_limit:
+            lines.append(line[:body_limit])
+            line = line[body_limit:]
+        lines.append(line)
+    chunks, current = [], ""
+    for line in lines:
+        if current and len(current) + 1 + len(line) > body_limit:
+            chunks.append(current)
+            current = line
+        else:
+            current = f"{current}\n{line}" if current else line
+    if current:
+        chunks.append(current)
+    return [f"({i}/{len(chunks)})\n{chunk}" for i, chunk in enumerate(chunks, 1)]
+
+def _post(session, worker_url, payload: dict, retries: int, backoff: float) -> dict:
+    """发送单条消息，网络错误、429 与 5xx 时退避重试"""
+    result = {}
+    for attempt in range(retries + 1):
+        try:
+            response = session.post(worker_url, data=json.dumps(payload), timeout=REQUEST_TIMEOUT)
+            if response.status_code == 200:
+                return {"status": "success", "response": response.text}
+            result = {"status": "error", "code": response.status_code, "message": response.text}
+            if response.status_code != 429 and response.status_code < 500:
+                return result
+            retry_after = str(response.headers.get("Retry-After", ""))
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+        except requests.exceptions.RequestException as e:
+            result = {"status": "error", "message": str(e)}
+            delay = backoff * 2 ** attempt
+        if attempt < retries:
+            time.sleep(delay)
+    return result
+
+def send_telegram_message(worker_url, bot_token, chat_id, message, secret_token=None,
+                          session=None, retries: int = MAX_RETRIES, backoff: float = BACKOFF_BASE):
+    """
+    通过 Cloudflare Worker 发送 Telegram 消息（同步）
+    超长消息拆分为多条依次发送，返回第一条失败或最后一条的结果
+    """
+    if not worker_url:
+        return {"status": "error", "message": "未配置 CF_WORKER_URL"}
+    session = session or get_session()
+    result = {}
+    for chunk in split_message(message):
+        payload = {
+            'bot_token': bot_token,
+            'chat_id': chat_id,
+            'message': chunk
+        }
+        if secret_token:
+            payload['secret_token'] = secret_token  # 确保键名与 Worker 代码中的参数名一致
+        result = _post(session, worker_url, payload, retries, backoff)
+        if result["status"] != "success":
+            break
+    return result
+
+# ---------------------------- 后台发送 ----------------------------
+class TelegramDispatcher:
+    """后台通知发送线程（有界队列 + 合并 + 拆分 + 重试）"""
+
+    def __init__(self, maxsize: int = QUEUE_SIZE, interval: float = COALESCE_INTERVAL, send=None):
+        """
+        :param interval: 合并窗口，收到第一条消息后等待该时间收集同一目标的后续消息
+        :param send: 发送函数，默认 send_telegram_message
+        """
+        self.queue = queue.Queue(maxsize)
+        self.interval = interval
+        self.send = send or send_telegram_message
+        self.dropped = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, worker_url, bot_token, chat_id, message, secret_token=None) -> bool:
+        """放入发送队列，队列已满时丢弃并返回 False（从不阻塞调用方）"""
+        if not worker_url or not message:
+            return False
+        self._start()
+        try:
+            self.queue.put_nowait(((worker_url, bot_token, chat_id, secret_token), message))
+            return True
+        except queue.Full:
+            self.dropped += 1
+            logging.warning(f"Telegram 发送队列已满，丢弃消息（累计 {self.dropped} 条）")
+            return False
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="telegram-dispatcher", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self.queue.get()
+            if item is _FLUSH:
+                self.queue.task_done()
+                continue
+            (target, message), taken = item, 1
+            batch, others = [message], []
+            deadline = time.monotonic() + self.interval
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is _FLUSH:
+                    break
+                if item[0] == target:
+                    batch.append(item[1])
+                else:
+                    others.append(item)
+            for item in [(target, "\n\n".join(batch))] + self._merge(others):
+                self._deliver(*item)
+            for _ in range(taken):
+                self.queue.task_done()
+
+    @staticmethod
+    def _merge(items: list) -> list:
+        merged = {}
+        for target, message in items:
+            merged.setdefault(target, []).append(message)
+        return [(target, "\n\n".join(messages)) for target, messages in merged.items()]
+
+    def _deliver(self, target: tuple, message: str):
+        worker_url, bot_token, chat_id, secret_token = target
+        try:
+            result = self.send(worker_url=worker_url, bot_token=bot_token, chat_id=chat_id,
+                               message=message, secret_token=secret_token)
+            if result.get("status") != "success":
+                logging.error(f"Telegram 通知发送失败: {result.get('code', '')} {result.get('message', '')}")
+        except Exception as e:
+            logging.error(f"Telegram 通知发送异常: {str(e)}")
+
+    def flush(self, timeout: float = FLUSH_TIMEOUT) -> bool:
+        """等待队列中的消息发送完成，超时返回 False（不会因 Telegram 无响应而无限等待）"""
+        deadline = time.monotonic() + timeout
+        if self._thread is not None and self._thread.is_alive():
+            try:
+                self.queue.put_nowait(_FLUSH)  # 不再等待合并窗口
+            except queue.Full:
+                pass
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    logging.warning(f"Telegram 通知在 {timeout:.0f}s 内未发送完成，"
+                                    f"剩余 {self.queue.unfinished_tasks} 条")
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+_dispatcher = TelegramDispatcher()
+atexit.register(_dispatcher.flush)
+
+def queue_telegram_message(worker_url, bot_token, chat_id, message, secret_token=None) -> bool:
+    """放入后台队列发送 Telegram 消息，立即返回"""
+    return _dispatcher.submit(worker_url, bot_token, chat_id, message, secret_token)
+
+def flush_telegram(timeout: float = FLUSH_TIMEOUT) -> bool:
+    return _dispatcher.flush(timeout)
+
+# ---------------------------- 单元测试 ----------------------------
+class _FakeResponse:
+    def __init__(self, status_code, text="ok", headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+class _FakeSession:
+    def __init__(self, statuses):
+        self.statuses = list(statuses)
+        self.payloads = []
+
+    def post(self, url, data=None, timeout=None):
+        self.payloads.append(json.loads(data))
+        status = self.statuses.pop(0) if self.statuses else 200
+        if status is None:
+            raise requests.exceptions.ConnectionError("down")
+        return _FakeResponse(status)
+
+class TestTelegram(unittest.TestCase):
+    """Telegram 通知单元测试"""
+
+    def test_split_message(self):
+        message = "\n".join(f"line {i:04d} " + "x" * 90 for i in range(100))
+        chunks = split_message(message, limit=1000)
+        self.assertTrue(all(len(chunk) <= 1000 for chunk in chunks))
+        self.assertTrue(chunks[0].startswith(f"(1/{len(chunks)})\n"))
+        self.assertEqual("\n".join(chunk.split("\n", 1)[1] for chunk in chunks), message)
+        self.assertEqual(split_message("short"), ["short"])
+        self.assertTrue(all(len(c) <= 100 for c in split_message("y" * 500, limit=100)))
+
+    def test_retry_and_chunked_send(self):
+        session = _FakeSession([None, 502, 200, 200])
+        result = send_telegram_message("http://worker", "token", "chat", "a" * 5000, "secret",
+                                       session=session, backoff=0)
+        self.assertEqual(result["status"], "success")
+        self.assertEqual(len(session.payloads), 4)  # 第一段重试两次后成功，第二段一次成功
+        self.assertEqual(session.payloads[-1]["secret_token"], "secret")
+
+        session = _FakeSession([400])
+        self.assertEqual(send_telegram_message("http://worker", "t", "c", "m", session=session,
+                                               backoff=0)["code"], 400)
+        self.assertEqual(len(session.payloads), 1)
+
+    def test_dispatcher_coalesces_without_blocking(self):
+        sent, release = [], threading.Event()
+
+        def slow_send(**kwargs):
+            release.wait(2)
+            sent.append((kwargs["chat_id"], kwargs["message"]))
+            return {"status": "success"}
+
+        dispatcher = TelegramDispatcher(maxsize=3, interval=0.2, send=slow_send)
+        start = time.monotonic()
+        self.assertTrue(dispatcher.submit("http://w", "t", "a", "first"))
+        self.assertTrue(dispatcher.submit("http://w", "t", "b", "other"))
+        self.assertTrue(dispatcher.submit("http://w", "t", "a", "second"))
+        time.sleep(0.3)  # 合并窗口结束，工作线程阻塞在发送中
+        for i in range(4):
+            dispatcher.submit("http://w", "t", "a", f"late {i}")
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(dispatcher.dropped, 1)
+        self.assertFalse(dispatcher.flush(timeout=0.1))
+
+        release.set()
+        self.assertTrue(dispatcher.flush(timeout=3))
+        self.assertEqual(sent[:2], [("a", "first\n\nsecond"), ("b", "other")])
+        self.assertEqual(sent[2:], [("a", "late 0\n\nlate 1\n\nlate 2")])
+
+if __name__ == "__main__":
+    # 从环境变量读取配置
+    WORKER_URL = os.getenv("CF_WORKER_URL")
+    BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+    CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+    SECRET_TOKEN = os.getenv("SECRET_TOKEN")  # 可选
+
+    # 调用时使用正确的参数名
+    result = send_telegram_message(
+        worker_url=WORKER_URL,
+        bot_token=BOT_TOKEN,
+        chat_id=CHAT_ID,
+        message="Hello from Python!",
+        secret_token=SECRET_TOKEN  # 确保此处参数名与函数定义一致
+    )
+
+    print(result)
@@ -0,0 +1,253 @@
+"""
+Cloudflare 区域 DNS 记录快照
+
+一次分页列出区域内全部记录并按 (名称, 类型) 建立索引，以短 TTL 持久化到本地，
+之后由本地的创建/删除结果原地更新，避免每个子域名单独查询。
+快照只反映本工具所做的修改，外部修改最多在 TTL 内不可见。
+多个进程同时使用时，写回在文件锁内重新读取磁盘上的快照，只叠加本进程的创建/删除，不覆盖其他进程的修改。
+"""
+
+import json
+import os
+import threading
+import time
+import unittest
+from collections import defaultdict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+from cfst_lib import BASE_DIR
+from cfst_lib.run_lock import file_lock
+
+SNAPSHOT_FILE = BASE_DIR / "history" / "zone_snapshot.json"  # ddns/delete_dns/ip_checker 共用
+SNAPSHOT_TTL = 300  # 快照有效期（秒）
+PAGE_SIZE = 1000
+
+class ZoneSnapshot:
+    """区域DNS记录快照（线程安全）"""
+
+    def __init__(self, zone_id: str, path: Path = SNAPSHOT_FILE, request: Optional[Callable] = None,
+                 ttl: float = SNAPSHOT_TTL):
+        """
+        :param request: cf_api 形式的请求函数 (method, endpoint, data=None, params=None) -> 响应JSON；
+                        为 None 时只读取本地快照
+        """
+        self.zone_id = zone_id
+        self.path = Path(path)
+        self.request = request
+        self.ttl = ttl
+        self.fetched_at = 0.0
+        self.records: Dict[str, dict] = {}
+        self._index = defaultdict(dict)  # (name, type) -> {id: record}
+        self._created: Dict[str, dict] = {}  # 本进程自上次写回后的修改
+        self._deleted = set()
+        self._listed = False  # 当前数据来自本进程的完整列出
+        self._lock = threading.RLock()
+        self.loaded = False
+
+    # ---------------------------- 加载 ----------------------------
+    def load(self, force: bool = False) -> bool:
+        """优先使用未过期的本地快照，否则重新列出全部记录；失败时返回 False"""
+        with self._lock:
+            if self.loaded and not force and self.is_fresh():
+                return True
+            if not force and self._load_file():
+                return True
+            return self.refresh()
+
+    def is_fresh(self) -> bool:
+        return time.time() - self.fetched_at < self.ttl
+
+    def _read_file(self) -> Optional[dict]:
+        """读取未过期的本地快照"""
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data.get("zone_id") != self.zone_id or time.time() - data.get("fetched_at", 0) >= self.ttl:
+            return None
+        return data
+
+    def _load_file(self) -> bool:
+        data = self._read_file()
+        if data is None:
+            return False
+        self._replace(data.get("records", []), data["fetched_at"])
+        self._listed = False
+        return True
+
+    def refresh(self) -> bool:
+        """分页列出区域内全部记录"""
+        if self.request is None:
+            return False
+        records, page = [], 1
+        while True:
+            response = self.request('GET', f'zones/{self.zone_id}/dns_records',
+                                    params={'page': page, 'per_page': PAGE_SIZE})
+            if not response.get('success'):
+                return False
+            records.extend(response.get('result') or [])
+            info = response.get('result_info') or {}
+            if page >= info.get('total_pages', 1):
+                break
+            page += 1
+        with self._lock:
+            self._replace(records, time.time())
+            self._listed = True
+            self.save()
+        return True
+
+    def _replace(self, records: List[dict], fetched_at: float):
+        self.records = {}
+        self._index = defaultdict(dict)
+        self._created, self._deleted = {}, set()
+        for record in records:
+            self._add(record)
+        self.fetched_at = fetched_at
+        self.loaded = True
+
+    # ---------------------------- 查询与更新 ----------------------------
+    def _add(self, record: dict):
+        self.records[record['id']] = record
+        self._index[(record['name'], record['type'])][record['id']] = record
+
+    def find(self, name: str, record_type: str) -> List[dict]:
+        with self._lock:
+            return [dict(r) for r in self._index.get((name, record_type), {}).values()]
+
+    def apply_created(self, record: dict):
+        """用创建/修改接口返回的记录更新快照"""
+        if record and record.get('id'):
+            with self._lock:
+                self.apply_deleted(record['id'])
+                self._add(dict(record))
+                self._deleted.discard(record['id'])
+                self._created[record['id']] = dict(record)
+
+    def apply_deleted(self, record_id: str):
+        with self._lock:
+            record = self.records.pop(record_id, None)
+            if record:
+                self._index[(record['name'], record['type'])].pop(record_id, None)
+            self._created.pop(record_id, None)
+            self._deleted.add(record_id)
+
+    def invalidate(self):
+        """操作结果与快照不一致时作废快照，下次运行重新列出"""
+        with self._lock, file_lock(self._lock_path()):
+            self.fetched_at = 0.0
+            self.loaded = False
+            self.path.unlink(missing_ok=True)
+
+    def expire(self):
+        """写回本进程的修改并丢弃内存中的数据，下次 load() 重新读取本地快照（包含其他进程写回的修改）"""
+        with self._lock:
+            self.save()
+            self.loaded = False
+
+    def _lock_path(self) -> Path:
+        return self.path.with_name(f"{self.path.name}.lock")
+
+    def save(self):
+        """
+        原子写出快照文件（fetched_at 保持为最近一次完整列出的时间）
+        在文件锁内重新读取磁盘快照：其不旧于本进程的数据时只叠加本进程的修改；
+        磁盘快照已被其他进程作废且本进程未重新列出时不写回
+        """
+        with self._lock, file_lock(self._lock_path()):
+            if not self.loaded:
+                return
+            disk = self._read_file()
+            if disk is not None and disk["fetched_at"] >= self.fetched_at:
+                created, deleted = self._created, self._deleted
+                self._replace(disk.get("records", []), disk["fetched_at"])
+                for record_id in deleted:
+                    self.apply_deleted(record_id)
+                for record in created.values():
+                    self.apply_created(record)
+            elif disk is None and not self._listed:
+                return
+            self._created, self._deleted = {}, set()
+            data = {"zone_id": self.zone_id, "fetched_at": self.fetched_at,
+                    "records": list(self.records.values())}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+            tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+            os.replace(tmp, self.path)
+
+# ---------------------------- 单元测试 ----------------------------
+class TestZoneSnapshot(unittest.TestCase):
+    """区域快照单元测试"""
+
+    RECORDS = [{"id": str(i), "name": f"s{i % 3}.example.com", "type": "A", "content": f"1.1.1.{i}"}
+               for i in range(5)]
+
+    def setUp(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = Path(tmp.name) / "zone.json"
+        self.calls = []
+
+    def request(self, method, endpoint, data=None, params=None):
+        self.calls.append(params)
+        start = (params["page"] - 1) * 2
+        return {"success": True, "result": self.RECORDS[start:start + 2],
+                "result_info": {"total_pages": 3}}
+
+    def test_paginated_load_and_local_updates(self):
+        snapshot = ZoneSnapshot("zone", self.path, self.request)
+        self.assertTrue(snapshot.load())
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual([r["id"] for r in snapshot.find("s0.example.com", "A")], ["0", "3"])
+
+        snapshot.apply_deleted("0")
+        snapshot.apply_created({"id": "9", "name": "s0.example.com", "type": "A", "content": "9.9.9.9"})
+        snapshot.save()
+
+        cached = ZoneSnapshot("zone", self.path)
+        self.assertTrue(cached.load())
+        self.assertEqual(len(self.calls), 3)
+        self.assertEqual(sorted(r["id"] for r in cached.find("s0.example.com", "A")), ["3", "9"])
+
+    def test_concurrent_writers_merge(self):
+        ZoneSnapshot("zone", self.path, self.request).load()
+        first, second = ZoneSnapshot("zone", self.path), ZoneSnapshot("zone", self.path)
+        first.load()
+        second.load()
+        first.apply_created({"id": "a", "name": "s0.example.com", "type": "A", "content": "8.8.8.8"})
+        second.apply_deleted("0")
+        first.save()
+        second.save()
+
+        merged = ZoneSnapshot("zone", self.path)
+        merged.load()
+        self.assertEqual(sorted(r["id"] for r in merged.find("s0.example.com", "A")), ["3", "a"])
+        self.assertIn("a", {r["id"] for r in second.find("s0.example.com", "A")})
+
+        # 其他进程作废快照后，未重新列出的进程不再写回
+        second.invalidate()
+        first.apply_deleted("a")
+        first.save()
+        self.assertFalse(self.path.exists())
+
+    def test_expire_rereads_other_writers(self):
+        ZoneSnapshot("zone", self.path, self.request).load()
+        first, second = ZoneSnapshot("zone", self.path), ZoneSnapshot("zone", self.path)
+        first.load()
+        second.load()
+        second.apply_deleted("0")
+        second.save()
+        first.apply_created({"id": "a", "name": "s0.example.com", "type": "A", "content": "8.8.8.8"})
+        first.expire()
+        self.assertFalse(first.loaded)
+        self.assertTrue(first.load())
+        self.assertEqual(sorted(r["id"] for r in first.find("s0.example.com", "A")), ["3", "a"])
+
+    def test_expired_snapshot_is_not_used(self):
+        ZoneSnapshot("zone", self.path, self.request, ttl=0).load()
+        self.assertFalse(ZoneSnapshot("zone", self.path, ttl=0).load())
+
+if __name__ == "__main__":
+    unittest.main()
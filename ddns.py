@@ -1,13 +1,26 @@
 import argparse
+import asyncio
+import contextlib
+import contextvars
 import json
 import os
+import re
 import sys
-import requests
-from datetime import datetime
+import threading
+import time
+import unittest
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from dotenv import load_dotenv
 from colorama import init, Fore, Style
 
-from py.tg import send_telegram_message
+from cfst_lib.tg import queue_telegram_message
+from cfst_lib.dns_batch import DnsBatch
+from cfst_lib.cf_client import CloudflareClient, auth_headers
+from cfst_lib.zone_snapshot import ZoneSnapshot, SNAPSHOT_FILE
+from cfst_lib.ddns_journal import get_journal
+from cfst_lib.run_lock import RunLock, LOCK_DIR
 
 # 初始化颜色输出
 init(autoreset=True)
@@ -20,38 +33,110 @@ EMAIL = os.environ.get("CLOUDFLARE_EMAIL")
 API_KEY = os.environ.get("CLOUDFLARE_API_KEY")
 ZONE_ID = os.environ.get("CLOUDFLARE_ZONE_ID")
 
-if not all([EMAIL, API_KEY, ZONE_ID]):
-    raise ValueError("缺少必要的环境变量: CLOUDFLARE_EMAIL, CLOUDFLARE_API_KEY, CLOUDFLARE_ZONE_ID")
+BASE_DIR = Path(__file__).parent.resolve()
+SPEED_DIR = BASE_DIR / "speed"
 
-API_BASE = "https://api.cloudflare.com/client/v4/"
+API_BASE = os.environ.get("CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4/")
+DEFAULT_CONCURRENCY = 8  # 并发更新时同时进行的API请求数
+LOG_TAIL_LINES = 200  # 输出捕获保留的最近行数（用于通知与返回的日志）
+LOG_LINE_MAX = 500  # 捕获的单行最大长度
+ANSI_RE = re.compile(r"\x1b\[[0-9;]*m")
+
+class OutputTee:
+    """
+    tee 方式捕获控制台输出：实时写出到原 stdout，同时在固定大小的环形缓冲区中保留最近的行（去除颜色码），
+    并收集各colo的结构化统计，供通知使用；内存占用与运行规模无关
+    带标签的输出在控制台逐行加 "[标签] " 前缀，缓冲区中仅在标签变化时插入一行标签，避免通知日志过长
+    """
+    def __init__(self, stream, echo=True, max_lines=LOG_TAIL_LINES):
+        self.stream = stream
+        self.echo = echo
+        self.lines = deque(maxlen=max_lines)
+        self.total_lines = 0
+        self.partial = ""
+        self.tag = ""  # 缓冲区最后一行所属的标签
+        self.summary = []  # [{"ip_type", "colo", "kept", "deleted", "added"}]
+
+    def write(self, text, tag=""):
+        if self.echo:
+            self.stream.write(tag_lines(text, tag))
+        *complete, self.partial = (self.partial + text).split("\n")
+        for line in complete:
+            if tag != self.tag:
+                self.tag = tag
+                if tag:
+                    self._append(tag)
+            self._append(ANSI_RE.sub("", line)[:LOG_LINE_MAX])
+        self.partial = self.partial[-LOG_LINE_MAX:]
+
+    def _append(self, line):
+        self.lines.append(line)
+        self.total_lines += 1
+
+    def flush(self):
+        if self.echo:
+            self.stream.flush()
 
-class OutputCollector:
-    """收集控制台输出的类"""
-    def __init__(self):
-        self.content = []
-        
-    def write(self, text):
-        self.content.append(text)
-        
     def get_output(self):
-        return "".join(self.content)
+        """最近的输出（超出缓冲区的部分以省略行数代替）"""
+        lines = list(self.lines)
+        if self.partial:
+            lines.append(ANSI_RE.sub("", self.partial))
+        omitted = self.total_lines - len(self.lines)
+        if omitted > 0:
+            lines.insert(0, f"…（省略前 {omitted} 行）")
+        return "\n".join(lines)
+
+def tag_lines(text, tag):
+    """为每一行加上 "[标签] " 前缀"""
+    if not tag:
+        return text
+    return "".join(f"{tag} {line}" for line in text.splitlines(keepends=True))
+
+_output_tee = contextvars.ContextVar("ddns_output_tee", default=None)
+_output_tag = contextvars.ContextVar("ddns_output_tag", default="")
+_output_lock = threading.Lock()
 
-# 在 main 执行前重定向输出
-original_stdout = sys.stdout
-output_collector = OutputCollector()
+def emit(*values, sep=" ", end="\n"):
+    """
+    输出日志（用法同 print）：写入当前上下文的输出捕获，未捕获时写入 sys.stdout；不替换进程级的 sys.stdout
+    并发更新时各任务的输出带 [类型/colo] 标签并立即写出，整段在锁内写入，避免与其他任务的输出交错
+    """
+    text = sep.join(str(value) for value in values) + end
+    tag = _output_tag.get()
+    with _output_lock:
+        tee = _output_tee.get()
+        if tee is not None:
+            tee.write(text, tag)
+            tee.flush()
+        else:
+            sys.stdout.write(tag_lines(text, tag))
+            sys.stdout.flush()
+
+def report_colo_stats(ip_type, colo, kept, deleted, added):
+    """输出colo统计，并记录到当前的输出捕获中"""
+    emit(f"{Fore.CYAN}[统计]{Style.RESET_ALL} {colo} ({ip_type}) 保留: {kept} 条，删除: {deleted} 条，新增: {added} 条")
+    tee = _output_tee.get()
+    if tee is not None:
+        tee.summary.append({"ip_type": ip_type, "colo": colo, "kept": kept, "deleted": deleted, "added": added})
+
+def check_config():
+    """检查必要的环境变量（在实际调用API前检查，便于作为模块导入）"""
+    if not all([EMAIL, API_KEY, ZONE_ID]):
+        raise ValueError("缺少必要的环境变量: CLOUDFLARE_EMAIL, CLOUDFLARE_API_KEY, CLOUDFLARE_ZONE_ID")
 
 def load_json(file_path):
     """加载JSON文件"""
     try:
         with open(file_path, 'r') as f:
             data = json.load(f)
-            print(f"{Fore.GREEN}[成功]{Style.RESET_ALL} 已加载 {len(data)} 条记录")  # 修改输出信息
+            emit(f"{Fore.GREEN}[成功]{Style.RESET_ALL} 已加载 {len(data)} 条记录")  # 修改输出信息
             return data
     except FileNotFoundError:
-        print(f"{Fore.RED}[错误]{Style.RESET_ALL} 文件未找到: {file_path}")
+        emit(f"{Fore.RED}[错误]{Style.RESET_ALL} 文件未找到: {file_path}")
         return []
     except json.JSONDecodeError:
-        print(f"{Fore.RED}[错误]{Style.RESET_ALL} JSON 解码错误: {file_path}")
+        emit(f"{Fore.RED}[错误]{Style.RESET_ALL} JSON 解码错误: {file_path}")
         return []
 
 def get_dns_record_type(ip_type):
@@ -69,166 +154,534 @@ def build_subdomain(ip_type, country):
     return sub.lower()
 
 def update_dns_log(ip_type, colo, ip, port, sub, operation='add'):
-    """更新DNS日志"""
-    log_dir = f"ddns/{ip_type}"
-    os.makedirs(log_dir, exist_ok=True)
-    log_file = f"{log_dir}/{colo}.txt"
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    """更新DNS日志（追加到 ddns/<类型>/<colo>.jsonl 并更新索引）"""
+    journal = get_journal(ip_type, colo)
     
     if operation == 'delete':
-        print(f"{Fore.RED}[删除日志]{Style.RESET_ALL} 搜索IP: {ip}:{port}")
-        deleted_lines = []
-        if os.path.exists(log_file):
-            # 读取所有行并过滤
-            with open(log_file, 'r') as f:
-                lines = f.readlines()
-            # 重新写入不匹配的行
-            with open(log_file, 'w') as f:
-                for line in lines:
-                    if f"{ip}:{port}" in line:
-                        deleted_line = line.strip()
-                        deleted_lines.append(deleted_line)
-                    else:
-                        f.write(line)
-            # 打印被删除的行
-            if deleted_lines:
-                print(f"{Fore.RED}已删除以下日志行:{Style.RESET_ALL}")
-                for dl in deleted_lines:
-                    print(f"  {Fore.YELLOW}{dl}{Style.RESET_ALL}")
-            else:
-                print(f"{Fore.YELLOW}未找到匹配的日志行{Style.RESET_ALL}")
+        emit(f"{Fore.RED}[删除日志]{Style.RESET_ALL} 搜索IP: {ip}:{port}")
+        deleted = journal.delete(ip, port)
+        if deleted:
+            emit(f"{Fore.RED}已删除以下日志记录:{Style.RESET_ALL} {', '.join(deleted)}")
         else:
-            print(f"{Fore.YELLOW}日志文件不存在: {log_file}{Style.RESET_ALL}")
+            emit(f"{Fore.YELLOW}未找到匹配的日志记录{Style.RESET_ALL}")
+    else:
+        domain = f"{sub}.616049.xyz"
+        journal.add(ip, port, domain)
+        emit(f"{Fore.GREEN}[添加日志]{Style.RESET_ALL} {ip}:{port} -> {domain}")
+
+_client = None
+
+def get_client():
+    """共享的Cloudflare API客户端（首次使用时创建）"""
+    global _client
+    if _client is None:
+        _client = CloudflareClient(API_BASE, headers=auth_headers(EMAIL, API_KEY))
+    return _client
+
+_snapshot = None
+
+def get_snapshot():
+    """共享的区域记录快照（首次使用时创建）"""
+    global _snapshot
+    if _snapshot is None:
+        _snapshot = ZoneSnapshot(ZONE_ID, SNAPSHOT_FILE, cf_api)
+    return _snapshot
+
+def load_snapshot(refresh=False):
+    """加载区域快照，失败时回退为逐个子域名查询"""
+    snapshot = get_snapshot()
+    if snapshot.load(force=refresh):
+        age = int(time.time() - snapshot.fetched_at)
+        emit(f"{Fore.CYAN}[快照]{Style.RESET_ALL} 区域记录 {len(snapshot.records)} 条（{age} 秒前列出）")
     else:
-        log_line = f"{timestamp} - {ip}:{port} -> {sub}.616049.xyz\n"
-        print(f"{Fore.GREEN}[添加日志]{Style.RESET_ALL} {log_line.strip()}")
-        with open(log_file, 'a') as f:
-            f.write(log_line)
+        emit(f"{Fore.YELLOW}[快照]{Style.RESET_ALL} 无法列出区域记录，改为逐个子域名查询")
+
+def cached_lookup(ctx):
+    """从快照中查询子域名的现有记录，快照不可用时返回 None"""
+    snapshot = get_snapshot()
+    if not snapshot.loaded:
+        return None
+    return {'success': True, 'result': snapshot.find(ctx['domain'], ctx['record_type'])}
 
-def cf_api(method, endpoint, data=None):
+def cf_api(method, endpoint, data=None, params=None):
     """发送Cloudflare API请求"""
-    headers = {
-        "X-Auth-Email": EMAIL,
-        "X-Auth-Key": API_KEY,
-        "Content-Type": "application/json"
-    }
     url = f"{API_BASE}{endpoint}"
-    print(f"{Fore.CYAN}[API]{Style.RESET_ALL} 请求: {method} {url}")
+    emit(f"{Fore.CYAN}[API]{Style.RESET_ALL} 请求: {method} {url}" + (f" {params}" if params else ""))
     if data: 
-        print(f"{Fore.CYAN}[API]{Style.RESET_ALL} 请求数据:\n{json.dumps(data, indent=2)}")
+        emit(f"{Fore.CYAN}[API]{Style.RESET_ALL} 请求数据:\n{json.dumps(data, indent=2)}")
     
-    try:
-        response = requests.request(method, url, headers=headers, json=data)
-        result = response.json()
-        if not result.get('success'):
-            errors = result.get('errors', [{'message': '未知错误'}])
-            print(f"{Fore.RED}[API 错误]{Style.RESET_ALL} 操作失败: {errors[0].get('message')}")
-        return result
-    except requests.exceptions.RequestException as e:
-        print(f"{Fore.RED}[API 错误]{Style.RESET_ALL} 网络错误: {str(e)}")
-        return {'success': False}
-
-def manage_dns_records(ip_type, colos):
-    """主逻辑"""
+    result = get_client().api(method, endpoint, data, params)
+    if not result.get('success'):
+        errors = result.get('errors') or [{'message': '未知错误'}]
+        emit(f"{Fore.RED}[API 错误]{Style.RESET_ALL} 操作失败: {errors[0].get('message')}")
+    return result
+
+def read_logged_ports(ip_type, colo):
+    """从DNS日志索引中读取 IP -> 端口 映射"""
+    return get_journal(ip_type, colo).ports_by_ip()
+
+def plan_dns_changes(records, colo_data):
+    """
+    计算现有记录与期望IP的差异
+    :param records: 子域名下现有的DNS记录
+    :param colo_data: 测速结果条目（含 ip/port）
+    :return: {"keep": [记录], "create": [条目], "delete": [记录]}
+    """
+    desired = {}
+    for entry in colo_data:
+        ip = entry.get('ip')
+        if ip and ip not in desired:
+            desired[ip] = entry
+
+    plan = {"keep": [], "create": [], "delete": []}
+    seen = set()
+    for record in records:
+        content = record['content']
+        if content in desired and content not in seen:
+            seen.add(content)
+            plan["keep"].append(record)
+        else:
+            plan["delete"].append(record)  # 不再需要的IP及重复记录
+    plan["create"] = [entry for ip, entry in desired.items() if ip not in seen]
+    return plan
+
+def prepare_colo(ip_type, colo):
+    """读取colo的测速结果并确定子域名，无数据时返回 None"""
+    emit(f"\n{Fore.YELLOW}{'='*50}{Style.RESET_ALL}")
+    emit(f"{Fore.YELLOW}[处理]{Style.RESET_ALL} 处理站点: {colo} ({ip_type})")
+
+    json_path = SPEED_DIR / ip_type / f'{colo}.json'
+    colo_data = load_json(json_path)
+    if not colo_data:
+        emit(f"{Fore.YELLOW}[警告]{Style.RESET_ALL} 跳过空数据集: {json_path}")
+        return None
+
+    country = colo_data[0].get('country', 'XX') if colo_data else 'XX'
+    sub = build_subdomain(ip_type, country)
+    domain = f"{sub}.616049.xyz"
+    record_type = get_dns_record_type(ip_type)
+    emit(f"{Fore.YELLOW}[DNS]{Style.RESET_ALL} 查询现有记录: {domain} ({record_type})")
+    return {"ip_type": ip_type, "colo": colo, "colo_data": colo_data,
+            "sub": sub, "domain": domain, "record_type": record_type}
+
+def list_params(ctx):
+    return {'type': ctx['record_type'], 'name': ctx['domain'], 'per_page': 100}
+
+def build_plan(ctx, response):
+    """根据查询结果生成并输出变更计划，查询失败时返回 None"""
+    domain = ctx['domain']
+    if not response.get('success'):
+        emit(f"{Fore.RED}[失败]{Style.RESET_ALL} 无法查询现有记录，跳过: {domain}")
+        return None
+    records = [r for r in response.get('result', [])
+               if r['name'] == domain and r['type'] == ctx['record_type']]
+
+    plan = plan_dns_changes(records, ctx['colo_data'])
+    emit(f"{Fore.CYAN}[计划]{Style.RESET_ALL} {domain} 保留: {len(plan['keep'])} 条，"
+          f"新增: {len(plan['create'])} 条，删除: {len(plan['delete'])} 条")
+    for record in plan['keep']:
+        emit(f"  {Fore.GREEN}= {record['content']}{Style.RESET_ALL}")
+    for entry in plan['create']:
+        emit(f"  {Fore.CYAN}+ {entry.get('ip')}:{entry.get('port', 443)}{Style.RESET_ALL}")
+    for record in plan['delete']:
+        emit(f"  {Fore.RED}- {record['content']}{Style.RESET_ALL}")
+    return plan
+
+def sync_kept_logs(ctx, plan, logged_ports):
+    """端口变化的保留IP只更新日志"""
+    for record in plan['keep']:
+        ip = record['content']
+        port = next(e.get('port', 443) for e in ctx['colo_data'] if e.get('ip') == ip)
+        if logged_ports.get(ip) != port:
+            if ip in logged_ports:
+                update_dns_log(ctx['ip_type'], ctx['colo'], ip, logged_ports[ip], ctx['sub'], 'delete')
+            update_dns_log(ctx['ip_type'], ctx['colo'], ip, port, ctx['sub'])
+
+def record_body(ctx, entry):
+    return {
+        "type": ctx['record_type'],
+        "name": ctx['domain'],
+        "content": entry.get('ip'),
+        "ttl": 1
+    }
+
+def on_created(ctx, entry, result):
+    """处理创建结果，成功时写入日志"""
+    ip = entry.get('ip')
+    emit(f"{Fore.GREEN}[创建]{Style.RESET_ALL} 添加新记录: {ip} -> {ctx['domain']}")
+    if result.get('success'):
+        get_snapshot().apply_created(result.get('result'))
+        update_dns_log(ctx['ip_type'], ctx['colo'], ip, entry.get('port', 443), ctx['sub'])
+        return True
+    emit(f"{Fore.RED}[失败]{Style.RESET_ALL} 未能为 {ip} 创建记录")
+    get_snapshot().invalidate()
+    return False
+
+def on_deleted(ctx, record, result, plan, logged_ports):
+    """处理删除结果，成功时删除对应日志（与保留记录重复的IP除外）"""
+    emit(f"{Fore.RED}[删除]{Style.RESET_ALL} 类型: {record['type']}, 内容: {record['content']}")
+    if not result.get('success'):
+        get_snapshot().invalidate()  # 记录可能已被外部删除，快照已过时
+        return False
+    get_snapshot().apply_deleted(record['id'])
+    ip = record['content']
+    if ip not in {r['content'] for r in plan['keep']}:
+        update_dns_log(ctx['ip_type'], ctx['colo'], ip, logged_ports.get(ip, 443), ctx['sub'], 'delete')
+    return True
+
+def should_keep_old(ctx, plan, added):
+    """新记录全部创建失败且无保留记录时保留旧记录，避免域名无解析"""
+    if plan['delete'] and not plan['keep'] and plan['create'] and added == 0:
+        emit(f"{Fore.YELLOW}[跳过]{Style.RESET_ALL} 新记录均创建失败，保留现有记录: {ctx['domain']}")
+        return True
+    return False
+
+def batch_ops(ctx, plan, logged_ports):
+    """同一域名的增删作为一组放入同一个批量请求，由接口保证原子性"""
+    kept_ips = {r['content'] for r in plan['keep']}
+    ops = [{"action": "posts", "body": record_body(ctx, entry),
+            "tag": (ctx['ip_type'], ctx['colo'], ctx['sub'], entry.get('ip'), entry.get('port', 443))}
+           for entry in plan['create']]
+    ops += [{"action": "deletes", "body": {"id": record['id']},
+             "tag": (ctx['ip_type'], ctx['colo'], ctx['sub'], record['content'],
+                     None if record['content'] in kept_ips else logged_ports.get(record['content'], 443))}
+            for record in plan['delete']]
+    return ops
+
+def print_summary(total_kept, total_deleted, total_added):
+    get_snapshot().save()
+    # 最终统计
+    emit(f"\n{Fore.BLUE}=== 最终统计 ==={Style.RESET_ALL}")
+    emit(f"总保留记录: {total_kept}")
+    emit(f"总删除记录: {total_deleted}")
+    emit(f"总新增记录: {total_added}")
+    stats = get_client().stats()
+    emit(f"API请求: {stats.get('requests', 0)} 次，重试: {stats.get('retries', 0)} 次，"
+          f"平均延迟: {stats['avg_latency_ms']} ms")
+
+def manage_dns_records(ip_type, colos, dry_run=False, batch=False, refresh=False):
+    """
+    主逻辑：按差异逐个colo更新DNS记录
+    未变化的IP不做任何请求；先创建新记录再删除旧记录，避免域名短暂无解析
+    :param dry_run: 仅输出变更计划，不调用写接口
+    :param batch: 使用批量接口一次提交所有colo的变更
+    :param refresh: 忽略本地快照，重新列出区域记录
+    """
+    check_config()
+    load_snapshot(refresh)
     total_deleted = 0  # 新增统计变量
     total_added = 0    # 新增统计变量
-    
+    total_kept = 0
+    dns_batch = DnsBatch() if batch else None
+    batch_stats = {}
+
     for colo in colos:
-        print(f"\n{Fore.YELLOW}{'='*50}{Style.RESET_ALL}")
-        print(f"{Fore.YELLOW}[处理]{Style.RESET_ALL} 处理站点: {colo}")
-        colo_deleted = 0  # 当前colo删除计数
-        colo_added = 0    # 当前colo新增计数
-        
-        json_path = f'speed/{ip_type}/{colo}.json'
-        colo_data = load_json(json_path)
-        if not colo_data:
-            print(f"{Fore.YELLOW}[警告]{Style.RESET_ALL} 跳过空数据集: {json_path}")
+        ctx = prepare_colo(ip_type, colo)
+        if ctx is None:
+            continue
+        response = cached_lookup(ctx) or cf_api('GET', f'zones/{ZONE_ID}/dns_records', params=list_params(ctx))
+        plan = build_plan(ctx, response)
+        if plan is None:
+            continue
+        total_kept += len(plan['keep'])
+        if dry_run:
+            continue
+
+        logged_ports = read_logged_ports(ip_type, colo)
+        sync_kept_logs(ctx, plan, logged_ports)
+        if dns_batch is not None:
+            dns_batch.add_group(batch_ops(ctx, plan, logged_ports))
+            batch_stats[(ip_type, colo)] = len(plan['keep'])
             continue
-        
-        country = colo_data[0].get('country', 'XX') if colo_data else 'XX'
-        sub = build_subdomain(ip_type, country)
-        domain = f"{sub}.616049.xyz"
-        record_type = get_dns_record_type(ip_type)
-        
-        print(f"{Fore.YELLOW}[DNS]{Style.RESET_ALL} 查询现有记录: {domain} ({record_type})")
-        params = {'type': record_type, 'name': domain}
-        records = cf_api('GET', f'zones/{ZONE_ID}/dns_records', params).get('result', [])
-        
-        # 删除完全匹配相同子域名的记录
-        for record in records:
-            if record['name'] == domain:
-                colo_deleted += 1  # 计数递增
-                print(f"{Fore.RED}[完全匹配]{Style.RESET_ALL} 类型: {record['type']}, 内容: {record['content']}")  # 新增详细信息
-                result = cf_api('DELETE', f'zones/{ZONE_ID}/dns_records/{record["id"]}')
-                if result.get('success'):
-                    update_dns_log(ip_type, colo, record['content'], 443, sub, 'delete')
-
-        for entry in colo_data:
-            ip = entry.get('ip')
-            port = entry.get('port', 443)
-            print(f"\n{Fore.CYAN}[IP]{Style.RESET_ALL} 处理 IP: {ip}:{port}")
-            
-            # 创建新记录
-            data = {
-                "type": record_type,
-                "name": domain,
-                "content": ip,
-                "ttl": 1
-            }
-            print(f"{Fore.GREEN}[创建]{Style.RESET_ALL} 添加新记录: {ip} -> {domain}")
-            result = cf_api('POST', f'zones/{ZONE_ID}/dns_records', data)
-            if result.get('success'):
-                colo_added += 1  # 计数递增
-                update_dns_log(ip_type, colo, ip, port, sub)
-            else:
-                print(f"{Fore.RED}[失败]{Style.RESET_ALL} 未能为 {ip} 创建记录")
+
+        # 先创建新记录，再删除不再需要的记录
+        colo_added = sum(on_created(ctx, entry, cf_api('POST', f'zones/{ZONE_ID}/dns_records', record_body(ctx, entry)))
+                         for entry in plan['create'])
+        colo_deleted = 0
+        if not should_keep_old(ctx, plan, colo_added):
+            colo_deleted = sum(on_deleted(ctx, record, cf_api('DELETE', f'zones/{ZONE_ID}/dns_records/{record["id"]}'),
+                                          plan, logged_ports)
+                               for record in plan['delete'])
 
         # 打印当前colo统计
-        print(f"{Fore.CYAN}[统计]{Style.RESET_ALL} {colo} 删除: {colo_deleted} 条，新增: {colo_added} 条")
+        report_colo_stats(ip_type, colo, len(plan['keep']), colo_deleted, colo_added)
         total_deleted += colo_deleted
         total_added += colo_added
 
-    # 最终统计
-    print(f"\n{Fore.BLUE}=== 最终统计 ==={Style.RESET_ALL}")
-    print(f"总删除记录: {total_deleted}")
-    print(f"总新增记录: {total_added}")
+    if dns_batch:
+        total_added, total_deleted = apply_batch(dns_batch, batch_stats)
+
+    print_summary(total_kept, total_deleted, total_added)
+    return total_deleted, total_added
+
+def apply_batch(dns_batch, batch_stats):
+    """通过批量接口提交所有变更，并按每项结果更新日志，返回 (新增数, 删除数)"""
+    emit(f"\n{Fore.CYAN}[批量]{Style.RESET_ALL} 提交 {len(dns_batch)} 项变更，"
+          f"共 {len(dns_batch.chunks())} 个请求")
+    added = Counter()
+    deleted = Counter()
+    snapshot = get_snapshot()
+    for op, success, record in dns_batch.execute(cf_api, ZONE_ID):
+        ip_type, colo, sub, ip, port = op["tag"]
+        if not success:
+            emit(f"{Fore.RED}[失败]{Style.RESET_ALL} {colo} {op['action']} {ip}")
+            snapshot.invalidate()
+            continue
+        if op["action"] == "posts":
+            snapshot.apply_created(record)
+            added[(ip_type, colo)] += 1
+            update_dns_log(ip_type, colo, ip, port, sub)
+        else:
+            snapshot.apply_deleted(op["body"]["id"])
+            deleted[(ip_type, colo)] += 1
+            if port is not None:  # 与保留记录重复的IP不删除日志
+                update_dns_log(ip_type, colo, ip, port, sub, 'delete')
+    for key, kept in batch_stats.items():
+        report_colo_stats(key[0], key[1], kept, deleted[key], added[key])
+    return sum(added.values()), sum(deleted.values())
+
+# ---------------------------- 并发更新 ----------------------------
+async def reconcile_colo(ip_type, colo, call, dry_run, dns_batch, batch_stats):
+    """
+    单个 类型/colo 的并发更新流程：查询 → 并发创建 → 并发删除
+    :return: (保留数, 新增数, 删除数)
+    """
+    _output_tag.set(f"[{ip_type}/{colo}]")  # 仅作用于本任务的上下文副本
+    try:
+        ctx = prepare_colo(ip_type, colo)
+        if ctx is None:
+            return 0, 0, 0
+        response = cached_lookup(ctx) or await call('GET', f'zones/{ZONE_ID}/dns_records', params=list_params(ctx))
+        plan = build_plan(ctx, response)
+        if plan is None:
+            return 0, 0, 0
+        kept = len(plan['keep'])
+        if dry_run:
+            return kept, 0, 0
+
+        logged_ports = read_logged_ports(ip_type, colo)
+        sync_kept_logs(ctx, plan, logged_ports)
+        if dns_batch is not None:
+            dns_batch.add_group(batch_ops(ctx, plan, logged_ports))
+            batch_stats[(ip_type, colo)] = kept
+            return kept, 0, 0
+
+        results = await asyncio.gather(*(call('POST', f'zones/{ZONE_ID}/dns_records', record_body(ctx, entry))
+                                         for entry in plan['create']))
+        added = sum(on_created(ctx, entry, result) for entry, result in zip(plan['create'], results))
+        deleted = 0
+        if not should_keep_old(ctx, plan, added):
+            results = await asyncio.gather(*(call('DELETE', f'zones/{ZONE_ID}/dns_records/{record["id"]}')
+                                             for record in plan['delete']))
+            deleted = sum(on_deleted(ctx, record, result, plan, logged_ports)
+                          for record, result in zip(plan['delete'], results))
+        report_colo_stats(ip_type, colo, kept, deleted, added)
+        return kept, added, deleted
+    except Exception as e:
+        emit(f"{Fore.RED}[错误]{Style.RESET_ALL} {colo} ({ip_type}) 处理失败: {str(e)}")
+        return 0, 0, 0
+
+async def reconcile_all(ip_types, colos, concurrency=DEFAULT_CONCURRENCY, dry_run=False, batch=False,
+                        refresh=False):
+    """
+    并发更新所有 类型 × colo 的DNS记录
+    所有API请求共享 concurrency 个并发名额，并受共享客户端的令牌桶限速
+    :return: (删除数, 新增数)
+    """
+    check_config()
+    semaphore = asyncio.Semaphore(concurrency)
+    # 默认线程池大小取决于CPU数，按并发数单独设置，避免成为瓶颈
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    async def call(*args, **kwargs):
+        async with semaphore:
+            return await asyncio.to_thread(cf_api, *args, **kwargs)
+
+    await asyncio.to_thread(load_snapshot, refresh)
+    dns_batch = DnsBatch() if batch else None
+    batch_stats = {}
+    results = await asyncio.gather(*(reconcile_colo(ip_type, colo, call, dry_run, dns_batch, batch_stats)
+                                     for ip_type in ip_types for colo in colos))
+    total_kept = sum(r[0] for r in results)
+    total_added = sum(r[1] for r in results)
+    total_deleted = sum(r[2] for r in results)
+    if dns_batch:
+        total_added, total_deleted = await asyncio.to_thread(apply_batch, dns_batch, batch_stats)
+
+    print_summary(total_kept, total_deleted, total_added)
     return total_deleted, total_added
 
+def build_message(ip_types, colos, deleted, added, log, summary=()):
+    """构建DDNS更新完成的Telegram消息（各colo统计 + 最近日志）"""
+    colo_lines = "".join(f"  • {item['colo']} ({item['ip_type'].upper()}) 保留 {item['kept']} / "
+                         f"删除 {item['deleted']} / 新增 {item['added']}\n" for item in summary)
+    return (
+        "🚀 DDNS更新完成\n"
+        f"📌 类型: {'/'.join(t.upper() for t in ip_types)}\n"
+        f"🌍 处理colo: {','.join(colos)}\n"
+        f"🗑 删除记录: {deleted}\n"
+        f"✨ 新增记录: {added}\n" +
+        colo_lines +
+        "📜 最近日志:\n" +
+        log
+    )
+
+@contextlib.contextmanager
+def hold_colo_locks(ip_types, colos):
+    """按固定顺序持有各 类型/colo 的运行锁，与测速、候补替换及其他进程的DNS同步互斥"""
+    with contextlib.ExitStack() as stack:
+        for ip_type in sorted(set(ip_types)):
+            run_lock = RunLock(ip_type, LOCK_DIR)
+            for colo in sorted(set(colos)):
+                stack.enter_context(run_lock.hold(colo))
+        yield
+
+def apply_dns_updates(ip_types, colos, notify=True, echo=True, dry_run=False, batch=False,
+                      concurrency=DEFAULT_CONCURRENCY, refresh=False, lock=True):
+    """
+    在当前进程内一次性更新多个colo的DNS记录，供 cfst.py 等模块直接调用
+    :param ip_types: 类型或类型列表（ipv4/ipv6/proxy）
+    :param notify: 是否发送Telegram通知（调用方自行汇总通知时传 False）
+    :param echo: 是否实时输出到控制台（无论是否输出，均在环形缓冲区中保留最近的日志）
+    :param dry_run: 仅输出变更计划
+    :param batch: 使用批量接口提交变更
+    :param concurrency: 并发API请求数，1 表示按colo顺序处理
+    :param refresh: 忽略本地快照，重新列出区域记录
+    :param lock: 同步期间持有各colo的运行锁（调用方已持有时传 False，同一进程重复加锁会死锁）
+    :return: (删除数, 新增数, 最近日志)
+    """
+    ip_types = [ip_types] if isinstance(ip_types, str) else list(ip_types)
+    tee = OutputTee(sys.stdout, echo=echo)
+    token = _output_tee.set(tee)
+    held = hold_colo_locks(ip_types, colos) if lock and not dry_run else contextlib.nullcontext()
+    try:
+        with held:
+            if concurrency > 1:
+                deleted, added = asyncio.run(reconcile_all(ip_types, colos, concurrency, dry_run, batch, refresh))
+            else:
+                deleted = added = 0
+                for ip_type in ip_types:
+                    type_deleted, type_added = manage_dns_records(ip_type, colos, dry_run=dry_run, batch=batch,
+                                                                  refresh=refresh)
+                    deleted += type_deleted
+                    added += type_added
+    finally:
+        _output_tee.reset(token)
+    log = tee.get_output()
+
+    if notify and not dry_run:
+        queue_telegram_message(
+            worker_url=os.getenv("CF_WORKER_URL"),
+            bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
+            chat_id=os.getenv("TELEGRAM_CHAT_ID"),
+            message=build_message(ip_types, colos, deleted, added, log, tee.summary),
+            secret_token=os.getenv("SECRET_TOKEN")
+        )
+    return deleted, added, log
+
+# ---------------------------- 单元测试 ----------------------------
+class TestPlanDnsChanges(unittest.TestCase):
+    """DNS差异计划单元测试"""
+
+    def test_plan(self):
+        records = [{"id": "1", "content": "1.1.1.1"}, {"id": "2", "content": "2.2.2.2"},
+                   {"id": "3", "content": "1.1.1.1"}]
+        colo_data = [{"ip": "1.1.1.1", "port": 443}, {"ip": "3.3.3.3", "port": 8443},
+                     {"ip": "3.3.3.3", "port": 443}]
+        plan = plan_dns_changes(records, colo_data)
+        self.assertEqual([r["id"] for r in plan["keep"]], ["1"])
+        self.assertEqual([r["id"] for r in plan["delete"]], ["2", "3"])
+        self.assertEqual(plan["create"], [{"ip": "3.3.3.3", "port": 8443}])
+        self.assertEqual(plan_dns_changes(records[:1], colo_data[:1])["delete"], [])
+
+class TestHoldColoLocks(unittest.TestCase):
+    """DNS同步期间的colo运行锁单元测试"""
+
+    def test_locks_every_type_and_colo(self):
+        import tempfile
+        from unittest.mock import patch
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        lock_dir = Path(tmp.name)
+        with patch(f"{__name__}.LOCK_DIR", lock_dir):
+            with hold_colo_locks(["ipv6", "ipv4"], ["LAX", "HKG"]):
+                for ip_type in ("ipv4", "ipv6"):
+                    for colo in ("HKG", "LAX"):
+                        with RunLock(ip_type, lock_dir).hold(colo, blocking=False) as held:
+                            self.assertIsNone(held)
+            with RunLock("ipv4", lock_dir).hold("HKG", blocking=False) as held:
+                self.assertIsNotNone(held)
+
+class TestOutputTee(unittest.TestCase):
+    """输出捕获单元测试"""
+
+    def test_ring_buffer_and_summary(self):
+        import io
+        console = io.StringIO()
+        tee = OutputTee(console, max_lines=3)
+        token = _output_tee.set(tee)
+        try:
+            for i in range(5):
+                emit(f"{Fore.GREEN}line {i}{Style.RESET_ALL}")
+            report_colo_stats("ipv4", "HKG", 3, 1, 2)
+            emit("tail", end="")
+        finally:
+            _output_tee.reset(token)
+        self.assertIn("line 0", console.getvalue())  # 实时写出全部输出
+        output = tee.get_output().split("\n")
+        self.assertEqual(output[0], "…（省略前 3 行）")
+        self.assertEqual(output[1:3], ["line 3", "line 4"])
+        self.assertEqual(output[-1], "tail")
+        self.assertEqual(tee.summary, [{"ip_type": "ipv4", "colo": "HKG", "kept": 3, "deleted": 1, "added": 2}])
+        self.assertIn("HKG (IPV4) 保留 3 / 删除 1 / 新增 2",
+                      build_message(["ipv4"], ["HKG"], 1, 2, tee.get_output(), tee.summary))
+
+        quiet = io.StringIO()
+        OutputTee(quiet, echo=False).write("hidden\n")
+        self.assertEqual(quiet.getvalue(), "")
+
+    def test_concurrent_tasks_stream_prefixed_lines(self):
+        import io
+        console = io.StringIO()
+        tee = OutputTee(console)
+        stdout = sys.stdout
+
+        async def task(colo):
+            _output_tag.set(f"[ipv4/{colo}]")
+            emit("plan")
+            await asyncio.sleep(0)
+            self.assertIs(sys.stdout, stdout)
+            emit("created\ndeleted")
+
+        async def run():
+            await asyncio.gather(task("HKG"), task("LAX"))
+
+        token = _output_tee.set(tee)
+        try:
+            asyncio.run(run())
+        finally:
+            _output_tee.reset(token)
+        self.assertEqual(console.getvalue().splitlines(), [
+            "[ipv4/HKG] plan", "[ipv4/LAX] plan",  # 逐行实时写出，而非任务结束后整段写出
+            "[ipv4/HKG] created", "[ipv4/HKG] deleted", "[ipv4/LAX] created", "[ipv4/LAX] deleted"])
+        self.assertEqual(tee.get_output().split("\n"), [
+            "[ipv4/HKG]", "plan", "[ipv4/LAX]", "plan",
+            "[ipv4/HKG]", "created", "deleted", "[ipv4/LAX]", "created", "deleted"])
+        self.assertEqual(_output_tag.get(), "")
+
 if __name__ == '__main__':
-    # 重定向标准输出
-    sys.stdout = output_collector
-    
     parser = argparse.ArgumentParser()
-    parser.add_argument('-t', choices=['ipv4', 'ipv6', 'proxy'], required=True)
+    parser.add_argument('-t', nargs='+', choices=['ipv4', 'ipv6', 'proxy'], required=True,
+                        help="一个或多个类型（例如：-t ipv4 ipv6 proxy）")
     parser.add_argument('-c', '--colos', required=True, 
                         help="逗号分隔的colo地区码列表（例如：HKG,LAX）")
+    parser.add_argument('--dry-run', action='store_true', help="仅输出变更计划，不修改DNS记录")
+    parser.add_argument('--batch', action='store_true', help="使用批量接口提交所有变更")
+    parser.add_argument('-j', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                        help=f"并发API请求数（默认{DEFAULT_CONCURRENCY}，1为按colo顺序处理）")
+    parser.add_argument('--refresh', action='store_true', help="忽略本地快照，重新列出区域记录")
     args = parser.parse_args()
     
     selected_colos = [c.strip().upper() for c in args.colos.split(',')]
-    
-    try:
-        deleted, added = manage_dns_records(args.t, selected_colos)
-        
-        # 构建Telegram消息
-        message = (
-            "🚀 DDNS更新完成\n"
-            f"📌 类型: {args.t.upper()}\n"
-            f"🌍 处理colo: {args.colos}\n"
-            f"🗑 删除记录: {deleted}\n"
-            f"✨ 新增记录: {added}\n"
-            "📜 完整日志:\n" + 
-            output_collector.get_output()
-        )
-        
-        # 发送通知
-        send_telegram_message(
-            worker_url=os.getenv("CF_WORKER_URL"),
-            bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
-            chat_id=os.getenv("TELEGRAM_CHAT_ID"),
-            message=message,
-            secret_token=os.getenv("SECRET_TOKEN")
-        )
-    finally:
-        # 恢复标准输出并打印日志
-        sys.stdout = original_stdout
-        print(output_collector.get_output())
\ No newline at end of file
+    apply_dns_updates(args.t, selected_colos, dry_run=args.dry_run, batch=args.batch,
+                      concurrency=args.concurrency, refresh=args.refresh)
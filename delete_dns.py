@@ -3,61 +3,47 @@
 import argparse
 import os
 import sys
-import requests
 from datetime import datetime
 from dotenv import load_dotenv
 from colorama import init, Fore, Style
 
+from cfst_lib.dns_batch import DnsBatch
+from cfst_lib.zone_snapshot import ZoneSnapshot, SNAPSHOT_FILE
+from ddns import build_subdomain, check_config, get_client
+
 # 初始化颜色输出
 init(autoreset=True)
 
 # 加载环境变量
 load_dotenv()
 
-# 环境变量验证
-EMAIL = os.environ.get("CLOUDFLARE_EMAIL")
-API_KEY = os.environ.get("CLOUDFLARE_API_KEY")
+# 环境变量（与 ddns.py 相同，在实际调用API前由 check_config() 检查，便于作为模块导入）
 ZONE_ID = os.environ.get("CLOUDFLARE_ZONE_ID")
+API_BASE = os.environ.get("CLOUDFLARE_API_BASE", "https://api.cloudflare.com/client/v4/")
 
-if not all([EMAIL, API_KEY, ZONE_ID]):
-    raise ValueError("缺少必要的环境变量: CLOUDFLARE_EMAIL, CLOUDFLARE_API_KEY, CLOUDFLARE_ZONE_ID")
-
-API_BASE = "https://api.cloudflare.com/client/v4/"
-
-def build_subdomain(ip_type, country):
-    """构建子域名"""
-    if ip_type == 'ipv6':
-        sub = f'{country}v6'
-    elif ip_type == 'proxy':
-        sub = f'proxy.{country}'
-    else:
-        sub = country
-    return sub.lower()
-
-def cf_api(method, endpoint, data=None):
+def cf_api(method, endpoint, data=None, params=None):
     """发送Cloudflare API请求"""
-    headers = {
-        "X-Auth-Email": EMAIL,
-        "X-Auth-Key": API_KEY,
-        "Content-Type": "application/json"
-    }
     url = f"{API_BASE}{endpoint}"
     print(f"{Fore.CYAN}[API]{Style.RESET_ALL} 请求: {method} {url}")
     
-    try:
-        response = requests.request(method, url, headers=headers, json=data)
-        result = response.json()
-        if not result.get('success'):
-            errors = result.get('errors', [{'message': '未知错误'}])
-            print(f"{Fore.RED}[API 错误]{Style.RESET_ALL} 操作失败: {errors[0].get('message')}")
-        return result
-    except requests.exceptions.RequestException as e:
-        print(f"{Fore.RED}[API 错误]{Style.RESET_ALL} 网络错误: {str(e)}")
-        return {'success': False}
-
-def delete_dns_records(ip_type, colos):
-    """删除指定colo的DNS记录"""
+    result = get_client().api(method, endpoint, data, params)
+    if not result.get('success'):
+        errors = result.get('errors') or [{'message': '未知错误'}]
+        print(f"{Fore.RED}[API 错误]{Style.RESET_ALL} 操作失败: {errors[0].get('message')}")
+    return result
+
+snapshot = ZoneSnapshot(ZONE_ID, SNAPSHOT_FILE, cf_api)
+
+def delete_dns_records(ip_type, colos, batch=False):
+    """
+    删除指定colo的DNS记录
+    :param batch: 使用批量接口一次提交所有删除
+    """
+    check_config()
     total_deleted = 0
+    dns_batch = DnsBatch() if batch else None
+    if not snapshot.load():
+        print(f"{Fore.YELLOW}[快照]{Style.RESET_ALL} 无法列出区域记录，改为逐个子域名查询")
     
     for colo in colos:
         print(f"\n{Fore.YELLOW}{'='*50}{Style.RESET_ALL}")
@@ -71,22 +57,50 @@ def delete_dns_records(ip_type, colos):
 
         # 获取现有记录
         print(f"{Fore.YELLOW}[DNS]{Style.RESET_ALL} 查询记录: {domain} ({record_type})")
-        params = {'type': record_type, 'name': domain}
-        records = cf_api('GET', f'zones/{ZONE_ID}/dns_records', params).get('result', [])
+        if snapshot.loaded:
+            records = snapshot.find(domain, record_type)
+        else:
+            params = {'type': record_type, 'name': domain, 'per_page': 100}
+            records = cf_api('GET', f'zones/{ZONE_ID}/dns_records', params=params).get('result', [])
+
+        if dns_batch is not None:
+            ops = [{"action": "deletes", "body": {"id": record['id']}, "tag": record}
+                   for record in records if record['name'] == domain]
+            for op in ops:
+                print(f"{Fore.RED}[待删除]{Style.RESET_ALL} 类型: {op['tag']['type']}, 内容: {op['tag']['content']}")
+            dns_batch.add_group(ops)
+            continue
 
         # 删除记录
         for record in records:
             if record['name'] == domain:
                 colo_deleted += 1
                 print(f"{Fore.RED}[删除]{Style.RESET_ALL} 类型: {record['type']}, 内容: {record['content']}")
-                cf_api('DELETE', f'zones/{ZONE_ID}/dns_records/{record["id"]}')
+                if cf_api('DELETE', f'zones/{ZONE_ID}/dns_records/{record["id"]}').get('success'):
+                    snapshot.apply_deleted(record['id'])
+                else:
+                    snapshot.invalidate()
 
         # 更新统计
         total_deleted += colo_deleted
         print(f"{Fore.CYAN}[统计]{Style.RESET_ALL} {colo} 删除记录: {colo_deleted}")
 
+    if dns_batch:
+        print(f"\n{Fore.CYAN}[批量]{Style.RESET_ALL} 提交 {len(dns_batch)} 项删除，共 {len(dns_batch.chunks())} 个请求")
+        for op, success, _ in dns_batch.execute(cf_api, ZONE_ID):
+            if success:
+                total_deleted += 1
+                snapshot.apply_deleted(op['tag']['id'])
+            else:
+                print(f"{Fore.RED}[失败]{Style.RESET_ALL} 未能删除: {op['tag']['name']} {op['tag']['content']}")
+                snapshot.invalidate()
+
+    snapshot.save()
     print(f"\n{Fore.BLUE}=== 最终统计 ==={Style.RESET_ALL}")
     print(f"总删除记录: {total_deleted}")
+    stats = get_client().stats()
+    print(f"API请求: {stats.get('requests', 0)} 次，重试: {stats.get('retries', 0)} 次，"
+          f"平均延迟: {stats['avg_latency_ms']} ms")
     return total_deleted
 
 if __name__ == '__main__':
@@ -94,12 +108,13 @@ if __name__ == '__main__':
     parser.add_argument('-t', '--type', choices=['ipv4', 'ipv6', 'proxy'], required=True)
     parser.add_argument('-s', '--sub', required=True, 
                         help="逗号分隔的国家代码列表（例如：us,hk）")
+    parser.add_argument('--batch', action='store_true', help="使用批量接口提交所有删除")
     args = parser.parse_args()
     
     selected_colos = [c.strip().upper() for c in args.sub.split(',')]
     
     try:
-        total = delete_dns_records(args.type, selected_colos)
+        total = delete_dns_records(args.type, selected_colos, batch=args.batch)
         print(f"\n{Fore.GREEN}操作完成！共删除 {total} 条DNS记录{Style.RESET_ALL}")
     except Exception as e:
         print(f"\n{Fore.RED}发生错误: {str(e)}{Style.RESET_ALL}")
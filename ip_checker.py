@@ -1,17 +1,29 @@
-import re
 import os
 import sys
+import json
+import time
 import socket
+import asyncio
 import logging
 import argparse
 import glob
 import subprocess
-import concurrent.futures
-from typing import Dict, List, Tuple
+import unittest
+from contextlib import ExitStack
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from datetime import datetime
 
 from dotenv import load_dotenv
-from py.tg import send_telegram_message
+from cfst_lib.tg import queue_telegram_message
+from cfst_lib.zone_snapshot import ZoneSnapshot
+from cfst_lib.ddns_journal import get_journal
+from cfst_lib.resolver import DnsResolver, CACHE_FILE as DNS_CACHE_FILE
+from cfst_lib.health_history import HealthHistory, DEFAULT_WINDOW, DEFAULT_THRESHOLD
+from cfst_lib import httping
+from cfst_lib.run_lock import RunLock
+import cfst
+import ddns
 
 # 加载环境变量
 load_dotenv()
@@ -36,7 +48,7 @@ class ColorFilter(logging.Filter):
 # 配置日志系统
 def setup_logging(ip_type: str):
     # 创建日志目录
-    log_dir = os.path.join("logs", ip_type)
+    log_dir = os.path.join(cfst.LOGS_DIR, ip_type)
     os.makedirs(log_dir, exist_ok=True)
 
     # 清理旧日志文件
@@ -110,62 +122,290 @@ def get_proxies(ip_type: str) -> Dict[str, str]:
     """根据协议类型获取代理配置"""
     return PROXY_MAP.get(ip_type, PROXY_MAP["ipv4"])
 
-def get_ips(host: str) -> List[str]:
-    """获取域名的所有IPv4地址（自动去重）"""
+def get_ports_by_ip(ip_type: str, colo: str, domain: str) -> Dict[str, List[int]]:
+    """从 ddns/<ip_type>/<colo> 日志索引获取域名下每个IP的端口（进程内共享，访问时同步其他进程的追加）"""
     try:
-        addrinfos = socket.getaddrinfo(host, None, socket.AF_INET)
-        seen = set()
-        ips = []
-        for info in addrinfos:
-            ip = info[4][0]
-            if ip not in seen:
-                seen.add(ip)
-                ips.append(ip)
-        return ips
-    except socket.gaierror as e:
-        logging.error(f"DNS解析失败 {host}: {str(e)}")
-        return []
+        return get_journal(ip_type, colo).ports_by_ip_for(domain)
     except Exception as e:
-        logging.error(f"获取{host} IP地址时发生未知错误: {str(e)}")
-        return []
+        logging.error(f"读取 {ip_type}/{colo} DDNS日志失败: {str(e)}")
+        return {}
 
 def get_ports_for_domain(ip_type: str, colo: str, domain: str) -> List[int]:
-    """从 ddns/<ip_type>/<colo>.txt 获取指定域名的所有端口"""
-    file_path = os.path.join("ddns", ip_type, f"{colo}.txt")
-    ports = set()
-    
-    try:
-        if not os.path.exists(file_path):
-            logging.warning(f"端口文件不存在: {file_path}")
-            return [443]  # 默认端口
-
-        with open(file_path, "r", encoding="utf-8") as f:
-            for line in f:
-                # 解析格式: "时间戳 - IP:端口 -> 域名"
-                match = re.search(r"(\d+\.\d+\.\d+\.\d+):(\d+)\s+->\s+" + re.escape(domain), line)
-                if match:
-                    ip, port = match.group(1), match.group(2)
-                    if port.isdigit():
-                        ports.add(int(port))
-    except Exception as e:
-        logging.error(f"读取端口文件 {file_path} 失败: {str(e)}")
-    
-    return sorted(ports) if ports else [443]
+    """获取指定域名的所有端口"""
+    ports = {port for ip_ports in get_ports_by_ip(ip_type, colo, domain).values() for port in ip_ports}
+    return sorted(ports) or [443]  # 默认端口
+
+def load_zone_snapshot():
+    """读取 ddns.py 维护的区域记录快照（只读，不存在或已过期时返回 None）"""
+    zone_id = os.getenv("CLOUDFLARE_ZONE_ID")
+    snapshot = ZoneSnapshot(zone_id)
+    return snapshot if zone_id and snapshot.load() else None
+
+# ---------------------------- 异步健康检查 ----------------------------
+DEFAULT_CONCURRENCY = 100  # 同时进行的连接数，不超过该值时全部检测在一个超时周期内完成
+PROBE_MODES = ["tcp", "http"]  # TCP连通性 / TLS+HTTP 分阶段计时与地区码校验
+HTTP_SAMPLES = 4  # HTTP 模式每个 IP:端口 的采样次数
+
+class IpHealth:
+    """单个IP的检测结果"""
 
-def check_proxy_multi_ports(host: str, ports: List[int], timeout: float, retries: int) -> Tuple[bool, str]:
-    """测试多个端口的代理连通性，只要有一个端口成功即判定成功"""
+    def __init__(self, ip: str, expected_colo: str = ""):
+        self.ip = ip
+        self.expected_colo = expected_colo
+        self.latencies: Dict[int, Optional[float]] = {}  # 端口 -> 连接耗时(ms)，失败为 None
+        self.errors: Dict[int, str] = {}
+        self.timings: Dict[int, httping.TimingStats] = {}  # HTTP 模式的分阶段计时
+
+    @property
+    def colos(self) -> Set[str]:
+        """cf-ray 中观测到的地区码"""
+        return {timing.colo for timing in self.timings.values() if timing.colo}
+
+    @property
+    def drifted(self) -> bool:
+        """实际服务的地区码与域名对应的colo不一致"""
+        return bool(self.expected_colo and self.colos and self.colos != {self.expected_colo})
+
+    @property
+    def healthy(self) -> bool:
+        """任一端口可连接且未发生地区漂移即判定可用"""
+        return any(latency is not None for latency in self.latencies.values()) and not self.drifted
+
+    def describe(self) -> str:
+        parts = []
+        for port, latency in sorted(self.latencies.items()):
+            timing = self.timings.get(port)
+            if latency is None:
+                parts.append(f"{port} ❌ {self.errors.get(port, '')}")
+            elif timing:
+                stages = " ".join(f"{name} {p50:.0f}/{p95:.0f}ms" for name, (p50, p95) in timing.percentiles().items())
+                parts.append(f"{port} ✅ {stages} (p50/p95) {timing.colo or '?'}")
+            else:
+                parts.append(f"{port} ✅ {latency:.0f}ms")
+        text = f"{self.ip}: " + ", ".join(parts)
+        if self.drifted:
+            text += f" ⚠️ 地区漂移 {self.expected_colo}→{','.join(sorted(self.colos))}"
+        return text
+
+async def probe_port(ip: str, port: int, timeout: float, retries: int,
+                     semaphore: asyncio.Semaphore) -> Tuple[Optional[float], str]:
+    """
+    测试单个 IP:端口 的TCP连通性，返回 (连接耗时ms, 错误信息)
+    所有尝试共享 timeout 的时限：连接被拒等快速失败时在剩余时间内重试，超时则不再重试
+    """
     last_error = ""
-    for port in ports:
-        for attempt in range(retries):
+    async with semaphore:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        for attempt in range(max(1, retries)):
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            start = time.perf_counter()
             try:
-                with socket.create_connection((host, port), timeout=timeout):
-                    logging.debug(f"{host}:{port} 连接成功")
-                    return True, ""
-            except (socket.timeout, ConnectionRefusedError, OSError) as e:
+                _, writer = await asyncio.wait_for(asyncio.open_connection(ip, port), remaining)
+                writer.close()
+                return (time.perf_counter() - start) * 1000, ""
+            except asyncio.TimeoutError:
+                last_error = f"TimeoutError: {timeout}s 内未建立连接"
+            except OSError as e:
                 last_error = f"{type(e).__name__}: {str(e)}"
-                logging.debug(f"{host}:{port} 第 {attempt+1} 次连接失败: {last_error}")
-    
-    return False, last_error
+            logging.debug(f"{ip}:{port} 第 {attempt+1} 次连接失败: {last_error}")
+    return None, last_error
+
+async def probe_http(ip: str, port: int, timeout: float, samples: int, host: str,
+                     semaphore: asyncio.Semaphore) -> httping.TimingStats:
+    """TLS握手 + HTTP请求，多次采样记录分阶段耗时与 cf-ray 地区码"""
+    async with semaphore:
+        return await httping.probe_timings(ip, port, host, samples=samples, timeout=timeout)
+
+async def check_all(targets: Dict[str, List[int]], resolver: DnsResolver, qtype: str, timeout: float,
+                    retries: int, concurrency: int = DEFAULT_CONCURRENCY, probe: str = "tcp",
+                    expected_colos: Dict[str, str] = None, samples: int = HTTP_SAMPLES,
+                    probe_host: str = httping.DEFAULT_HOST,
+                    ip_ports: Dict[str, Dict[str, List[int]]] = None) -> Dict[str, Dict[str, IpHealth]]:
+    """
+    并发解析全部域名（每个域名一次，A 或 AAAA），再有界并发检测每个 IP×端口
+    :param targets: 域名 -> 待检测端口列表
+    :param ip_ports: 域名 -> {IP: 端口列表}，DDNS日志中有记录的IP只检测其自身端口
+    :param probe: tcp 仅测试连通性；http 执行 TLS+HTTP 请求并校验 cf-ray 地区码
+    :param expected_colos: 域名 -> 期望的地区码（HTTP 模式用于漂移检测）
+    :return: 域名 -> {IP: IpHealth}
+    """
+    hosts = list(targets)
+    expected_colos = expected_colos or {}
+    ip_ports = ip_ports or {}
+    resolved = await resolver.resolve_many(hosts, qtype)
+    for host, error in resolver.errors.items():
+        logging.error(f"DNS解析失败 {host}: {error}")
+    results = {host: {ip: IpHealth(ip, expected_colos.get(host, "")) for ip in resolved[host]}
+               for host in hosts}
+
+    semaphore = asyncio.Semaphore(concurrency)
+    probes = [(health, port) for host in hosts for health in results[host].values()
+              for port in ip_ports.get(host, {}).get(health.ip) or targets[host]]
+    if probe == "http":
+        timings = await asyncio.gather(*(probe_http(health.ip, port, timeout, samples, probe_host, semaphore)
+                                         for health, port in probes))
+        outcomes = [(timing.percentiles()["connect"][0] if timing.ok else None,
+                     "" if timing.ok else timing.last_error or "HTTP无响应") for timing in timings]
+        for (health, port), timing in zip(probes, timings):
+            health.timings[port] = timing
+    else:
+        outcomes = await asyncio.gather(*(probe_port(health.ip, port, timeout, retries, semaphore)
+                                          for health, port in probes))
+    for (health, port), (latency, error) in zip(probes, outcomes):
+        health.latencies[port] = latency
+        if error:
+            health.errors[port] = error
+    return results
+
+# ---------------------------- 检测评估 ----------------------------
+class Assessment:
+    """一轮检测的评估结果"""
+
+    def __init__(self):
+        self.success_count = 0
+        self.fail_count = 0
+        self.dead_ips = 0
+        self.drifted_ips = 0
+        self.failed_codes: List[str] = []  # 持续故障（需要维护）的colo
+        self.dead_by_colo: Dict[str, Set[str]] = {}  # colo -> 持续故障的IP
+
+def assess(ip_type: str, proxies: Dict[str, str], results: Dict[str, Dict[str, IpHealth]],
+           history: HealthHistory, snapshot: Optional[ZoneSnapshot] = None) -> Assessment:
+    """
+    记录本轮结果到健康历史并输出报告，仅持续故障（窗口内失败达到阈值）的域名/IP计入维护
+    :param snapshot: 区域快照，提供时比对解析结果
+    """
+    outcome = Assessment()
+    record_type = 'AAAA' if ip_type == 'ipv6' else 'A'
+    for host, code in proxies.items():
+        health = results.get(host, {})
+        ips = list(health)
+        if snapshot:
+            expected = {r['content'] for r in snapshot.find(host, record_type)}
+            if expected and expected != set(ips):
+                logging.warning(f"[{code}] 解析结果与区域快照不一致: "
+                                f"快照缺少 {sorted(set(ips) - expected) or '无'}，"
+                                f"未解析到 {sorted(expected - set(ips)) or '无'}")
+
+        healthy = sum(1 for h in health.values() if h.healthy)
+        history.record_domain(host, healthy > 0)
+        if health:
+            history.prune(host, ips)
+        for ip, h in health.items():
+            latencies = [latency for latency in h.latencies.values() if latency is not None]
+            history.record_ip(host, ip, h.healthy, min(latencies) if latencies else None)
+        sustained = {ip for ip, h in health.items() if not h.healthy and history.ip_down(host, ip)}
+        if sustained:
+            outcome.dead_by_colo[code] = sustained
+
+        report = '\n  - '.join(f"{h.describe()} [{history.trend(host, ip)}]"
+                               for ip, h in health.items()) if health else '无IP地址'
+        outcome.dead_ips += len(health) - healthy
+        outcome.drifted_ips += sum(1 for h in health.values() if h.drifted)
+        if healthy:
+            outcome.success_count += 1
+            log = logging.info if healthy == len(health) else logging.warning
+            log(f"[{code}] ✅ {host} 可用IP: {healthy}/{len(health)}\n  - {report}")
+        else:
+            outcome.fail_count += 1
+            logging.error(f"[{code}] ❌ {host} 检测失败 [{history.trend(host)}]\n  - {report}")
+            if history.domain_down(host):
+                outcome.failed_codes.append(code)
+            else:
+                logging.warning(f"[{code}] ⏳ 最近 {history.window} 次中失败未达 {history.threshold} 次，暂不触发维护")
+    return outcome
+
+def reset_history(history: HealthHistory, proxies: Dict[str, str], codes: Iterable[str]):
+    """已维护的colo重新累积健康历史"""
+    codes = set(codes)
+    for host, code in proxies.items():
+        if code in codes:
+            history.reset(host)
+
+def invalidate_resolved(resolver: DnsResolver, proxies: Dict[str, str], codes: Iterable[str]) -> int:
+    """DNS记录已更新的colo作废解析缓存并写出，下次检测重新解析，不再检测已替换的IP"""
+    codes = set(codes)
+    count = resolver.invalidate(host for host, code in proxies.items() if code in codes)
+    resolver.save()
+    return count
+
+# ---------------------------- 失效IP替换 ----------------------------
+SPEED_DIR = cfst.SPEED_DIR
+
+async def verify_candidates(entries: List[dict], timeout: float, retries: int,
+                            concurrency: int = DEFAULT_CONCURRENCY) -> List[dict]:
+    """复检候补节点的连通性，返回可用的节点（保持排名顺序）"""
+    semaphore = asyncio.Semaphore(concurrency)
+    outcomes = await asyncio.gather(*(probe_port(e['ip'], e.get('port', 443), timeout, retries, semaphore)
+                                      for e in entries))
+    return [entry for entry, (latency, _) in zip(entries, outcomes) if latency is not None]
+
+def repair_colo(ip_type: str, colo: str, dead_ips: Set[str], timeout: float, retries: int,
+                concurrency: int = DEFAULT_CONCURRENCY, speed_dir: Path = None) -> Optional[int]:
+    """
+    从 speed/<ip_type>/<colo>.json 中移除失效IP，并用复检可用的候补节点（<colo>_reserve.json）补齐
+    :return: 替换的IP数；候补不足以补齐时返回 None（文件保持不变，由调用方回退完整测速）
+    """
+    speed_dir = speed_dir or SPEED_DIR / ip_type
+    try:
+        with open(speed_dir / f"{colo}.json", 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.error(f"[{colo}] 读取测速结果失败: {str(e)}")
+        return None
+
+    alive = [e for e in entries if e.get('ip') not in dead_ips]
+    needed = len(entries) - len(alive)
+    if needed == 0:
+        return 0
+    current = {e.get('ip') for e in entries}
+    candidates = [e for e in cfst.load_reserve(speed_dir, colo)
+                  if e.get('ip') not in dead_ips and e.get('ip') not in current]
+    verified = asyncio.run(verify_candidates(candidates, timeout, retries, concurrency))
+    if len(verified) < needed:
+        logging.warning(f"[{colo}] 候补可用IP不足 ({len(verified)}/{needed})，回退完整测速")
+        return None
+
+    replacements = verified[:needed]
+    for entry in replacements:
+        logging.info(f"[{colo}] 🔧 候补替换: {entry['ip']}:{entry.get('port', 443)}")
+    cfst.save_speed_files(speed_dir, ip_type, colo, alive + replacements)
+    cfst.save_reserve(speed_dir, colo, verified[needed:])  # 复检失败的候补一并移除
+    return needed
+
+def repair_colos(ip_type: str, dead_by_colo: Dict[str, Set[str]], timeout: float, retries: int,
+                 concurrency: int = DEFAULT_CONCURRENCY) -> Tuple[Dict[str, int], List[str]]:
+    """
+    逐colo替换失效IP，并在进程内同步DNS（只删除失效记录、创建替换记录）
+    :return: ({colo: 替换数}, 需要完整测速的colo列表)
+    """
+    replaced, exhausted = {}, []
+    run_lock = RunLock(ip_type, cfst.LOCK_DIR)
+    # colo锁一直持有到DNS同步结束，避免其他进程在替换与同步之间测速或同步同一colo
+    with ExitStack() as stack:
+        for colo, dead_ips in dead_by_colo.items():
+            if stack.enter_context(run_lock.hold(colo, blocking=False)) is None:
+                # 正在测速的colo交由完整测速合并到进行中的运行，避免同时改写 speed 文件
+                logging.info(f"[{colo}] 正在测速，跳过候补替换")
+                exhausted.append(colo)
+                continue
+            count = repair_colo(ip_type, colo, dead_ips, timeout, retries, concurrency)
+            if count is None:
+                exhausted.append(colo)
+            else:
+                replaced[colo] = count
+        if replaced:
+            try:
+                deleted, added, _ = ddns.apply_dns_updates(ip_type, list(replaced), notify=False, lock=False)
+                logging.info(f"DNS已同步: 删除 {deleted} 条，新增 {added} 条")
+            except Exception as e:
+                logging.error(f"DNS同步失败: {str(e)}")
+                exhausted.extend(replaced)
+                replaced = {}
+    return replaced, exhausted
 
 def main():
     # 参数解析
@@ -181,11 +421,32 @@ def main():
     parser.add_argument('--timeout', type=float, default=1.0,
                        help='单次连接超时时间（秒）')
     parser.add_argument('--retries', type=int, default=3,
-                       help='最大重试次数')
+                       help='超时时间内连接被拒时的最大尝试次数')
+    parser.add_argument('-j', '--concurrency', type=int, default=DEFAULT_CONCURRENCY,
+                       help='同时检测的 IP×端口 连接数')
+    parser.add_argument('--repair', action='store_true',
+                       help='仅替换失效IP（使用候补节点），候补不足时才触发完整测速')
+    parser.add_argument('--dns-server',
+                       help='解析使用的DNS服务器（IP[:端口]，例如区域的权威服务器），默认读取系统配置')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW,
+                       help='健康历史窗口：参考最近N次检测结果')
+    parser.add_argument('--fail-threshold', type=int, default=DEFAULT_THRESHOLD,
+                       help='窗口内失败次数达到该值才判定故障并触发维护（1 为立即触发）')
+    parser.add_argument('--probe', choices=PROBE_MODES, default='tcp',
+                       help='检测方式：tcp 仅测试连通性；http 执行TLS握手与HTTP请求，'
+                            '统计连接/TLS/首字节耗时 p50/p95 并校验 cf-ray 地区码')
+    parser.add_argument('--samples', type=int, default=HTTP_SAMPLES,
+                       help='HTTP 模式每个 IP:端口 的采样次数')
+    parser.add_argument('--probe-host', default=httping.DEFAULT_HOST,
+                       help='HTTP 模式使用的 SNI/Host')
     # 新增git-commit参数
     parser.add_argument('--git-commit', action='store_true',
                        help='触发CFST更新时自动提交git变更')
     args = parser.parse_args()
+    try:
+        history = HealthHistory(args.type, window=args.window, threshold=args.fail_threshold)
+    except ValueError as e:
+        parser.error(str(e))
 
     # 初始化日志系统（按协议类型分目录）
     log_path = setup_logging(args.type)
@@ -194,53 +455,20 @@ def main():
     # 动态获取代理配置
     proxies = get_proxies(args.type)
 
-    ips_cache: Dict[str, List[str]] = {}
-    for host, code in proxies.items():
-        ips = get_ips(host)
-        ips_cache[host] = ips
-        ips_formatted = '\n  - '.join(ips) if ips else '无IP地址'
-        logging.info(f"[{code}] 域名解析 {host} => \n  - {ips_formatted}")
-
-    failed_nodes: List[str] = []
-    success_count = 0
-    fail_count = 0
-
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_host = {}
-        for host, code in proxies.items():
-            # 获取当前域名的colo对应的端口
-            ports = get_ports_for_domain(args.type, code, host)
-            future = executor.submit(
-                check_proxy_multi_ports,
-                host=host,
-                ports=ports,
-                timeout=args.timeout,
-                retries=args.retries
-            )
-            future_to_host[future] = (host, code)
+    # 解析一次，检测每个域名下所有IP的所有端口
+    record_type = 'AAAA' if args.type == 'ipv6' else 'A'
+    targets = {host: get_ports_for_domain(args.type, code, host) for host, code in proxies.items()}
+    ip_ports = {host: get_ports_by_ip(args.type, code, host) for host, code in proxies.items()}
+    resolver = DnsResolver(args.dns_server, cache_file=DNS_CACHE_FILE)
+    results = asyncio.run(check_all(targets, resolver, record_type, args.timeout, args.retries, args.concurrency,
+                                    probe=args.probe, expected_colos=proxies, samples=args.samples,
+                                    probe_host=args.probe_host, ip_ports=ip_ports))
+    resolver.save()
 
-        for future in concurrent.futures.as_completed(future_to_host):
-            host, code = future_to_host[future]
-            try:
-                success, error_msg = future.result()
-                ips = ips_cache.get(host, [])
-                ips_str = '\n  - '.join(ips) if ips else '无IP地址'
-                
-                if success:
-                    success_count += 1
-                    logging.info(f"[{code}] ✅ {host} 连接成功")
-                else:
-                    fail_count += 1
-                    logging.error(
-                        f"[{code}] ❌ {host} 检测失败\n"
-                        f"  解析IP:\n  - {ips_str}\n"
-                        f"  错误原因: {error_msg}"
-                    )
-                    failed_nodes.append(code)
-            except Exception as e:
-                logging.error(f"处理区域 {host} 时发生异常: {str(e)}")
-                fail_count += 1
-                failed_nodes.append(code)
+    outcome = assess(args.type, proxies, results, history, load_zone_snapshot())
+    success_count, fail_count = outcome.success_count, outcome.fail_count
+    failed_nodes, dead_by_colo = outcome.failed_codes, outcome.dead_by_colo
+    dead_ips, drifted_ips = outcome.dead_ips, outcome.drifted_ips
 
     logging.info("\n" + "="*40)
     logging.info(f"总检测区域: {len(proxies)}")
@@ -252,18 +480,24 @@ def main():
 
     unique_codes = sorted(set(failed_nodes))
 
-# 在 main() 函数中找到以下代码块：
+    # 修复模式：先用候补节点替换失效IP，只有候补不足或无法解析的colo才完整测速
+    replaced: Dict[str, int] = {}
+    retest_codes = unique_codes
+    if args.repair and dead_by_colo:
+        replaced, exhausted = repair_colos(args.type, dead_by_colo, args.timeout, args.retries,
+                                           args.concurrency)
+        retest_codes = sorted((set(unique_codes) - set(replaced)) | set(exhausted))
+
     # 触发CFST更新
     triggered_optimization = False
     trigger_failure = False  # 新增标志
     error_msg = ""  # 新增错误信息存储
-    unique_codes = sorted(set(failed_nodes))
     
-    if unique_codes:
-        codes_str = ",".join(unique_codes)
+    if retest_codes:
+        codes_str = ",".join(retest_codes)
         logging.info(f"触发更新区域: {codes_str}")
         try:
-            cfst_cmd = ['python', 'cfst.py', '-t', args.type, '-c', codes_str]
+            cfst_cmd = [sys.executable, str(cfst.BASE_DIR / 'cfst.py'), '-t', args.type, '-c', codes_str]
             if args.git_commit:
                 cfst_cmd.append('--git-commit')
             subprocess.run(
@@ -284,11 +518,23 @@ def main():
             logging.error(error_msg)
             trigger_failure = True
 
+    # 已维护的域名重新累积健康历史（更新失败的保留历史，下次继续触发）
+    maintained = set(replaced) | (set(retest_codes) if triggered_optimization else set())
+    reset_history(history, proxies, maintained)
+    history.save()
+    invalidate_resolved(resolver, proxies, maintained)
+
+    # 仅替换了失效IP时自行提交（完整测速已由 cfst.py --git-commit 提交）
+    if replaced and args.git_commit and not triggered_optimization:
+        cfst.CFSpeedTester.git_commit_and_push(args.type)
+
     # 构建Telegram消息
     timestamp = datetime.now().strftime("%m/%d %H:%M")
     
     # 维护状态描述
     maintenance_status = []
+    if replaced:
+        maintenance_status.append("🔧 已替换: " + ", ".join(f"{c}({n})" for c, n in sorted(replaced.items())))
     if triggered_optimization:
         maintenance_status.append("⚡ 维护已触发")
     if trigger_failure:
@@ -301,13 +547,14 @@ def main():
         "├─ 健康检查",
         f"│  ├─ 类型: {args.type.upper()}",
         f"│  ├─ ✅ 正常: {success_count}/{len(proxies)}",
+        f"│  ├─ ⚠️ 异常IP: {dead_ips}" + (f"（地区漂移 {drifted_ips}）" if drifted_ips else ""),
         f"│  └─ ❌ 故障: {', '.join(unique_codes) if unique_codes else '无'}",
         "└─ 自动维护",
         f"   └─ {' | '.join(maintenance_status)}"
     ]
 
     # 发送通知
-    send_telegram_message(
+    queue_telegram_message(
         worker_url=os.getenv("CF_WORKER_URL"),
         bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
         chat_id=os.getenv("TELEGRAM_CHAT_ID"),
@@ -315,5 +562,97 @@ def main():
         secret_token=os.getenv("SECRET_TOKEN")
     )
 
+# ---------------------------- 单元测试 ----------------------------
+class TestRepairColo(unittest.TestCase):
+    """失效IP替换单元测试（本地端口）"""
+
+    def test_backfill_from_verified_reserve(self):
+        import tempfile
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        speed_dir = Path(tmp.name)
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        open_port, closed_port = listener.getsockname()[1], closed.getsockname()[1]
+        closed.close()
+
+        def entry(ip, port=443):
+            return {"ip": ip, "port": port, "speed": 0.0, "emoji": "", "colo": "HKG", "country": "HK"}
+        (speed_dir / "HKG.json").write_text(json.dumps([entry("10.0.0.1"), entry("10.0.0.2")]))
+        cfst.save_reserve(speed_dir, "HKG", [entry("127.0.0.2", closed_port), entry("127.0.0.1", open_port)])
+        try:
+            self.assertEqual(repair_colo("ipv4", "HKG", {"10.0.0.1"}, 1.0, 1, speed_dir=speed_dir), 1)
+            self.assertIsNone(repair_colo("ipv4", "HKG", {"10.0.0.2"}, 1.0, 1, speed_dir=speed_dir))
+        finally:
+            listener.close()
+        saved = json.loads((speed_dir / "HKG.json").read_text())
+        self.assertEqual([e["ip"] for e in saved], ["10.0.0.2", "127.0.0.1"])
+        self.assertEqual(cfst.load_reserve(speed_dir, "HKG"), [])
+
+    def test_dns_sync_holds_colo_lock(self):
+        import tempfile
+        from unittest.mock import patch
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        lock_dir = Path(tmp.name)
+        busy = []
+
+        def apply_dns_updates(ip_type, colos, notify=True, lock=True):
+            for colo in colos:
+                with RunLock(ip_type, lock_dir).hold(colo, blocking=False) as held:
+                    busy.append(held is None)
+            return 0, 1, ""
+
+        with patch.object(cfst, "LOCK_DIR", lock_dir), \
+                patch(f"{__name__}.repair_colo", return_value=1), \
+                patch.object(ddns, "apply_dns_updates", side_effect=apply_dns_updates) as apply:
+            replaced, exhausted = repair_colos("ipv4", {"HKG": {"10.0.0.1"}}, 1.0, 1)
+        self.assertEqual((replaced, exhausted, busy), ({"HKG": 1}, [], [True]))
+        self.assertFalse(apply.call_args.kwargs["lock"])
+
+class TestCheckAll(unittest.TestCase):
+    """异步健康检查单元测试（本地端口）"""
+
+    def test_probes_every_port_within_timeout(self):
+        listener = socket.socket()
+        listener.bind(("127.0.0.1", 0))
+        listener.listen()
+        closed = socket.socket()
+        closed.bind(("127.0.0.1", 0))
+        open_port, closed_port = listener.getsockname()[1], closed.getsockname()[1]
+        closed.close()
+        try:
+            start = time.perf_counter()
+            results = asyncio.run(check_all({"127.0.0.1": [open_port, closed_port]}, DnsResolver(),
+                                            "A", timeout=1.0, retries=3))
+            self.assertLess(time.perf_counter() - start, 1.0)
+            own_ports = asyncio.run(check_all({"127.0.0.1": [open_port, closed_port]}, DnsResolver(), "A",
+                                              timeout=1.0, retries=1,
+                                              ip_ports={"127.0.0.1": {"127.0.0.1": [open_port]}}))
+            self.assertEqual(list(own_ports["127.0.0.1"]["127.0.0.1"].latencies), [open_port])
+        finally:
+            listener.close()
+        health = results["127.0.0.1"]["127.0.0.1"]
+        self.assertTrue(health.healthy)
+        self.assertIsNotNone(health.latencies[open_port])
+        self.assertIsNone(health.latencies[closed_port])
+        self.assertIn("ConnectionRefusedError", health.errors[closed_port])
+
+    def test_colo_drift_marks_ip_unhealthy(self):
+        health = IpHealth("1.1.1.1", expected_colo="HKG")
+        timing = httping.TimingStats("1.1.1.1", 443)
+        timing.connect, timing.tls, timing.ttfb, timing.colo = [10.0, 30.0], [20.0, 25.0], [40.0, 60.0], "HKG"
+        health.timings[443], health.latencies[443] = timing, 10.0
+        self.assertTrue(health.healthy)
+        self.assertIn("ttfb 40/60ms", health.describe())
+
+        timing.colo = "SJC"
+        self.assertTrue(health.drifted)
+        self.assertFalse(health.healthy)
+        self.assertIn("HKG→SJC", health.describe())
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,403 @@
+"""
+常驻监控服务
+
+在单个进程内替代 cron 串联的 ip_checker.py → cfst.py → ddns.py：
+1. 每个类型按带抖动的间隔执行健康检查（解析缓存、健康历史、DDNS日志索引常驻内存）
+2. 持续故障的colo进入维护队列（按 类型/colo 去重），由单个工作线程依次执行：
+   先用候补节点替换失效IP（--repair），候补不足时完整测速，完成后立即更新DNS，
+   并作废该colo域名的解析缓存与区域快照，下一轮检测读取新的记录
+3. 可选的定期完整测速（--speed-interval）
+每个维护任务完成后发送一条Telegram通知，并可提交Git。
+"""
+
+import os
+import sys
+import time
+import random
+import signal
+import asyncio
+import logging
+import argparse
+import unittest
+from unittest.mock import Mock, patch
+from types import SimpleNamespace
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+
+import cfst
+import ddns
+import ip_checker
+from cfst_lib.health_history import HealthHistory, DEFAULT_WINDOW, DEFAULT_THRESHOLD
+from cfst_lib.metrics import RunMetrics
+from cfst_lib.resolver import DnsResolver, CACHE_FILE as DNS_CACHE_FILE
+from cfst_lib.tg import queue_telegram_message
+
+load_dotenv()
+
+# ---------------------------- 配置参数 ----------------------------
+DEFAULT_CHECK_INTERVAL = 300  # 健康检查间隔（秒）
+DEFAULT_SPEED_INTERVAL = 0  # 定期完整测速间隔（秒），0 表示仅在故障时测速
+DEFAULT_JITTER = 0.2  # 间隔随机抖动比例，避免多个类型同时检测
+
+def jittered(interval: float, jitter: float) -> float:
+    return interval * random.uniform(1 - jitter, 1 + jitter)
+
+def setup_logging():
+    """控制台 + logs/monitor.log（沿用 ip_checker 的着色）"""
+    os.makedirs(cfst.LOGS_DIR, exist_ok=True)
+    logger = logging.getLogger()
+    logger.setLevel(logging.INFO)
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+    file_handler = logging.FileHandler(cfst.LOGS_DIR / "monitor.log", encoding="utf-8")
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+    console_handler = logging.StreamHandler()
+    console_handler.addFilter(ip_checker.ColorFilter())
+    console_handler.setFormatter(logging.Formatter('%(asctime)s %(message)s', "%H:%M:%S"))
+    logger.addHandler(file_handler)
+    logger.addHandler(console_handler)
+
+class Job:
+    """维护任务：repair 替换失效IP（候补不足时升级为测速）/ speed 完整测速"""
+
+    def __init__(self, kind: str, ip_type: str, colo: str, dead_ips: Set[str] = None):
+        self.kind = kind
+        self.ip_type = ip_type
+        self.colo = colo
+        self.dead_ips = set(dead_ips or ())
+
+class Monitor:
+    """常驻监控：检测循环 + 去重的维护队列"""
+
+    def __init__(self, args):
+        self.args = args
+        self.ip_types: List[str] = args.type
+        self.histories = {t: HealthHistory(t, window=args.window, threshold=args.fail_threshold)
+                          for t in self.ip_types}
+        self.resolver = DnsResolver(args.dns_server, cache_file=DNS_CACHE_FILE)
+        self.testers: Dict[str, cfst.CFSpeedTester] = {}
+        self.pending: Dict[Tuple[str, str], Job] = {}  # 排队或执行中的任务
+        self.followups: Dict[Tuple[str, str], Job] = {}  # 任务执行期间收到的请求，完成后重新排队
+        self.running: Optional[Job] = None
+        self.queue: Optional[asyncio.Queue] = None
+        self.stop: Optional[asyncio.Event] = None
+
+    # ---------------------------- 调度 ----------------------------
+    def enqueue(self, kind: str, ip_type: str, colo: str, dead_ips: Set[str] = None):
+        """
+        加入维护队列；同一 类型/colo 已排队时合并（测速覆盖替换）
+        执行中的任务不再修改，期间的请求合并为后续任务，由 finish() 在其结束后重新排队
+        """
+        key = (ip_type, colo)
+        job = self.pending.get(key)
+        if job is not None and job is self.running:
+            job = self.followups.get(key)
+            if job is None:
+                self.followups[key] = Job(kind, ip_type, colo, dead_ips)
+                logging.info(f"[{ip_type}/{colo}] 维护进行中，完成后再处理新的请求")
+                return
+        if job is None:
+            self._put(Job(kind, ip_type, colo, dead_ips))
+            return
+        if kind == "speed":
+            job.kind = "speed"
+        job.dead_ips |= set(dead_ips or ())
+
+    def _put(self, job: Job):
+        self.pending[(job.ip_type, job.colo)] = job
+        self.queue.put_nowait(job)
+        logging.info(f"[{job.ip_type}/{job.colo}] 加入维护队列: "
+                     f"{'替换失效IP' if job.kind == 'repair' else '完整测速'}")
+
+    def finish(self, job: Job):
+        """
+        任务结束：作废该colo的缓存，并重新排队执行期间收到的请求
+        已由本任务处理的失效IP与已执行的测速不再重复
+        """
+        self.invalidate_caches(job)
+        self.running = None
+        self.pending.pop((job.ip_type, job.colo), None)
+        followup = self.followups.pop((job.ip_type, job.colo), None)
+        if followup is None:
+            return
+        followup.dead_ips -= job.dead_ips
+        if (followup.kind == "speed" and job.kind != "speed") or followup.dead_ips:
+            self._put(followup)
+
+    async def sleep(self, seconds: float) -> bool:
+        """等待指定时间，收到停止信号时返回 False"""
+        try:
+            await asyncio.wait_for(self.stop.wait(), seconds)
+            return False
+        except asyncio.TimeoutError:
+            return True
+
+    async def check_loop(self, ip_type: str):
+        while not self.stop.is_set():
+            try:
+                await self.check(ip_type)
+            except Exception as e:
+                logging.error(f"[{ip_type}] 健康检查异常: {str(e)}", exc_info=True)
+            if self.args.once or not await self.sleep(jittered(self.args.interval, self.args.jitter)):
+                return
+
+    async def speed_loop(self, ip_type: str):
+        while await self.sleep(jittered(self.args.speed_interval, self.args.jitter)):
+            for colo in sorted(set(ip_checker.get_proxies(ip_type).values())):
+                self.enqueue("speed", ip_type, colo)
+
+    async def check(self, ip_type: str):
+        """执行一轮检测并将持续故障的colo加入队列"""
+        args = self.args
+        proxies = ip_checker.get_proxies(ip_type)
+        targets = {host: ip_checker.get_ports_for_domain(ip_type, code, host) for host, code in proxies.items()}
+        ip_ports = {host: ip_checker.get_ports_by_ip(ip_type, code, host) for host, code in proxies.items()}
+        record_type = 'AAAA' if ip_type == 'ipv6' else 'A'
+        start = time.perf_counter()
+        results = await ip_checker.check_all(targets, self.resolver, record_type, args.timeout, args.retries,
+                                             args.concurrency, probe=args.probe, expected_colos=proxies,
+                                             ip_ports=ip_ports)
+        history = self.histories[ip_type]
+        outcome = ip_checker.assess(ip_type, proxies, results, history, ip_checker.load_zone_snapshot())
+        history.save()
+        self.resolver.save()
+        logging.info(f"[{ip_type}] 检测完成: 正常 {outcome.success_count}/{len(proxies)}，"
+                     f"异常IP {outcome.dead_ips}，耗时 {time.perf_counter() - start:.1f}s")
+
+        for colo in sorted(set(outcome.failed_codes) | set(outcome.dead_by_colo)):
+            dead_ips = outcome.dead_by_colo.get(colo)
+            if args.repair and dead_ips:
+                self.enqueue("repair", ip_type, colo, dead_ips)
+            elif colo in outcome.failed_codes:
+                self.enqueue("speed", ip_type, colo)
+
+    # ---------------------------- 维护 ----------------------------
+    async def worker(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = await self.queue.get()
+            self.running = job
+            try:
+                maintained, lines = await loop.run_in_executor(None, self.run_job, job)
+                if maintained:
+                    ip_checker.reset_history(self.histories[job.ip_type], ip_checker.get_proxies(job.ip_type),
+                                             [job.colo])
+                    self.histories[job.ip_type].save()
+                self.notify(job, lines)  # 放入后台发送队列，不等待 Telegram
+            except Exception as e:
+                logging.error(f"[{job.ip_type}/{job.colo}] 维护失败: {str(e)}", exc_info=True)
+            finally:
+                self.finish(job)
+                self.queue.task_done()
+
+    def invalidate_caches(self, job: Job):
+        """维护可能已修改该colo的DNS记录：作废其域名的解析缓存，并让区域快照重新读取"""
+        try:
+            ip_checker.invalidate_resolved(self.resolver, ip_checker.get_proxies(job.ip_type), [job.colo])
+            ddns.get_snapshot().expire()
+        except Exception as e:
+            logging.error(f"[{job.ip_type}/{job.colo}] 缓存作废失败: {str(e)}")
+
+    def tester(self, ip_type: str) -> cfst.CFSpeedTester:
+        if ip_type not in self.testers:
+            self.testers[ip_type] = cfst.CFSpeedTester(ip_type, engine=self.args.engine,
+                                                       warm_start=self.args.warm_start)
+        return self.testers[ip_type]
+
+    def run_job(self, job: Job) -> Tuple[bool, List[str]]:
+        """在工作线程中执行维护任务，返回 (是否完成维护, 通知内容)"""
+        args = self.args
+        lines = []
+        if job.kind == "repair":
+            replaced, _ = ip_checker.repair_colos(job.ip_type, {job.colo: job.dead_ips}, args.timeout,
+                                                  args.retries, args.concurrency)
+            if job.colo in replaced:
+                lines.append(f"🔧 已替换失效IP: {replaced[job.colo]} 个")
+                self.commit(job, lines)
+                return True, lines
+            lines.append("⚠️ 候补不足，执行完整测速")
+            job.kind = "speed"  # 执行期间收到的测速请求由本次测速满足
+
+        tester = self.tester(job.ip_type)
+        tester.metrics = RunMetrics(job.ip_type, job="monitor")
+        ok = tester.run_colos([job.colo]).get(job.colo, False)
+        tester.metrics.set_colo_result(job.colo, ok)
+        if not ok:
+            lines.append("❌ 测速失败")
+        elif job.colo in tester.coalesced:
+            lines.append("🔗 已合并进行中的测速，DNS由其更新")
+        else:
+            dns_result = tester.update_dns([job.colo])
+            if dns_result:
+                deleted, added, _ = dns_result
+                lines.append(f"⚡ 测速完成，DDNS更新: 删除 {deleted} 条，新增 {added} 条")
+            else:
+                lines.append("❌ 测速完成，DDNS更新失败")
+                ok = False
+        try:
+            tester.metrics.finish()
+            report_dir = cfst.LOGS_DIR / job.ip_type
+            tester.metrics.write_json(report_dir / f"cfst_run_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+            tester.metrics.write_prometheus(report_dir / "cfst.prom")
+        except Exception as e:
+            logging.error(f"运行指标导出失败: {str(e)}")
+        if ok:
+            self.commit(job, lines)
+        return ok, lines
+
+    def commit(self, job: Job, lines: List[str]):
+        if self.args.git_commit:
+            committed = cfst.CFSpeedTester.git_commit_and_push(job.ip_type)
+            lines.append("📦 Git已提交" if committed else "📦 Git无变更或提交失败")
+
+    def notify(self, job: Job, lines: List[str]):
+        timestamp = datetime.now().strftime("%m/%d %H:%M")
+        message = [f"🛰 监控维护 - {timestamp}", f"├─ 类型: {job.ip_type.upper()}", f"├─ 地区: {job.colo}",
+                   "└─ 自动维护"]
+        message += [f"   {'└─' if i == len(lines) - 1 else '├─'} {line}" for i, line in enumerate(lines)]
+        queue_telegram_message(
+            worker_url=os.getenv("CF_WORKER_URL"),
+            bot_token=os.getenv("TELEGRAM_BOT_TOKEN"),
+            chat_id=os.getenv("TELEGRAM_CHAT_ID"),
+            message="\n".join(message),
+            secret_token=os.getenv("SECRET_TOKEN")
+        )
+
+    # ---------------------------- 运行 ----------------------------
+    async def run(self):
+        self.queue = asyncio.Queue()
+        self.stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop.set)
+            except (NotImplementedError, RuntimeError):
+                pass  # Windows 不支持，Ctrl+C 以 KeyboardInterrupt 退出
+
+        logging.info(f"监控启动: {', '.join(self.ip_types)}，检测间隔 {self.args.interval}s"
+                     + (f"，定期测速 {self.args.speed_interval}s" if self.args.speed_interval else ""))
+        worker = asyncio.create_task(self.worker())
+        checks = [asyncio.create_task(self.check_loop(t)) for t in self.ip_types]
+        speeds = [asyncio.create_task(self.speed_loop(t))
+                  for t in self.ip_types if self.args.speed_interval and not self.args.once]
+        if self.args.once:
+            await asyncio.gather(*checks)
+            await self.queue.join()
+        else:
+            await self.stop.wait()
+        logging.info("监控停止，等待当前维护任务结束")
+        for task in checks + speeds + [worker]:
+            task.cancel()
+        await asyncio.gather(*checks, *speeds, worker, return_exceptions=True)
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='常驻监控：健康检查、测速与DNS更新',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-t', '--type', nargs='+', default=['ipv4'], choices=['ipv4', 'ipv6', 'proxy'],
+                        help='监控的协议类型（可多个）')
+    parser.add_argument('--interval', type=float, default=DEFAULT_CHECK_INTERVAL, help='健康检查间隔（秒）')
+    parser.add_argument('--speed-interval', type=float, default=DEFAULT_SPEED_INTERVAL,
+                        help='定期完整测速间隔（秒），0 表示仅在故障时测速')
+    parser.add_argument('--jitter', type=float, default=DEFAULT_JITTER, help='间隔随机抖动比例')
+    parser.add_argument('--once', action='store_true', help='每个类型只检测一轮，维护队列清空后退出')
+    parser.add_argument('--repair', action='store_true', help='优先用候补节点替换失效IP')
+    parser.add_argument('--probe', choices=ip_checker.PROBE_MODES, default='tcp', help='检测方式')
+    parser.add_argument('--timeout', type=float, default=1.0, help='单次连接超时时间（秒）')
+    parser.add_argument('--retries', type=int, default=3, help='超时时间内连接被拒时的最大尝试次数')
+    parser.add_argument('-j', '--concurrency', type=int, default=ip_checker.DEFAULT_CONCURRENCY,
+                        help='同时检测的 IP×端口 连接数')
+    parser.add_argument('--window', type=int, default=DEFAULT_WINDOW, help='健康历史窗口')
+    parser.add_argument('--fail-threshold', type=int, default=DEFAULT_THRESHOLD, help='窗口内触发维护的失败次数')
+    parser.add_argument('--dns-server', help='解析使用的DNS服务器（IP[:端口]）')
+    parser.add_argument('--engine', choices=cfst.ENGINES, default='binary', help='测速的延迟测试引擎')
+    parser.add_argument('--warm-start', type=int, default=0, help='测速时优先测试历史最佳的N个IP')
+    parser.add_argument('--git-commit', action='store_true', help='维护完成后提交Git')
+    args = parser.parse_args()
+    args.type = list(dict.fromkeys(args.type))
+    return args
+
+def main():
+    args = parse_arguments()
+    setup_logging()
+    try:
+        monitor = Monitor(args)
+    except ValueError as e:
+        logging.error(str(e))
+        return 2
+    try:
+        asyncio.run(monitor.run())
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+# ---------------------------- 单元测试 ----------------------------
+class TestMonitorQueue(unittest.TestCase):
+    """维护队列去重单元测试"""
+
+    def test_enqueue_dedup_and_upgrade(self):
+        args = SimpleNamespace(type=["ipv4"], window=DEFAULT_WINDOW, fail_threshold=DEFAULT_THRESHOLD,
+                               dns_server="127.0.0.1")
+
+        async def run():
+            monitor = Monitor(args)
+            monitor.queue = asyncio.Queue()
+            monitor.enqueue("repair", "ipv4", "HKG", {"1.1.1.1"})
+            monitor.enqueue("repair", "ipv4", "HKG", {"2.2.2.2"})
+            monitor.enqueue("speed", "ipv4", "HKG")
+            monitor.enqueue("repair", "ipv4", "LAX", {"3.3.3.3"})
+            monitor.running = lax = monitor.pending[("ipv4", "LAX")]
+            monitor.enqueue("repair", "ipv4", "LAX", {"3.3.3.3", "4.4.4.4"})
+            monitor.enqueue("speed", "ipv4", "LAX")
+            self.assertEqual(lax.kind, "repair")  # 执行中的任务不再变更
+            self.assertEqual(monitor.queue.qsize(), 2)
+            with patch.object(Monitor, "invalidate_caches") as invalidate:
+                monitor.finish(lax)
+            invalidate.assert_called_once_with(lax)
+            return monitor
+
+        monitor = asyncio.run(run())
+        self.assertEqual(monitor.queue.qsize(), 3)
+        hkg = monitor.pending[("ipv4", "HKG")]
+        self.assertEqual((hkg.kind, hkg.dead_ips), ("speed", {"1.1.1.1", "2.2.2.2"}))
+        followup = monitor.pending[("ipv4", "LAX")]  # 执行期间的测速请求未丢失
+        self.assertEqual((followup.kind, followup.dead_ips), ("speed", {"4.4.4.4"}))
+        self.assertEqual(monitor.followups, {})
+
+    def test_finish_skips_followup_already_covered(self):
+        args = SimpleNamespace(type=["ipv4"], window=DEFAULT_WINDOW, fail_threshold=DEFAULT_THRESHOLD,
+                               dns_server="127.0.0.1")
+
+        async def run():
+            monitor = Monitor(args)
+            monitor.queue = asyncio.Queue()
+            monitor.enqueue("repair", "ipv4", "HKG", {"1.1.1.1"})
+            monitor.running = job = monitor.pending[("ipv4", "HKG")]
+            monitor.enqueue("repair", "ipv4", "HKG", {"1.1.1.1"})
+            monitor.enqueue("speed", "ipv4", "HKG")
+            job.kind = "speed"  # 候补不足，已执行完整测速
+            with patch.object(Monitor, "invalidate_caches"):
+                monitor.finish(job)
+            return monitor
+
+        monitor = asyncio.run(run())
+        self.assertEqual((monitor.pending, monitor.followups), ({}, {}))
+
+    def test_invalidate_caches_after_maintenance(self):
+        args = SimpleNamespace(type=["ipv4"], window=DEFAULT_WINDOW, fail_threshold=DEFAULT_THRESHOLD,
+                               dns_server="127.0.0.1")
+        monitor = Monitor(args)
+        monitor.resolver.cache_file = None
+        monitor.resolver.cache = {"127.0.0.1:53|hk.example.com|A": (time.time() + 300, ["1.1.1.1"]),
+                                  "127.0.0.1:53|us.example.com|A": (time.time() + 300, ["2.2.2.2"])}
+        snapshot = SimpleNamespace(expire=Mock())
+        with patch.object(ip_checker, "get_proxies", return_value={"hk.example.com": "HKG",
+                                                                   "us.example.com": "LAX"}), \
+                patch.object(ddns, "get_snapshot", return_value=snapshot):
+            monitor.invalidate_caches(Job("repair", "ipv4", "HKG"))
+        self.assertEqual(list(monitor.resolver.cache), ["127.0.0.1:53|us.example.com|A"])
+        snapshot.expire.assert_called_once_with()
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,9 +1,12 @@
-import requests
 import os
 import sys
 import time  # 新增导入time模块
+from pathlib import Path
 from dotenv import load_dotenv
 
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from cfst_lib.cf_client import CloudflareClient, auth_headers  # noqa: E402
+
 load_dotenv()
 
 # 配置信息（建议使用环境变量）
@@ -15,14 +18,11 @@ KEY_NAME = "LINK.txt"  # 你的键名
 # API 端点
 BASE_URL = f"https://api.cloudflare.com/client/v4/accounts/{ACCOUNT_ID}/storage/kv/namespaces/{NAMESPACE_ID}"
 
-headers = {
-    "Authorization": f"Bearer {API_TOKEN}",
-    "Content-Type": "application/json"
-}
+client = CloudflareClient(headers=auth_headers(api_token=API_TOKEN))
 
 def delete_from_kv(mode='line_number', target=0, keyword=None):
     get_url = f"{BASE_URL}/values/{KEY_NAME}"
-    response = requests.get(get_url, headers=headers)
+    response = client.request('GET', get_url)
     
     if not response.ok and response.status_code != 404:
         response.raise_for_status()
@@ -59,7 +59,7 @@ def delete_from_kv(mode='line_number', target=0, keyword=None):
         updated_value = ''
 
     put_url = f"{BASE_URL}/values/{KEY_NAME}"
-    response = requests.put(put_url, headers=headers, data=updated_value)
+    response = client.request('PUT', put_url, data=updated_value)
     
     if response.ok:
         print(f"已成功删除 {mode}.")
@@ -68,7 +68,7 @@ def delete_from_kv(mode='line_number', target=0, keyword=None):
 
 def append_to_kv(content):
     get_url = f"{BASE_URL}/values/{KEY_NAME}"
-    response = requests.get(get_url, headers=headers)
+    response = client.request('GET', get_url)
     
     current_value = ""
     if response.status_code == 200:
@@ -84,7 +84,7 @@ def append_to_kv(content):
     updated_value = current_value + new_content
     
     put_url = f"{BASE_URL}/values/{KEY_NAME}"
-    response = requests.put(put_url, headers=headers, data=updated_value)
+    response = client.request('PUT', put_url, data=updated_value)
     
     if response.ok:
         print("KV更新成功.")
@@ -93,7 +93,7 @@ def append_to_kv(content):
 
 def print_kv():
     get_url = f"{BASE_URL}/values/{KEY_NAME}"
-    response = requests.get(get_url, headers=headers)
+    response = client.request('GET', get_url)
     if response.status_code == 200:
         print("当前KV内容:\n", response.text)
     else: